@@ -0,0 +1,13 @@
+"""
+Benchmarks for the markdown render pipeline.
+
+    python -m bench.run --output results.json
+    python -m bench.run --compare results.json
+
+See bench.run for the options and bench.corpus for the generated
+tiddlers. bench.imports times importing the plugin:
+
+    python -m bench.imports --limit 50
+"""
+
+import mangler
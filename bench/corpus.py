@@ -0,0 +1,169 @@
+"""
+Synthetic corpora for the benchmarks.
+
+Each generator takes a random.Random, so a seed reproduces the same
+text, and returns the text of one tiddler of roughly the given size
+in bytes.
+"""
+
+WORDS = ('lorem ipsum dolor sit amet consectetur adipiscing elit sed do '
+        'eiusmod tempor incididunt ut labore et dolore magna aliqua enim '
+        'ad minim veniam quis nostrud exercitation ullamco laboris nisi '
+        'aliquip ex ea commodo consequat duis aute irure in reprehenderit '
+        'voluptate velit esse cillum fugiat nulla pariatur').split()
+
+
+def words(rand, count):
+    return ' '.join(rand.choice(WORDS) for _ in range(count))
+
+
+def sentence(rand):
+    text = words(rand, rand.randint(6, 16))
+    return text[0].upper() + text[1:] + '.'
+
+
+def camel(rand):
+    return ''.join(rand.choice(WORDS).capitalize()
+            for _ in range(rand.randint(2, 3)))
+
+
+def fill(rand, size, block):
+    """
+    Join blocks made by block(rand) until there are size bytes.
+    """
+    blocks = []
+    total = 0
+    while total < size:
+        text = block(rand)
+        blocks.append(text)
+        total += len(text) + 2
+    return '\n\n'.join(blocks) + '\n'
+
+
+def plain(rand, size=4000):
+    """
+    Headers, paragraphs with emphasis, lists and quotes.
+    """
+    def block(rand):
+        kind = rand.randint(0, 5)
+        if kind == 0:
+            return '%s %s' % ('#' * rand.randint(1, 3), words(rand, 4))
+        if kind == 1:
+            return '\n'.join('* %s' % sentence(rand)
+                    for _ in range(rand.randint(2, 6)))
+        if kind == 2:
+            return '> %s' % sentence(rand)
+        return ' '.join('%s *%s* **%s** `%s`' % (sentence(rand),
+            rand.choice(WORDS), rand.choice(WORDS), rand.choice(WORDS))
+            for _ in range(rand.randint(2, 5)))
+    return fill(rand, size, block)
+
+
+def prose(rand, size=4000):
+    """
+    Paragraphs of sentences with no Markdown in them, as most short
+    tiddlers are.
+    """
+    def block(rand):
+        return ' '.join(sentence(rand) for _ in range(rand.randint(1, 4)))
+    return fill(rand, size, block)
+
+
+def links(rand, size=4000):
+    """
+    Paragraphs dense with CamelCase, freelinks, labeled freelinks and
+    @target links.
+    """
+    def link(rand):
+        kind = rand.randint(0, 4)
+        if kind == 0:
+            return camel(rand)
+        if kind == 1:
+            return '[[%s]]' % words(rand, 2)
+        if kind == 2:
+            return '[[%s|%s]]' % (words(rand, 2), words(rand, 2))
+        if kind == 3:
+            return '[[%s]]@%s' % (words(rand, 2), rand.choice(WORDS))
+        return '%s@[[%s]]' % (camel(rand), words(rand, 2))
+
+    def block(rand):
+        return ' '.join('%s %s' % (words(rand, rand.randint(1, 4)),
+            link(rand)) for _ in range(rand.randint(5, 15))) + '.'
+    return fill(rand, size, block)
+
+
+def urls(rand, size=4000):
+    """
+    Paragraphs with many bare URLs, for the autolink extension.
+    """
+    def url(rand):
+        return '%s://%s.example.com/%s?%s=%s' % (
+                rand.choice(['http', 'https', 'ftp']), rand.choice(WORDS),
+                '/'.join(words(rand, 2).split()), rand.choice(WORDS),
+                rand.randint(0, 999))
+
+    def block(rand):
+        return ' '.join('%s %s' % (words(rand, rand.randint(2, 6)), url(rand))
+                for _ in range(rand.randint(3, 8))) + '.'
+    return fill(rand, size, block)
+
+
+def fenced(rand, size=4000):
+    """
+    Fenced code blocks between short paragraphs.
+    """
+    def block(rand):
+        if rand.randint(0, 1):
+            return sentence(rand)
+        lines = ['    %s = %s(%s)' % (rand.choice(WORDS), rand.choice(WORDS),
+            ', '.join(words(rand, 3).split()))
+            for _ in range(rand.randint(3, 12))]
+        return '```python\ndef %s():\n%s\n```' % (rand.choice(WORDS),
+                '\n'.join(lines))
+    return fill(rand, size, block)
+
+
+def footnotes(rand, size=4000):
+    """
+    Paragraphs with footnote references and their definitions.
+    """
+    notes = []
+
+    def block(rand):
+        note = len(notes) + 1
+        notes.append('[^%s]: %s' % (note, sentence(rand)))
+        return '%s[^%s] %s' % (sentence(rand), note, sentence(rand))
+    text = fill(rand, size * 2 // 3, block)
+    return text + '\n' + '\n'.join(notes) + '\n'
+
+
+ADVERSARIAL = ['[[', ' [[', '|[[x', ' @[[', ' @[[ @w', '[x', 'QUJDRGVm']
+
+
+def adversarial(rand, size=4000):
+    """
+    Long unbroken lines of the runs of brackets, @ and base64 which
+    make backtracking expressions take quadratic time.
+    """
+    def block(rand):
+        piece = rand.choice(ADVERSARIAL)
+        return piece * (size // (4 * len(piece)) + 1)
+    return fill(rand, size, block)
+
+
+def transcluding(titles):
+    """
+    Text which transcludes each of titles.
+    """
+    return '\n\n'.join('{{%s}}' % title for title in titles) + '\n'
+
+
+GENERATORS = {
+    'plain': plain,
+    'prose': prose,
+    'links': links,
+    'urls': urls,
+    'fenced': fenced,
+    'footnotes': footnotes,
+    'adversarial': adversarial,
+}
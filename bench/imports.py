@@ -0,0 +1,116 @@
+"""
+Measure how long importing the plugin takes, and what it imports, in
+fresh processes.
+
+    python -m bench.imports [--runs N] [--preload] [--limit MS]
+            [--output FILE]
+
+Each run starts a new Python, imports tiddlywebplugins.markdown (and
+with --preload then calls render.preload()) and reports the time
+taken and the modules imported. Python-Markdown and most of TiddlyWeb
+should only be imported on the first render; the report says whether
+they were. With --limit the exit status is 1 if the median import
+takes longer than MS milliseconds, so startup can be kept in check.
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+
+from bench.run import percentile
+
+
+# run in each child, printing its measurements as JSON
+CHILD = '''
+import json, sys, time
+try:
+    import mangler
+except ImportError:
+    pass
+before = set(sys.modules)
+start = time.time()
+import tiddlywebplugins.markdown
+imported = time.time() - start
+modules = len(set(sys.modules) - before)
+markdown_imported = 'markdown' in sys.modules
+web_imported = 'tiddlyweb.web.util' in sys.modules
+preloaded = None
+if %(preload)r:
+    start = time.time()
+    from tiddlywebplugins.markdown.render import preload
+    preload()
+    preloaded = time.time() - start
+print(json.dumps({
+    'import_ms': 1000 * imported,
+    'preload_ms': preloaded and 1000 * preloaded,
+    'modules': modules,
+    'markdown_imported': markdown_imported,
+    'tiddlyweb_web_imported': web_imported,
+}))
+'''
+
+
+def run_child(preload):
+    output = subprocess.check_output([sys.executable, '-c',
+        CHILD % {'preload': preload}])
+    return json.loads(output.decode('utf-8'))
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+            description='Benchmark importing the plugin.')
+    parser.add_argument('--runs', type=int, default=20,
+            help='processes to start')
+    parser.add_argument('--preload', action='store_true',
+            help='also time render.preload()')
+    parser.add_argument('--limit', type=float,
+            help='fail if the median import takes longer (ms)')
+    parser.add_argument('--output', help='write JSON results here')
+    options = parser.parse_args(args)
+
+    # the first run may write bytecode, so it is not counted
+    run_child(options.preload)
+    runs = [run_child(options.preload) for _ in range(options.runs)]
+    imports = sorted(run['import_ms'] for run in runs)
+    results = {
+        'meta': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'runs': options.runs,
+        },
+        'import_p50_ms': percentile(imports, 50),
+        'import_min_ms': imports[0],
+        'import_max_ms': imports[-1],
+        'modules': runs[-1]['modules'],
+        'markdown_imported': runs[-1]['markdown_imported'],
+        'tiddlyweb_web_imported': runs[-1]['tiddlyweb_web_imported'],
+    }
+    if options.preload:
+        results['preload_p50_ms'] = percentile(sorted(run['preload_ms']
+            for run in runs), 50)
+    print('import p50 %.1fms (min %.1fms, max %.1fms), %s modules, '
+            'markdown %s' % (results['import_p50_ms'],
+                results['import_min_ms'], results['import_max_ms'],
+                results['modules'], 'imported' if results['markdown_imported']
+                else 'not imported'), file=sys.stderr)
+    if options.preload:
+        print('preload p50 %.1fms' % results['preload_p50_ms'],
+                file=sys.stderr)
+    if options.output:
+        with open(options.output, 'w') as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+    if options.limit is not None and results['import_p50_ms'] > options.limit:
+        print('import p50 is over the limit of %.1fms' % options.limit,
+                file=sys.stderr)
+        sys.exit(1)
+    return results
+
+
+if __name__ == '__main__':
+    main()
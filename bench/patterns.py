@@ -0,0 +1,83 @@
+"""
+Micro-benchmark of the compiled expression registry (see
+tiddlywebplugins.markdown.patterns): the cost of handing expression
+strings to re, or compiling them per pattern, against reusing the
+compiled objects from the registry.
+
+    python -m bench.patterns [--number N]
+
+Each operation is timed both ways, warm and cold. Cold runs empty the
+re module's cache first, as happens over and over in a long-running
+Python 2 process which uses more than 100 expressions.
+"""
+
+from __future__ import print_function
+
+import argparse
+import re
+import timeit
+
+from markdown.inlinepatterns import Pattern
+
+from tiddlywebplugins.markdown.autolink import BARELINK
+from tiddlywebplugins.markdown.links import WIKILINK, WIKILINK_RE
+from tiddlywebplugins.markdown.patterns import SharedPattern, compiled
+from tiddlywebplugins.markdown.transclusion import TRANSCLUDE_RE
+
+
+# the converted HTML of a page with one transclusion in it
+HTML = '\n'.join('<p>Paragraph %s with <a href="/x">a link</a>.</p>' % index
+        for index in range(40)) + '\n<p>{{Some Tiddler}}</p>\n'
+
+
+def operations():
+    """
+    (name, before, after) for each operation timed: before is how it
+    was done without the registry.
+    """
+    transclusions = compiled(TRANSCLUDE_RE)
+    return [
+        ('find transclusions, per render',
+            lambda: list(re.finditer(TRANSCLUDE_RE, HTML)),
+            lambda: list(transclusions.finditer(HTML))),
+        ('check ~WikiLink, per link',
+            lambda: re.match(WIKILINK, '~WikiLink'),
+            lambda: WIKILINK_RE.match('~WikiLink')),
+        ('make link patterns, per engine',
+            lambda: (Pattern(WIKILINK), Pattern(BARELINK)),
+            lambda: (SharedPattern(WIKILINK), SharedPattern(BARELINK))),
+    ]
+
+
+def cold(operation):
+    def run():
+        re.purge()
+        operation()
+    return run
+
+
+def microseconds(operation, number):
+    return min(timeit.repeat(operation, number=number, repeat=3)) \
+            / number * 1e6
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+            description='Benchmark the compiled expression registry.')
+    parser.add_argument('--number', type=int, default=2000,
+            help='calls of each operation per timing')
+    options = parser.parse_args(args)
+
+    print('%-34s %5s %10s %10s %10s' % ('operation', '', 'before us',
+        'after us', 'saved us'))
+    for name, before, after in operations():
+        for label, wrap in [('warm', lambda operation: operation),
+                ('cold', cold)]:
+            old = microseconds(wrap(before), options.number)
+            new = microseconds(wrap(after), options.number)
+            print('%-34s %5s %10.2f %10.2f %10.2f' % (name, label, old, new,
+                old - new))
+
+
+if __name__ == '__main__':
+    main()
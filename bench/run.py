@@ -0,0 +1,333 @@
+"""
+Measure render() throughput, latency and memory for a set of
+scenarios, writing the results as JSON which can be compared between
+runs.
+
+    python -m bench.run [--scenario NAME ...] [--iterations N]
+            [--count N] [--size BYTES] [--seed N] [--backend NAME]
+            [--output FILE] [--compare FILE]
+
+Each scenario runs in a process of its own so that its peak memory
+can be measured. Tiddlers are rendered with a fresh environ each time,
+as for separate requests, and without a render cache. --backend
+renders with another Markdown backend (see
+tiddlywebplugins.markdown.backends), if it is installed.
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from multiprocessing import Process, Queue
+
+try:
+    import resource
+except ImportError:  # not on Windows
+    resource = None
+
+try:
+    import tracemalloc
+except ImportError:  # Python 2
+    tracemalloc = None
+
+import markdown
+
+from tiddlyweb.config import config as tiddlyweb_config
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.store import Store
+
+from tiddlywebplugins.markdown import __version__, backends, render
+from tiddlywebplugins.markdown.cache import MemoryCache
+
+from bench import corpus
+
+
+PERCENTILES = [50, 90, 99]
+
+
+def make_config(store_root=None):
+    config = dict(tiddlyweb_config)
+    config.update({
+        'markdown.wiki_link_base': '',
+        'markdown.render_cache': None,
+        'wikitext.type_render_map': {
+            'text/x-markdown': 'tiddlywebplugins.markdown'
+        },
+        'server_host': {
+            'scheme': 'http',
+            'host': 'example.com',
+            'port': '80'
+        },
+    })
+    if store_root:
+        config['server_store'] = ['text', {'store_root': store_root}]
+    return config
+
+
+def make_environ(config, store=None):
+    return {
+        'tiddlyweb.config': config,
+        'tiddlyweb.usersign': {'name': 'GUEST', 'roles': []},
+        'tiddlyweb.store': store,
+    }
+
+
+def corpus_scenario(generator):
+    """
+    A scenario rendering count generated tiddlers of size bytes.
+    """
+    def setup(options, rand):
+        config = make_config()
+        tiddlers = []
+        for index in range(options.count):
+            tiddler = Tiddler('tiddler%s' % index, 'bench')
+            tiddler.type = 'text/x-markdown'
+            tiddler.text = generator(rand, options.size)
+            tiddlers.append(tiddler)
+        return config, None, tiddlers
+    return setup
+
+
+def edits_scenario(options, rand):
+    """
+    A scenario rendering count successive versions of one tiddler of
+    size bytes, each with one block of the last changed, using a
+    block cache.
+    """
+    config = make_config()
+    config['markdown.block_cache'] = MemoryCache()
+    blocks = corpus.plain(rand, options.size).split('\n\n')
+    tiddlers = []
+    for index in range(options.count):
+        blocks[rand.randrange(len(blocks))] = corpus.sentence(rand)
+        tiddler = Tiddler('edited%s' % index, 'bench')
+        tiddler.type = 'text/x-markdown'
+        tiddler.text = '\n\n'.join(blocks)
+        tiddlers.append(tiddler)
+    return config, None, tiddlers
+
+
+def transclusion_scenario(depth, width):
+    """
+    A scenario rendering tiddlers which transclude width tiddlers,
+    each of which transcludes the next level down, depth levels deep,
+    from a text store.
+    """
+    def setup(options, rand):
+        root = tempfile.mkdtemp()
+        # the text store sets up a root which does not exist yet
+        config = make_config(os.path.join(root, 'store'))
+        store = Store(config['server_store'][0], config['server_store'][1],
+                environ={'tiddlyweb.config': config})
+        store.put(Bag('bench'))
+        for level in range(1, depth + 1):
+            for index in range(width):
+                tiddler = Tiddler('level%s-%s' % (level, index), 'bench')
+                tiddler.type = 'text/x-markdown'
+                text = corpus.plain(rand, options.size // (width * depth) + 1)
+                if level < depth:
+                    text += '\n' + corpus.transcluding(['level%s-%s' % (
+                        level + 1, index)])
+                tiddler.text = text
+                store.put(tiddler)
+        tiddlers = []
+        for index in range(options.count):
+            tiddler = Tiddler('page%s' % index, 'bench')
+            tiddler.type = 'text/x-markdown'
+            tiddler.text = corpus.transcluding(['level1-%s' % index
+                for index in range(width)])
+            tiddlers.append(tiddler)
+        return config, store, tiddlers, root
+    return setup
+
+
+SCENARIOS = {
+    'plain': corpus_scenario(corpus.plain),
+    'prose': corpus_scenario(corpus.prose),
+    'links': corpus_scenario(corpus.links),
+    'urls': corpus_scenario(corpus.urls),
+    'fenced': corpus_scenario(corpus.fenced),
+    'footnotes': corpus_scenario(corpus.footnotes),
+    'adversarial': corpus_scenario(corpus.adversarial),
+    'edits': edits_scenario,
+    'transclusion_deep': transclusion_scenario(depth=10, width=1),
+    'transclusion_wide': transclusion_scenario(depth=1, width=50),
+}
+
+
+def percentile(ordered, percent):
+    """
+    Nearest rank percentile of the sorted list ordered.
+    """
+    index = int(round(percent / 100.0 * len(ordered) + 0.5)) - 1
+    return ordered[max(0, min(index, len(ordered) - 1))]
+
+
+def peak_rss_kb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        peak //= 1024
+    return peak
+
+
+def measure(name, options):
+    """
+    Run scenario name, returning a dict of results.
+    """
+    backends.DEFAULT_BACKEND = options.backend
+    rand = random.Random(options.seed)
+    setup = SCENARIOS[name](options, rand)
+    config, store, tiddlers = setup[:3]
+    root = setup[3] if len(setup) > 3 else None
+    try:
+        # build engines and warm any caches outside the timings
+        for tiddler in tiddlers[:2]:
+            render(tiddler, make_environ(config, store))
+
+        rss_start = peak_rss_kb()
+        latencies = []
+        output_bytes = 0
+        input_bytes = sum(len(tiddler.text) for tiddler in tiddlers)
+        start = time.time()
+        for _ in range(options.iterations):
+            for tiddler in tiddlers:
+                environ = make_environ(config, store)
+                began = time.time()
+                output = render(tiddler, environ)
+                latencies.append(time.time() - began)
+                output_bytes += len(output)
+        elapsed = time.time() - start
+
+        # tracing slows rendering, so it gets a pass of its own
+        traced_peak = None
+        if tracemalloc:
+            tracemalloc.start()
+            for tiddler in tiddlers:
+                render(tiddler, make_environ(config, store))
+            traced_peak = tracemalloc.get_traced_memory()[1] // 1024
+            tracemalloc.stop()
+        rss_peak = peak_rss_kb()
+    finally:
+        if root:
+            shutil.rmtree(root)
+
+    latencies.sort()
+    result = {
+        'renders': len(latencies),
+        'seconds': elapsed,
+        'renders_per_second': len(latencies) / elapsed,
+        'input_bytes_per_second': input_bytes * options.iterations / elapsed,
+        'output_bytes': output_bytes // options.iterations,
+        'mean_ms': 1000 * sum(latencies) / len(latencies),
+        'max_ms': 1000 * latencies[-1],
+        'peak_rss_kb': rss_peak,
+        'rss_growth_kb': (None if rss_peak is None
+            else rss_peak - rss_start),
+        'traced_peak_kb': traced_peak,
+    }
+    for percent in PERCENTILES:
+        result['p%s_ms' % percent] = 1000 * percentile(latencies, percent)
+    return result
+
+
+def measure_into(name, options, queue):
+    try:
+        queue.put(('ok', measure(name, options)))
+    except Exception as exc:
+        queue.put(('error', '%s: %s' % (exc.__class__.__name__, exc)))
+
+
+def run_isolated(name, options):
+    """
+    Run measure() in a child process.
+    """
+    queue = Queue()
+    process = Process(target=measure_into, args=(name, options, queue))
+    process.start()
+    status, result = queue.get()
+    process.join()
+    if status != 'ok':
+        raise RuntimeError('scenario %s failed: %s' % (name, result))
+    return result
+
+
+def compare(old, new):
+    """
+    Print how the scenarios in new differ from those in old.
+    """
+    print('%-20s %12s %12s %8s %10s %10s' % ('scenario', 'old/s', 'new/s',
+        'change', 'old p99', 'new p99'))
+    for name in sorted(new['scenarios']):
+        if name not in old['scenarios']:
+            continue
+        before = old['scenarios'][name]
+        after = new['scenarios'][name]
+        change = (after['renders_per_second'] /
+                before['renders_per_second'] - 1) * 100
+        print('%-20s %12.1f %12.1f %+7.1f%% %9.2fms %9.2fms' % (name,
+            before['renders_per_second'], after['renders_per_second'],
+            change, before['p99_ms'], after['p99_ms']))
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Benchmark render().')
+    parser.add_argument('--scenario', action='append',
+            choices=sorted(SCENARIOS), help='run only these scenarios')
+    parser.add_argument('--iterations', type=int, default=5,
+            help='times to render each tiddler')
+    parser.add_argument('--count', type=int, default=50,
+            help='tiddlers per scenario')
+    parser.add_argument('--size', type=int, default=4000,
+            help='approximate bytes of text per tiddler')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--backend', default=backends.REFERENCE,
+            help='Markdown backend to render with')
+    parser.add_argument('--output', help='write JSON results here')
+    parser.add_argument('--compare', help='JSON results to compare with')
+    options = parser.parse_args(args)
+
+    results = {
+        'meta': {
+            'plugin_version': __version__,
+            'markdown_version': markdown.version,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'iterations': options.iterations,
+            'count': options.count,
+            'size': options.size,
+            'seed': options.seed,
+            'backend': options.backend,
+        },
+        'scenarios': {},
+    }
+    for name in options.scenario or sorted(SCENARIOS):
+        result = run_isolated(name, options)
+        results['scenarios'][name] = result
+        print('%-20s %8.1f renders/s  p50 %6.2fms  p99 %6.2fms  '
+                'peak %s KB' % (name, result['renders_per_second'],
+                    result['p50_ms'], result['p99_ms'],
+                    result['peak_rss_kb']), file=sys.stderr)
+
+    if options.output:
+        with open(options.output, 'w') as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+    if options.compare:
+        with open(options.compare) as previous:
+            compare(json.load(previous), results)
+    return results
+
+
+if __name__ == '__main__':
+    main()
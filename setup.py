@@ -16,7 +16,7 @@ setup(
     long_description=open(os.path.join(os.path.dirname(__file__), 'README')).read(),
     author = AUTHOR,
     url = 'http://pypi.python.org/pypi/%s' % NAME,
-    packages = find_packages(exclude=['test']),
+    packages = find_packages(exclude=['test', 'bench', 'bench.*']),
     author_email = AUTHOR_EMAIL,
     platforms = 'Posix; MacOS X; Windows',
     install_requires = ['tiddlyweb', 'Markdown'],
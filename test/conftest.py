@@ -0,0 +1,23 @@
+"""
+Run the tests against another Markdown backend (see
+tiddlywebplugins.markdown.backends) with:
+
+    py.test --markdown-backend=mistune
+
+Renders whose config does not name a backend then use that one, if it
+is installed. Tests of what only Python-Markdown does, such as header
+ids, fail with other backends.
+"""
+
+from tiddlywebplugins.markdown import backends
+
+
+def pytest_addoption(parser):
+    parser.addoption('--markdown-backend', default=None,
+            help='Markdown backend to render with by default')
+
+
+def pytest_configure(config):
+    name = config.getoption('markdown_backend')
+    if name:
+        backends.DEFAULT_BACKEND = name
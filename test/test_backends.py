@@ -0,0 +1,166 @@
+"""
+Test that each Markdown backend which is installed renders the
+TiddlyWeb features as Python-Markdown does.
+"""
+
+import shutil
+import pytest
+
+from tiddlywebplugins.markdown import backends, render
+from tiddlywebplugins.markdown.render import EngineSettings
+from tiddlywebplugins.markdown.stream import render_stream
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.config import config
+
+from tiddlywebplugins.utils import get_store
+
+
+BACKENDS = [backends.REFERENCE] + sorted(backends.BACKENDS)
+
+# text, what the output must contain, what it must not
+CASES = [
+    ('This is WikiLink',
+        ['This is <a class="wikilink" href="WikiLink">WikiLink</a>'], []),
+    ('This is not ~WikiLink', ['This is not WikiLink'], ['href']),
+    ('(HtmlJavascript in parens)',
+        ['(<a class="wikilink" href="HtmlJavascript">HtmlJavascript</a>'
+            ' in parens)'], []),
+    ('see [[some page]] and [[label|other page]]',
+        ['<a class="wikilink" href="some%20page">some page</a>',
+            '<a class="wikilink" href="other%20page">label</a>'], []),
+    ('[[this & that]]',
+        ['<a class="wikilink" href="this%20%26%20that">this &amp; that</a>'],
+        []),
+    ('ask @cdent', ['ask <a href="http://cdent.example.com/">@cdent</a>'],
+        []),
+    ('WikiLink@cdent and [[Free Link]]@cdent',
+        ['<a href="http://cdent.example.com/WikiLink">WikiLink</a>',
+            '<a href="http://cdent.example.com/Free%20Link">Free Link</a>'],
+        []),
+    ('see http://example.com/x?a=1&b=2 now',
+        ['see <a href="http://example.com/x?a=1&amp;b=2">'
+            'http://example.com/x?a=1&amp;b=2</a> now'], []),
+    ('`CodeLink` [label](http://example.org/CamelCase)',
+        ['<code>CodeLink</code>',
+            '<a href="http://example.org/CamelCase">label</a>'],
+        ['wikilink']),
+    ('```\nWikiLink http://example.com/\n```',
+        ['WikiLink http://example.com/\n</code></pre>'], ['href']),
+    ('<script>alert(WikiLink)</script>', [], ['<script>']),
+    ('{{missing}}', ['<p>{{missing}}</p>'], []),
+]
+
+
+def interlinker(environ, target):
+    return 'http://%s.example.com/' % target
+
+
+def setup_module(module):
+    try:
+        shutil.rmtree('store')
+    except:
+        pass
+    store = get_store(config)
+    module.store = store
+
+    store.put(Bag('things'))
+    for title, text in [
+            ('page', 'page WikiLink\n\n{{other}}\n\nthe end'),
+            ('other', 'other [[link]] http://example.com/')]:
+        tiddler = Tiddler(title, 'things')
+        tiddler.text = text
+        tiddler.type = 'text/x-markdown'
+        store.put(tiddler)
+
+
+def make_environ(name, **extra):
+    config = {
+        'markdown.wiki_link_base': '',
+        'markdown.backend': name,
+        'markdown.interlinker': interlinker,
+        'wikitext.type_render_map': {
+            'text/x-markdown': 'tiddlywebplugins.markdown'
+        },
+        'server_host': {
+            'scheme': 'http',
+            'host': 'example.com',
+            'port': '80'
+        },
+    }
+    config.update(extra)
+    return {
+        'tiddlyweb.config': config,
+        'tiddlyweb.usersign': {'name': 'GUEST', 'roles': []},
+        'tiddlyweb.store': store,
+    }
+
+
+def installed(name):
+    if name not in backends.available():
+        pytest.skip('%s is not installed' % name)
+
+
+@pytest.mark.parametrize('name', BACKENDS)
+def test_features(name):
+    installed(name)
+    for text, present, absent in CASES:
+        tiddler = Tiddler('case', 'things')
+        tiddler.text = text
+        output = render(tiddler, make_environ(name))
+        for html in present:
+            assert html in output, (text, output)
+        for html in absent:
+            assert html not in output, (text, output)
+
+
+@pytest.mark.parametrize('name', BACKENDS)
+def test_transclusion(name):
+    installed(name)
+    environ = make_environ(name)
+    page = store.get(Tiddler('page', 'things'))
+    output = render(page, environ)
+    assert '<a class="wikilink" href="WikiLink">WikiLink</a>' in output
+    assert ('<article id="t-other" class="transclusion" '
+            'data-uri="http://example.com/bags/things/tiddlers/other" '
+            'data-title="other" data-bag="things">') in output
+    assert '<a class="wikilink" href="link">link</a>' in output
+    assert ('<a href="http://example.com/">http://example.com/</a>'
+            in output)
+    assert output.endswith('<p>the end</p>')
+
+    assert ''.join(render_stream(page, make_environ(name))) == output
+
+
+def test_same_as_reference():
+    name = 'python-markdown-postpass'
+    for text, _, _ in CASES:
+        tiddler = Tiddler('case', 'things')
+        tiddler.text = text
+        assert (render(tiddler, make_environ(name))
+                == render(tiddler, make_environ(backends.REFERENCE)))
+    page = store.get(Tiddler('page', 'things'))
+    assert (render(page, make_environ(name))
+            == render(page, make_environ(backends.REFERENCE)))
+
+
+def test_fallback():
+    assert backends.backend_for('python-markdown', 'escape') is None
+    assert backends.backend_for('no-such-backend', 'escape') is None
+    # cmark-gfm cannot escape HTML
+    assert backends.backend_for('cmarkgfm', 'escape') is None
+    backend = backends.backend_for(['no-such-backend',
+        'python-markdown-postpass'], 'escape')
+    assert backend.name == 'python-markdown-postpass'
+    assert backends.backend_for(['no-such-backend',
+        'python-markdown-postpass'], 'escape') is backend
+
+    config = make_environ('python-markdown-postpass',
+            **{'markdown.block_cache': {}})['tiddlyweb.config']
+    settings = EngineSettings(config)
+    assert settings.backend is backend
+    assert settings.block_cache is None
+    config['markdown.extensions'] = (['abbr'], {})
+    settings = EngineSettings(config)
+    assert settings.backend is None
+    assert settings.backend_name == backends.REFERENCE
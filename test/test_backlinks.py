@@ -0,0 +1,164 @@
+"""
+Test collecting links while rendering and the backlink index.
+"""
+
+import shutil
+import tempfile
+
+from tiddlywebplugins.markdown import backlinks
+from tiddlywebplugins.markdown.backlinks import BacklinkIndex, Outlinks
+from tiddlywebplugins.markdown.cache import MemoryCache
+from tiddlywebplugins.markdown.render import render_with_links
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.config import config
+
+from tiddlywebplugins.utils import get_store
+
+
+TEXT = """
+# Links
+
+See [[some page]], [[a label|other page]] and WikiLink, not ~NotLink.
+Elsewhere [[far page]]@[[far bag]], FarLink@place and @place.
+
+{{included}}
+
+{{remote}}@place
+"""
+
+
+SETTINGS = {
+    'markdown.wiki_link_base': '',
+    'markdown.interlinker': lambda environ, target: '/' + target,
+    'wikitext.type_render_map': {
+        'text/x-markdown': 'tiddlywebplugins.markdown'
+    },
+}
+
+
+def setup_module(module):
+    try:
+        shutil.rmtree('store')
+    except:
+        pass
+    # the hooks render with the config of the store
+    config.update(SETTINGS)
+    config['markdown.backlink_index'] = BacklinkIndex()
+    backlinks.init(config)
+    store = get_store(config)
+    module.store = store
+
+    store.put(Bag('things'))
+    store.put(Bag('place'))
+    tiddler = Tiddler('included', 'things')
+    tiddler.type = 'text/x-markdown'
+    tiddler.text = 'inside [[inner page]]'
+    store.put(tiddler)
+
+
+def teardown_module(module):
+    for key in list(SETTINGS) + ['markdown.backlink_index']:
+        del config[key]
+
+
+def make_environ(**extra):
+    tiddlyweb_config = dict(config)
+    tiddlyweb_config.update(extra)
+    return {
+        'tiddlyweb.config': tiddlyweb_config,
+        'tiddlyweb.store': store,
+        'tiddlyweb.usersign': {'name': 'GUEST', 'roles': []},
+    }
+
+
+def expected_links():
+    outlinks = Outlinks()
+    outlinks.titles.update(['some page', 'other page', 'WikiLink'])
+    outlinks.targets.update([('far bag', 'far page'), ('place', 'FarLink'),
+        ('place', '')])
+    outlinks.transclusions.update([('', 'included'), ('place', 'remote')])
+    return outlinks
+
+
+def make_tiddler(title='page', text=TEXT):
+    tiddler = Tiddler(title, 'things')
+    tiddler.type = 'text/x-markdown'
+    tiddler.text = text
+    return tiddler
+
+
+def test_render_with_links():
+    environ = make_environ()
+    output, outlinks = render_with_links(make_tiddler(), environ)
+    assert 'inside <a class="wikilink" href="inner%20page">' in output
+    # the links of the transcluded tiddler are its own
+    assert outlinks == expected_links()
+    assert 'markdown.outlinks' not in environ
+
+    output, outlinks = render_with_links(make_tiddler(text='Just text.'),
+            make_environ())
+    assert output == '<p>Just text.</p>'
+    assert len(outlinks) == 0
+
+
+def test_links_with_caches():
+    environ = make_environ(**{'markdown.render_cache': MemoryCache(),
+        'markdown.block_cache': MemoryCache()})
+    first = render_with_links(make_tiddler(), environ)
+    second = render_with_links(make_tiddler(), environ)
+    assert first == second
+    assert second[1] == expected_links()
+
+
+def test_outlinks_of():
+    outlinks = backlinks.outlinks_of(make_tiddler(), make_environ())
+    assert outlinks == expected_links()
+
+
+def test_index_hooks():
+    index = config['markdown.backlink_index']
+    store.put(make_tiddler())
+    assert index.outlinks('things', 'page') == expected_links()
+    assert index.backlinks('some page') == [('things', 'page')]
+    assert index.backlinks('included') == [('things', 'page')]
+    assert index.backlinks('far page', 'far bag') == [('things', 'page')]
+    assert index.backlinks('far page') == []
+    assert index.backlinks('inner page') == [('things', 'included')]
+
+    store.put(make_tiddler('second', 'more of [[some page]]'))
+    assert index.backlinks('some page') == [('things', 'page'),
+            ('things', 'second')]
+
+    store.put(make_tiddler(text='now only WikiLink'))
+    assert index.backlinks('some page') == [('things', 'second')]
+    assert index.backlinks('WikiLink') == [('things', 'page')]
+
+    store.delete(make_tiddler('second'))
+    assert index.backlinks('some page') == []
+    assert index.outlinks('things', 'second') is None
+
+    store.delete(Bag('things'))
+    assert index.backlinks('WikiLink') == []
+    assert index.backlinks('inner page') == []
+
+
+def test_index_files():
+    root = tempfile.mkdtemp()
+    try:
+        first = BacklinkIndex(root)
+        first.update('bag', 'one', expected_links())
+        # another process, sharing the files
+        second = BacklinkIndex(root)
+        assert second.outlinks('bag', 'one') == expected_links()
+        assert second.backlinks('remote', 'place') == [('bag', 'one')]
+
+        second.update('bag', 'two', expected_links())
+        assert first.backlinks('WikiLink') == [('bag', 'one'), ('bag', 'two')]
+        first.remove('bag', 'one')
+        assert second.backlinks('WikiLink') == [('bag', 'two')]
+        second.remove_bag('bag')
+        assert first.backlinks('WikiLink') == []
+        assert first.outlinks('bag', 'two') is None
+    finally:
+        shutil.rmtree(root)
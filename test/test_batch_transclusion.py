@@ -0,0 +1,116 @@
+"""
+Test that transclusions are collected and loaded in one batch.
+"""
+
+import shutil
+
+from tiddlywebplugins.markdown import render
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.recipe import Recipe
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.config import config
+from tiddlyweb.store import HOOKS
+
+from tiddlywebplugins.utils import get_store
+
+
+BULK_CALLS = []
+HOOKED = []
+
+
+def setup_module(module):
+    try:
+        shutil.rmtree('store')
+    except:
+        pass
+    store = get_store(config)
+    module.store = store
+
+    store.put(Bag('things'))
+    recipe = Recipe('site')
+    recipe.set_recipe([('things', '')])
+    store.put(recipe)
+    for title in ['alpha', 'beta', 'gamma']:
+        tiddler = Tiddler(title, 'things')
+        tiddler.text = '%s _text_' % title
+        tiddler.type = 'text/x-markdown'
+        store.put(tiddler)
+
+
+def bulk_get(tiddlers):
+    BULK_CALLS.append(sorted(tiddler.title for tiddler in tiddlers))
+    for tiddler in tiddlers:
+        try:
+            yield store.storage.tiddler_get(tiddler)
+        except Exception:
+            pass
+
+
+def hook(store, tiddler):
+    HOOKED.append(tiddler.title)
+
+
+def make_environ():
+    return {
+        'tiddlyweb.config': {
+            'markdown.wiki_link_base': '',
+            'wikitext.type_render_map': {
+                'text/x-markdown': 'tiddlywebplugins.markdown'
+            },
+            'server_host': {
+                'scheme': 'http',
+                'host': 'example.com',
+                'port': '80'
+            }
+        },
+        'tiddlyweb.usersign': {'name': 'GUEST', 'roles': []},
+        'tiddlyweb.store': store,
+    }
+
+
+def page():
+    tiddler = Tiddler('page')
+    tiddler.recipe = 'site'
+    tiddler.text = '''
+start
+
+{{alpha}}
+
+{{beta}}
+
+middle
+
+{{alpha}}
+
+{{missing}}
+
+{{gamma}}@nowhere
+
+{{gamma}}
+'''
+    return tiddler
+
+
+def test_batch_matches_serial():
+    serial = render(page(), make_environ())
+
+    store.storage.tiddlers_get = bulk_get
+    HOOKS['tiddler']['get'].append(hook)
+    try:
+        batched = render(page(), make_environ())
+    finally:
+        del store.storage.tiddlers_get
+        HOOKS['tiddler']['get'].remove(hook)
+
+    assert batched == serial
+    assert batched.count('alpha <em>text</em>') == 2
+    assert 'beta <em>text</em>' in batched
+    assert 'gamma <em>text</em>' in batched
+    assert '{{missing}}' in batched
+    assert '{{gamma}}@nowhere' in batched
+
+    # One call for the page; the interior tiddlers transclude nothing.
+    # Without a target resolver, gamma@nowhere is looked for in NoSuchBag.
+    assert BULK_CALLS == [['alpha', 'beta', 'gamma', 'gamma']]
+    assert sorted(set(HOOKED) & set(['alpha', 'beta', 'gamma'])) == [
+            'alpha', 'beta', 'gamma']
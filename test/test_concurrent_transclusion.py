@@ -0,0 +1,155 @@
+"""
+Test that transclusions can be rendered on a pool of threads
+without changing the output.
+"""
+
+import os
+import shutil
+import signal
+import threading
+import time
+
+from tiddlywebplugins.markdown import render as render_markdown
+from tiddlywebplugins.markdown.render import render_with_dependencies
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.recipe import Recipe
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.config import config
+
+from tiddlywebplugins.utils import get_store
+
+
+THREADS = set()
+
+
+def render(tiddler, environ):
+    """
+    A slow renderer which notes the thread it runs in.
+    """
+    THREADS.add(threading.current_thread().name)
+    time.sleep(0.01)
+    return render_markdown(tiddler, environ)
+
+
+def setup_module(module):
+    try:
+        shutil.rmtree('store')
+    except:
+        pass
+    store = get_store(config)
+    module.store = store
+
+    store.put(Bag('parts'))
+    recipe = Recipe('site')
+    recipe.set_recipe([('parts', '')])
+    store.put(recipe)
+
+    for index in range(6):
+        tiddler = Tiddler('part%s' % index, 'parts')
+        tiddler.text = 'part %s _text_\n\n{{part%s}}\n\n{{loop}}\n' % (
+                index, (index + 1) % 6)
+        tiddler.type = 'text/x-slow'
+        store.put(tiddler)
+    for title, text in [('zeta', 'zeta zzzzzzzzzzzzzzz'),
+            ('alpha', 'alpha aaaaaaaaaaaaaa'), ('mid', 'mid mmmmmmmmmmmmmmmm'),
+            ('outer', '{{inner}}\n\nouter'), ('inner', 'inner iiiiiiiiiiiiii')]:
+        tiddler = Tiddler(title, 'parts')
+        tiddler.text = text
+        tiddler.type = 'text/x-markdown'
+        store.put(tiddler)
+    loop = Tiddler('loop', 'parts')
+    loop.text = 'loop\n\n{{loop}}\n'
+    loop.type = 'text/x-slow'
+    store.put(loop)
+
+
+def make_environ(workers=None):
+    environ = {
+        'tiddlyweb.config': {
+            'markdown.wiki_link_base': '',
+            'wikitext.type_render_map': {
+                'text/x-markdown': 'tiddlywebplugins.markdown',
+                'text/x-slow': 'test.test_concurrent_transclusion',
+            },
+            'server_host': {
+                'scheme': 'http',
+                'host': 'example.com',
+                'port': '80'
+            }
+        },
+        'tiddlyweb.usersign': {'name': 'GUEST', 'roles': []},
+        'tiddlyweb.store': store,
+    }
+    if workers:
+        environ['tiddlyweb.config']['markdown.transclusion_workers'] = workers
+    return environ
+
+
+def page():
+    tiddler = Tiddler('page')
+    tiddler.recipe = 'site'
+    tiddler.text = '\n\n'.join('{{part%s}}' % index for index in range(6))
+    tiddler.text += '\n\n{{part0}}\n\n{{missing}}\n'
+    return tiddler
+
+
+def test_concurrent_matches_serial():
+    THREADS.clear()
+    serial, serial_dependencies = render_with_dependencies(page(),
+            make_environ())
+    assert THREADS == set([threading.current_thread().name])
+
+    THREADS.clear()
+    concurrent, dependencies = render_with_dependencies(page(),
+            make_environ(4))
+    assert len(THREADS) > 1
+
+    assert concurrent == serial
+    assert dependencies == serial_dependencies
+    assert concurrent.count('part 3 <em>text</em>') == 7
+    assert '{{missing}}' in concurrent
+
+
+def test_one_worker_is_serial():
+    THREADS.clear()
+    render_markdown(page(), make_environ(1))
+    assert THREADS == set([threading.current_thread().name])
+
+
+def test_byte_budget_matches_serial():
+    tiddler = Tiddler('budgeted')
+    tiddler.recipe = 'site'
+    for text, budget, included in [
+            ('{{zeta}}\n\n{{alpha}}\n\n{{mid}}', 50, ['zeta', 'alpha']),
+            ('{{outer}}\n\n{{zeta}}\n\n{{alpha}}', 60,
+                ['outer', 'inner', 'zeta'])]:
+        tiddler.text = text
+        outputs = []
+        for workers in [None, 4]:
+            environ = make_environ(workers)
+            environ['tiddlyweb.config']['markdown.max_transcluded_bytes'] = \
+                    budget
+            outputs.append(render_markdown(tiddler, environ))
+        serial, concurrent = outputs
+        assert concurrent == serial
+        for title in ['zeta', 'alpha', 'mid', 'outer', 'inner']:
+            assert (('data-title="%s"' % title) in serial) == (
+                    title in included)
+
+
+def test_after_fork():
+    if not hasattr(os, 'fork'):
+        return
+    # the pool is made in this process, as by a warmup before forking
+    serial = render_markdown(page(), make_environ())
+    assert render_markdown(page(), make_environ(4)) == serial
+    pid = os.fork()
+    if pid == 0:
+        status = 1
+        try:
+            signal.alarm(10)
+            if render_markdown(page(), make_environ(4)) == serial:
+                status = 0
+        finally:
+            os._exit(status)
+    assert os.waitpid(pid, 0)[1] == 0
@@ -0,0 +1,171 @@
+"""
+Test recording of transclusion dependencies and the cache
+invalidation based on them.
+"""
+
+import shutil
+import tempfile
+
+from tiddlywebplugins.markdown import render
+from tiddlywebplugins.markdown.cache import MemoryCache, DiskCache
+from tiddlywebplugins.markdown.dependencies import Dependencies
+from tiddlywebplugins.markdown.render import render_with_dependencies
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.recipe import Recipe
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.config import config
+
+from tiddlywebplugins.utils import get_store
+
+
+def setup_module(module):
+    try:
+        shutil.rmtree('store')
+    except:
+        pass
+    store = get_store(config)
+    module.store = store
+
+    store.put(Bag('lower'))
+    store.put(Bag('upper'))
+    recipe = Recipe('stack')
+    recipe.set_recipe([('lower', ''), ('upper', '')])
+    store.put(recipe)
+
+    put_tiddler('inner', 'lower', 'I am _inner_')
+    put_tiddler('middle', 'lower', 'middle\n\n{{inner}}\n')
+
+
+def put_tiddler(title, bag, text):
+    tiddler = Tiddler(title, bag)
+    tiddler.text = text
+    tiddler.type = 'text/x-markdown'
+    store.put(tiddler)
+    return store.get(Tiddler(title, bag))
+
+
+def make_environ(cache=None):
+    """
+    A new environ, as for a new request.
+    """
+    return {
+        'tiddlyweb.config': {
+            'markdown.wiki_link_base': '',
+            'markdown.render_cache': cache,
+            'wikitext.type_render_map': {
+                'text/x-markdown': 'tiddlywebplugins.markdown'
+            },
+            'server_host': {
+                'scheme': 'http',
+                'host': 'example.com',
+                'port': '80'
+            }
+        },
+        'tiddlyweb.usersign': {'name': 'GUEST', 'roles': []},
+        'tiddlyweb.store': store,
+    }
+
+
+def outer():
+    tiddler = Tiddler('outer')
+    tiddler.recipe = 'stack'
+    tiddler.text = 'outer\n\n{{middle}}\n\n{{missing}}\n'
+    return tiddler
+
+
+def test_recorded():
+    middle = store.get(Tiddler('middle', 'lower'))
+    inner = store.get(Tiddler('inner', 'lower'))
+
+    output, dependencies = render_with_dependencies(outer(), make_environ())
+
+    assert 'I am <em>inner</em>' in output
+    assert dependencies.tiddlers == {
+        ('lower', 'middle'): middle.revision,
+        ('lower', 'inner'): inner.revision,
+    }
+    assert dependencies.resolutions == {
+        ('', 'stack', '', 'middle'): 'lower',
+        ('', 'stack', '', 'missing'): None,
+        ('', '', 'lower', 'inner'): 'lower',
+    }
+    assert set(dependencies.recipes) == set(['stack'])
+    assert set(dependencies.bags) == set(['lower'])
+    assert dependencies.current(make_environ())
+
+    copy = Dependencies.from_dict(dependencies.to_dict())
+    assert copy == dependencies
+
+
+def test_cached_until_changed():
+    cache = MemoryCache()
+
+    first = render(outer(), make_environ(cache))
+    assert render(outer(), make_environ(cache)) == first
+    assert cache.stats()['stale'] == 0
+    hits = cache.stats()['hits']
+
+    put_tiddler('inner', 'lower', 'I am _changed_')
+    second = render(outer(), make_environ(cache))
+    # both outer and middle transclude inner
+    assert cache.stats()['stale'] == 2
+    assert cache.stats()['hits'] == hits
+    assert 'I am <em>changed</em>' in second
+
+    assert render(outer(), make_environ(cache)) == second
+    assert cache.stats()['hits'] == hits + 1
+
+
+def test_resolution_changes():
+    cache = MemoryCache()
+
+    first = render(outer(), make_environ(cache))
+    assert '{{missing}}' in first
+
+    put_tiddler('missing', 'lower', 'now here')
+    second = render(outer(), make_environ(cache))
+    assert 'now here' in second
+
+    # a tiddler in a later bag in the recipe takes precedence
+    put_tiddler('middle', 'upper', 'upper middle')
+    third = render(outer(), make_environ(cache))
+    assert 'upper middle' in third
+    assert '<em>changed</em>' not in third
+    assert cache.stats()['stale'] == 2
+
+    store.delete(Tiddler('middle', 'upper'))
+    store.delete(Tiddler('missing', 'lower'))
+
+
+def test_policy_changes():
+    cache = MemoryCache()
+
+    first = render(outer(), make_environ(cache))
+    assert 'middle' in first
+    assert render(outer(), make_environ(cache)) == first
+
+    bag = store.get(Bag('lower'))
+    bag.policy.read = ['cdent']
+    store.put(bag)
+    second = render(outer(), make_environ(cache))
+    assert '{{middle}}' in second
+    assert cache.stats()['stale'] == 1
+
+    bag.policy.read = []
+    store.put(bag)
+
+
+def test_disk_cache():
+    root = tempfile.mkdtemp()
+    try:
+        first = render(outer(), make_environ(DiskCache(root)))
+
+        cache = DiskCache(root)
+        assert render(outer(), make_environ(cache)) == first
+        assert cache.stats()['hits'] == 1
+
+        put_tiddler('inner', 'lower', 'I am _inner_ again')
+        assert render(outer(), make_environ(cache)) != first
+        assert cache.stats()['stale'] == 2
+    finally:
+        shutil.rmtree(root)
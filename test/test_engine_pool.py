@@ -0,0 +1,99 @@
+"""
+Test that Markdown instances are pooled and reused safely.
+"""
+
+import markdown
+
+from tiddlywebplugins.markdown import render
+from tiddlywebplugins.markdown.render import ENGINES, EngineSettings
+from tiddlyweb.model.tiddler import Tiddler
+
+
+SAMPLE = """
+Oh Now
+======
+
+We always talked[^1] about WikiLink and [[free link]].
+
+Oh Now
+======
+
+[^1]: Asynch, of course.
+"""
+
+
+def setup_module(module):
+    ENGINES.clear()
+
+
+def test_engine_reused():
+    config = {'markdown.wiki_link_base': ''}
+    environ = {'tiddlyweb.config': config}
+    settings = EngineSettings(config)
+    tiddler = Tiddler('Foo')
+    tiddler.text = SAMPLE
+
+    assert ENGINES.idle_count(settings) == 0
+    first = render(tiddler, environ)
+    assert ENGINES.idle_count(settings) == 1
+    engine = ENGINES.acquire(settings)
+    assert engine.environ is None
+    assert engine.tiddler is None
+    ENGINES.release(settings, engine)
+
+    second = render(tiddler, environ)
+    assert ENGINES.idle_count(settings) == 1
+    assert first == second
+
+
+def test_state_reset():
+    environ = {'tiddlyweb.config': {'markdown.wiki_link_base': ''}}
+    tiddler = Tiddler('Foo')
+    tiddler.text = SAMPLE
+
+    for _ in range(3):
+        output = render(tiddler, environ)
+        assert '<h1 id="oh-now">Oh Now</h1>' in output
+        assert '<h1 id="oh-now_1">Oh Now</h1>' in output
+        assert output.count('<li id="fn-1">') == 1
+
+
+def test_same_as_fresh_markdown():
+    environ = {'tiddlyweb.config': {}}
+    tiddler = Tiddler('Foo')
+    tiddler.text = SAMPLE
+
+    render(tiddler, environ)
+    expected = markdown.markdown(SAMPLE,
+            extensions=['headerid', 'footnotes', 'fenced_code', 'def_list',
+                'tiddlywebplugins.markdown.autolink'],
+            output_format='html5', safe_mode='escape')
+    assert render(tiddler, environ) == expected
+
+
+def test_config_keys():
+    plain = EngineSettings({})
+    linked = EngineSettings({'markdown.wiki_link_base': ''})
+    removing = EngineSettings({'markdown.wiki_link_base': '',
+        'markdown.safe_mode': 'remove'})
+    based = EngineSettings({'markdown.wiki_link_base': '/wiki/'})
+    assert len(set([plain.key, linked.key, removing.key, based.key])) == 4
+    assert EngineSettings({'markdown.safe_mode': 'monkey'}).key == plain.key
+
+
+def test_late_binding():
+    def interlinker(environ, target):
+        return 'http://%s.example.com/' % environ['test.prefix'] + target
+
+    config = {'markdown.wiki_link_base': '',
+            'markdown.interlinker': interlinker}
+    tiddler = Tiddler('Foo')
+    tiddler.text = 'Visit @cdent'
+
+    output = render(tiddler, {'tiddlyweb.config': config,
+        'test.prefix': 'one'})
+    assert 'href="http://one.example.com/cdent"' in output
+
+    output = render(tiddler, {'tiddlyweb.config': config,
+        'test.prefix': 'two'})
+    assert 'href="http://two.example.com/cdent"' in output
@@ -0,0 +1,48 @@
+"""
+Test that importing the plugin leaves Python-Markdown to the first
+render, and preloading the modules which are otherwise imported on
+first use.
+"""
+
+import json
+import os
+import subprocess
+import sys
+
+from tiddlywebplugins.markdown.render import (DEFERRED_MODULES,
+        extension_module, preload)
+
+
+# run in a fresh interpreter, printing whether markdown was imported
+CHILD = '''
+import json, sys
+try:
+    import mangler
+except ImportError:
+    pass
+import tiddlywebplugins.markdown
+print(json.dumps('markdown' in sys.modules))
+'''
+
+
+def test_import_defers_markdown():
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.check_output([sys.executable, '-c', CHILD],
+            cwd=root)
+    assert json.loads(output.decode('utf-8')) is False
+
+
+def test_extension_module():
+    assert extension_module('abbr') == 'markdown.extensions.abbr'
+    assert (extension_module('markdown.extensions.abbr:AbbrExtension')
+            == 'markdown.extensions.abbr')
+    assert (extension_module('tiddlywebplugins.markdown.links')
+            == 'tiddlywebplugins.markdown.links')
+
+
+def test_preload():
+    preload({'markdown.extensions': (['abbr', 'markdown.extensions.toc'],
+        {})})
+    for name in DEFERRED_MODULES + ['markdown.extensions.abbr',
+            'markdown.extensions.toc', 'markdown.extensions.def_list']:
+        assert name in sys.modules
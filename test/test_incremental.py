@@ -0,0 +1,134 @@
+"""
+Test incremental rendering with a block cache.
+"""
+
+from tiddlywebplugins.markdown import render
+from tiddlywebplugins.markdown.cache import MemoryCache
+from tiddlywebplugins.markdown.incremental import block_groups
+from tiddlywebplugins.markdown.render import EngineSettings
+from tiddlyweb.model.tiddler import Tiddler
+
+
+TEXT = """# Title
+
+Some *text* with a CamelCase link.
+
+- one
+- two
+
+- three
+
+    code in a list
+
+Term
+:   definition
+
+Term two
+:   another
+
+> quoted
+
+> and more
+
+    code
+
+    more code
+
+```
+fenced
+
+code
+```
+
+## Title
+
+The end.
+"""
+
+
+def make_environ(cache=None, **extra):
+    config = {
+        'markdown.wiki_link_base': '',
+        'markdown.block_cache': cache,
+    }
+    config.update(extra)
+    return {'tiddlyweb.config': config}
+
+
+def page(text):
+    tiddler = Tiddler('page', 'things')
+    tiddler.text = text
+    return tiddler
+
+
+def test_block_groups():
+    groups = block_groups(TEXT)
+    assert groups[0] == '# Title\n'
+    assert groups[1] == 'Some *text* with a CamelCase link.\n'
+    assert groups[2].startswith('- one\n- two\n\n- three\n\n    code')
+    assert groups[3].startswith('Term\n:   definition\n\nTerm two\n')
+    assert groups[4] == '> quoted\n\n> and more\n'
+    assert groups[5] == '    code\n\n    more code\n'
+    assert groups[6] == '```\nfenced\n\ncode\n```\n\n## Title\n'
+    assert groups[7:] == ['The end.\n']
+    assert '\n'.join(groups) == TEXT
+
+    assert block_groups('a\r\n\r\nb') == ['a\n', 'b']
+
+
+def test_whole_document():
+    for text in ['a\n\nb[^1]\n\n[^1]: note', 'a\n\n[b]\n\n[b]: /b',
+            'a\n\n<div>\n\nb\n\n</div>']:
+        assert block_groups(text) is None
+        cache = MemoryCache()
+        output = render(page(text), make_environ(cache))
+        assert output == render(page(text), make_environ())
+        assert cache.stats()['entries'] == 0
+
+
+def test_same_output():
+    cache = MemoryCache()
+    assert (render(page(TEXT), make_environ(cache))
+            == render(page(TEXT), make_environ()))
+    assert cache.stats()['entries'] == 8
+
+    edited = TEXT.replace('quoted', 'quoted again')
+    assert (render(page(edited), make_environ(cache))
+            == render(page(edited), make_environ()))
+
+
+def test_only_changed_blocks():
+    cache = MemoryCache()
+    text = '\n\n'.join('paragraph *%s*' % index for index in range(50))
+    render(page(text), make_environ(cache))
+    assert cache.stats()['misses'] == 50
+
+    edited = text.replace('*20*', '*twenty*')
+    output = render(page(edited), make_environ(cache))
+    assert '<p>paragraph <em>twenty</em></p>' in output
+    assert cache.stats()['misses'] == 51
+    assert cache.stats()['hits'] == 49
+
+
+def test_header_ids():
+    cache = MemoryCache()
+    text = '# Same\n\nbetween\n\n# Same'
+    output = render(page(text), make_environ(cache))
+    assert output == ('<h1 id="same">Same</h1>\n<p>between</p>\n'
+            '<h1 id="same_1">Same</h1>')
+
+
+def test_transcluding_blocks_not_cached():
+    cache = MemoryCache()
+    output = render(page('a\n\n{{other}}\n\nb'), make_environ(cache))
+    assert output == '<p>a</p>\n<p>{{other}}</p>\n<p>b</p>'
+    assert cache.stats()['entries'] == 2
+
+
+def test_not_with_extensions():
+    cache = MemoryCache()
+    settings = EngineSettings(make_environ(cache)['tiddlyweb.config'])
+    assert settings.block_cache is cache
+    settings = EngineSettings(make_environ(cache, **{
+        'markdown.extensions': (['abbr'], {})})['tiddlyweb.config'])
+    assert settings.block_cache is None
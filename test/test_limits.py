@@ -0,0 +1,198 @@
+"""
+Test the render budgets: input size, render time, transclusion depth
+and transcluded bytes.
+"""
+
+import shutil
+import time
+
+from tiddlywebplugins.markdown import render as render_markdown
+from tiddlywebplugins.markdown.cache import MemoryCache
+from tiddlywebplugins.markdown.limits import BUDGET_KEY, LIMITS_KEY
+from tiddlywebplugins.markdown.render import EngineSettings
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.config import config
+
+from tiddlywebplugins.utils import get_store
+
+
+def render(tiddler, environ):
+    """
+    A slow renderer, for text/x-slow.
+    """
+    time.sleep(0.05)
+    return render_markdown(tiddler, environ)
+
+
+def setup_module(module):
+    try:
+        shutil.rmtree('store')
+    except:
+        pass
+    store = get_store(config)
+    module.store = store
+
+    store.put(Bag('things'))
+    for title, text in [
+            ('one', 'one\n\n{{two}}\n'),
+            ('two', 'two\n\n{{three}}\n'),
+            ('three', 'three'),
+            ('big', 'x' * 200),
+            ('small', 'y' * 20)]:
+        tiddler = Tiddler(title, 'things')
+        tiddler.type = 'text/x-markdown'
+        tiddler.text = text
+        store.put(tiddler)
+    slow = Tiddler('slow', 'things')
+    slow.type = 'text/x-slow'
+    slow.text = 'slow'
+    store.put(slow)
+
+
+def make_environ(cache=None, **limits):
+    environ = {
+        'tiddlyweb.config': {
+            'markdown.wiki_link_base': '',
+            'markdown.render_cache': cache,
+            'wikitext.type_render_map': {
+                'text/x-markdown': 'tiddlywebplugins.markdown',
+                'text/x-slow': 'test.test_limits',
+            },
+            'server_host': {
+                'scheme': 'http',
+                'host': 'example.com',
+                'port': '80'
+            }
+        },
+        'tiddlyweb.usersign': {'name': 'GUEST', 'roles': []},
+        'tiddlyweb.store': store,
+    }
+    for limit, value in limits.items():
+        environ['tiddlyweb.config']['markdown.%s' % limit] = value
+    return environ
+
+
+def page(text):
+    tiddler = Tiddler('page', 'things')
+    tiddler.text = text
+    return tiddler
+
+
+def limits_hit(environ):
+    return [(exc.limit, exc.title) for exc in environ[LIMITS_KEY]]
+
+
+def test_no_limits():
+    environ = make_environ()
+    output = render_markdown(page('{{one}}'), environ)
+    assert 'data-title="three"' in output
+    assert LIMITS_KEY not in environ
+    assert BUDGET_KEY not in environ
+
+
+def test_within_limits():
+    environ = make_environ(max_input_bytes=1000, max_render_time=10,
+            max_transclusion_depth=5, max_transcluded_bytes=1000)
+    output = render_markdown(page('{{one}}'), environ)
+    assert output == render_markdown(page('{{one}}'), make_environ())
+    assert environ[LIMITS_KEY] == []
+    assert BUDGET_KEY not in environ
+
+
+def test_max_input_bytes():
+    environ = make_environ(max_input_bytes=10)
+    output = render_markdown(page('# <b>too</b> & long'), environ)
+    assert output == ('<pre class="markdown-limit"># &lt;b&gt;too&lt;/b&gt;'
+            ' &amp; long</pre>')
+    assert limits_hit(environ) == [('max_input_bytes', 'page')]
+    assert environ[LIMITS_KEY][0].amount == 19
+
+
+def test_max_input_bytes_transcluded():
+    environ = make_environ(max_input_bytes=100)
+    output = render_markdown(page('{{big}}\n\n{{small}}'), environ)
+    assert '<p>{{big}}</p>' in output
+    assert 'data-title="small"' in output
+    assert limits_hit(environ) == [('max_input_bytes', 'big')]
+
+
+def test_max_transclusion_depth():
+    environ = make_environ(max_transclusion_depth=2)
+    output = render_markdown(page('{{one}}'), environ)
+    assert 'data-title="one"' in output
+    assert 'data-title="two"' in output
+    assert '<p>{{three}}</p>' in output
+    assert limits_hit(environ) == [('max_transclusion_depth', 'three')]
+
+
+def test_max_transcluded_bytes():
+    environ = make_environ(max_transcluded_bytes=210)
+    output = render_markdown(page('{{big}}\n\n{{small}}\n\n{{big}}'),
+            environ)
+    assert output.count('data-title="big"') == 2
+    assert '<p>{{small}}</p>' in output
+    assert limits_hit(environ) == [('max_transcluded_bytes', 'small')]
+
+
+def test_max_transcluded_bytes_concurrently():
+    environ = make_environ(max_transcluded_bytes=210)
+    environ['tiddlyweb.config']['markdown.transclusion_workers'] = 4
+    output = render_markdown(page('{{big}}\n\n{{small}}\n\n{{three}}'),
+            environ)
+    assert output.count('class="transclusion"') == 2
+    assert len(environ[LIMITS_KEY]) == 1
+    assert environ[LIMITS_KEY][0].limit == 'max_transcluded_bytes'
+
+
+def test_max_render_time():
+    text = '# Slow\n\n{{slow}}\n\n{{one}}'
+    environ = make_environ(max_render_time=0.01)
+    output = render_markdown(page(text), environ)
+    assert output == '<pre class="markdown-limit">%s</pre>' % text
+    assert limits_hit(environ) == [('max_render_time', 'page')]
+    assert 'markdown.transclusions' not in environ or not environ[
+            'markdown.transclusions']
+
+    # the same environ can go on to render within the limit
+    environ['tiddlyweb.config']['markdown.max_render_time'] = 10
+    output = render_markdown(page('{{one}}'), environ)
+    assert 'data-title="three"' in output
+    assert limits_hit(environ) == []
+
+
+def test_separate_engines():
+    timed = EngineSettings(make_environ(max_render_time=1)[
+        'tiddlyweb.config'])
+    sized = EngineSettings(make_environ(max_input_bytes=1)[
+        'tiddlyweb.config'])
+    plain = EngineSettings(make_environ()['tiddlyweb.config'])
+    assert timed.key != plain.key
+    assert sized.key == plain.key
+
+
+def test_not_cached():
+    cache = MemoryCache()
+    text = '{{big}}\n\n{{small}}'
+    environ = make_environ(cache, max_transcluded_bytes=100)
+    limited = render_markdown(page(text), environ)
+    assert '<p>{{big}}</p>' in limited
+
+    output = render_markdown(page(text), make_environ(cache))
+    assert 'data-title="big"' in output
+
+    # nor is the fallback
+    render_markdown(page('x' * 50), make_environ(cache, max_input_bytes=10))
+    output = render_markdown(page('x' * 50), make_environ(cache))
+    assert output == '<p>%s</p>' % ('x' * 50)
+
+
+def test_max_render_time_inline():
+    # code spans take seconds over this, match by match
+    text = '`a ' * 8000
+    environ = make_environ(max_render_time=0.05)
+    start = time.time()
+    output = render_markdown(page(text), environ)
+    assert time.time() - start < 1
+    assert output.startswith('<pre class="markdown-limit">')
+    assert limits_hit(environ) == [('max_render_time', 'page')]
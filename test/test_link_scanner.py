@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+Test that the single links pattern finds the same links as the
+separate patterns it replaced, that the Finders which match links,
+URLs and short references agree with the expressions they stand in
+for, and that they take linear time on adversarial text.
+"""
+
+import random
+import time
+
+import markdown
+
+from tiddlywebplugins.markdown.autolink import TWAutoLink
+from tiddlywebplugins.markdown.links import (MarkdownLinksExtension,
+        MarkdownLinks, TargetLinks, FREELINK, WIKILINK, WIKITARGET,
+        FREETARGET, TARGETLINK)
+from tiddlywebplugins.markdown.scan import LinearScanning, ScanMatch
+
+
+PIECES = ['[[', ']]', '@[[', ' [[', '|[[', '(FooBar', '@', '[', ']', '~',
+        '|', '(', ')', ' ', ' ', '\n', 'FooBar', 'WikiWord', 'Foo', 'bar',
+        'x-y', 'a1', '[[free link]]', '[[label|target]]', '@bag',
+        '@[[my bag]]', 'CamelCase@target', '[[x]]@y', '~NotLink', '`code`',
+        '*', '_', 'http://example.com/a?b=c', '<b>', '&', '\\[', '#', '-',
+        '[[~FooBar x]]', u'u\xe9', u'Ca\xe9De', '[foo]', '[x]', '![x]',
+        '[foo][]', ' http://a.b/c', '="http://q', '">https://r.s']
+
+REFERENCES = u'\n\n[foo]: http://f.com/\n[x]: /x "T"\n[free link]: /fl\n'
+
+
+def interlinker(environ, target):
+    return 'http://example.com/' + target
+
+
+class URLExpression(object):
+    """
+    The expression of the twautolink pattern, with its matches as
+    ScanMatches.
+    """
+
+    def __init__(self, pattern):
+        self.compiled = pattern.compiled_re
+
+    def match(self, data):
+        match = self.compiled.match(data)
+        if match is None:
+            return None
+        return ScanMatch(data, match.start(2), match.end(2),
+                url=match.group(2))
+
+
+def separate_patterns(md, interlinker):
+    """
+    Replace the links pattern with the five patterns of old, and the
+    Finders of other patterns with their expressions.
+    """
+    twautolink = md.inlinePatterns['twautolink']
+    twautolink.getCompiledRegExp = lambda: URLExpression(twautolink)
+    del md.inlinePatterns['short_reference'].getCompiledRegExp
+
+    extension = MarkdownLinksExtension(environ={}, interlinker=interlinker)
+    configs = extension.getConfigs()
+    del md.inlinePatterns['links']
+
+    def add(name, pattern_class, regex, location):
+        pattern = pattern_class(regex, configs)
+        pattern.md = md
+        md.inlinePatterns.add(name, pattern, location)
+
+    add('wikilink', MarkdownLinks, WIKILINK, '<link')
+    add('freelink', MarkdownLinks, FREELINK, '<wikilink')
+    if interlinker:
+        add('wikitargetlink', TargetLinks, WIKITARGET, '<wikilink')
+        add('freetargetlink', TargetLinks, FREETARGET, '<wikitargetlink')
+        add('targetlink', TargetLinks, TARGETLINK, '>wikitargetlink')
+
+
+def extensions(interlinker):
+    return [MarkdownLinksExtension(environ={}, interlinker=interlinker),
+            TWAutoLink(), LinearScanning()]
+
+
+def engines(interlinker):
+    scanner = markdown.Markdown(extensions=extensions(interlinker))
+    separate = markdown.Markdown(extensions=extensions(interlinker))
+    separate_patterns(separate, interlinker)
+    return scanner, separate
+
+
+def texts(seed, count):
+    rand = random.Random(seed)
+    for index in range(count):
+        text = u''.join(rand.choice(PIECES)
+                for _ in range(rand.randint(1, 40)))
+        if index % 2:
+            text += REFERENCES
+        yield text
+
+
+def test_same_links():
+    for linker in (None, interlinker):
+        scanner, separate = engines(linker)
+        for text in texts(12, 500):
+            assert scanner.convert(text) == separate.convert(text), text
+            scanner.reset()
+            separate.reset()
+
+
+def test_overlapping_forms():
+    scanner, separate = engines(interlinker)
+    for text in [u'[[a [[FooBar]]@b]] FooBar@c',
+            u'|[[@[[(`code`[[Foo|@[[ [[[[x]]@y)FooBar_]]|@x',
+            u'@[[x]] [[y]]@z WikiWord ~WikiWord [[~NotLink]]']:
+        assert scanner.convert(text) == separate.convert(text), text
+
+
+def test_many_on_a_line():
+    scanner, separate = engines(interlinker)
+    text = (u' WikiWord [[free]] @bag http://a.b/ [foo] [[x]]@y' * 50 +
+            REFERENCES)
+    assert scanner.convert(text) == separate.convert(text)
+
+
+def seconds(engine, text):
+    best = None
+    for _ in range(3):
+        engine.reset()
+        start = time.time()
+        engine.convert(text)
+        took = time.time() - start
+        best = took if best is None else min(best, took)
+    return best
+
+
+def test_linear_on_adversarial_text():
+    """
+    Eight times the text should take about eight times as long, not
+    sixty four.
+    """
+    scanner, _ = engines(interlinker)
+    for piece in ['[[', ' [[', '|[[x', ' @[[', ' @[[ @w', '(AbCd@',
+            'QUJDRGVm', 'http://', '[x']:
+        small = seconds(scanner, piece * 1000)
+        large = seconds(scanner, piece * 8000)
+        assert large < 20 * small + 0.05, (piece, small, large)
+
+
+def test_names():
+    scanner, separate = engines(interlinker)
+    assert 'links' in scanner.inlinePatterns
+    for name in ['wikilink', 'freelink', 'targetlink']:
+        assert name not in scanner.inlinePatterns
@@ -0,0 +1,136 @@
+"""
+Test the memos of encoded titles and interlinker and transclude_url
+results.
+"""
+
+import shutil
+
+from tiddlywebplugins.markdown import memo, render
+from tiddlywebplugins.markdown.links import encode_name
+from tiddlywebplugins.markdown.memo import Memo
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.config import config
+
+from tiddlywebplugins.utils import get_store
+
+
+CALLS = []
+
+
+def interlinker(environ, target):
+    CALLS.append(target)
+    return '/spaces/%s/' % target
+
+
+def transclude_url(environ, tiddler):
+    CALLS.append(tiddler.title)
+    return '/bags/%s/tiddlers/%s' % (tiddler.bag, tiddler.title)
+
+
+def setup_module(module):
+    try:
+        shutil.rmtree('store')
+    except:
+        pass
+    store = get_store(config)
+    module.store = store
+    store.put(Bag('things'))
+    tiddler = Tiddler('inside', 'things')
+    tiddler.text = 'inner text'
+    store.put(tiddler)
+
+
+def make_environ(**extra):
+    tiddlyweb_config = {
+        'markdown.wiki_link_base': '',
+        'markdown.interlinker': interlinker,
+        'markdown.transclude_url': transclude_url,
+    }
+    tiddlyweb_config.update(extra)
+    return {
+        'tiddlyweb.config': tiddlyweb_config,
+        'tiddlyweb.store': store,
+        'tiddlyweb.usersign': {'name': 'GUEST', 'roles': []},
+    }
+
+
+def page(text):
+    tiddler = Tiddler('page', 'things')
+    tiddler.text = text
+    return tiddler
+
+
+TEXT = """
+PageOne@alpha, @alpha and [[two]]@alpha, then @beta.
+
+{{inside}}
+
+{{inside}}
+"""
+
+
+def test_memo():
+    lru = Memo(4)
+    lru.set('a', 1)
+    lru.set('b', 2)
+    assert lru.get('a') == 1
+    lru.set('c', 3)
+    lru.set('d', 4)
+    # b was least recently used
+    assert lru.get('b') is None
+    assert lru.get('c') == 3
+    assert lru.stats() == {'hits': 2, 'misses': 1, 'entries': 2,
+            'max_entries': 4}
+    lru.clear()
+    assert lru.stats()['entries'] == 0
+
+
+def test_encode_name():
+    memo.NAMES.clear()
+    assert encode_name(u'some page#here') == 'some%20page#here'
+    assert encode_name(u'some page#here') == 'some%20page#here'
+    assert encode_name(u'caf\xe9') == 'caf%C3%A9'
+    assert memo.NAMES.stats()['hits'] == 1
+    assert memo.NAMES.stats()['misses'] == 2
+
+
+def test_request_memo():
+    del CALLS[:]
+    environ = make_environ()
+    output = render(page(TEXT), environ)
+    assert '<a href="/spaces/alpha/PageOne">PageOne</a>' in output
+    assert '<a href="/spaces/alpha/two">two</a>' in output
+    assert '<a href="/spaces/beta/">@beta</a>' in output
+    assert output.count('/bags/things/tiddlers/inside') == 2
+    assert sorted(CALLS) == ['alpha', 'beta', 'inside']
+    stats = memo.stats(environ)['request']
+    assert stats['misses'] == 3
+    assert stats['hits'] == 2
+    # kept apart from the config setting of the same purpose
+    assert isinstance(environ[memo.MEMO_KEY], Memo)
+    assert memo.CONFIG_KEY not in environ
+
+    # a new request calls them again
+    render(page(TEXT), make_environ())
+    assert len(CALLS) == 6
+
+
+def test_process_memo():
+    del CALLS[:]
+    memo.URLS.clear()
+    first = render(page(TEXT),
+            make_environ(**{'markdown.url_memo': 'process'}))
+    second = render(page(TEXT),
+            make_environ(**{'markdown.url_memo': 'process'}))
+    assert first == second
+    assert len(CALLS) == 3
+    assert memo.stats()['urls']['entries'] == 3
+
+
+def test_no_memo():
+    del CALLS[:]
+    environ = make_environ(**{'markdown.url_memo': False})
+    render(page(TEXT), environ)
+    assert CALLS == ['alpha', 'alpha', 'alpha', 'beta', 'inside']
+    assert 'request' not in memo.stats(environ)
@@ -0,0 +1,40 @@
+"""
+Test that compiled expressions are shared by patterns and engines.
+"""
+
+import re
+
+from tiddlywebplugins.markdown.autolink import BARELINK
+from tiddlywebplugins.markdown.links import WIKILINK, MarkdownLinks
+from tiddlywebplugins.markdown.patterns import (INLINE_FLAGS,
+        SharedPattern, compiled, inline)
+from tiddlywebplugins.markdown.render import EngineSettings
+from tiddlywebplugins.markdown.transclusion import TRANSCLUDE_RE
+
+
+def test_compiled_once():
+    assert compiled(TRANSCLUDE_RE) is compiled(TRANSCLUDE_RE)
+    assert compiled(TRANSCLUDE_RE) is not compiled(TRANSCLUDE_RE, re.I)
+    assert inline(WIKILINK).pattern == r'^(.*?)%s(.*)$' % WIKILINK
+    assert inline(WIKILINK).flags & INLINE_FLAGS == INLINE_FLAGS
+
+
+def test_patterns_share():
+    pattern = SharedPattern(BARELINK)
+    assert pattern.compiled_re is inline(BARELINK)
+    assert pattern.getCompiledRegExp() is inline(BARELINK)
+
+    links = MarkdownLinks(WIKILINK, {})
+    assert links.config == {}
+    assert links.compiled_re is inline(WIKILINK)
+
+
+def test_engines_share():
+    settings = EngineSettings({'markdown.wiki_link_base': ''})
+    first, second = settings.build(), settings.build()
+    assert (first.inlinePatterns['links'].compiled_re
+            is second.inlinePatterns['links'].compiled_re)
+    assert (first.inlinePatterns['twautolink'].compiled_re
+            is second.inlinePatterns['twautolink'].compiled_re)
+    assert (first.postprocessors['transclusion'].expression
+            is second.postprocessors['transclusion'].expression)
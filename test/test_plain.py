@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+Test the fast path for plain text against Python-Markdown.
+"""
+
+import random
+
+from tiddlywebplugins.markdown import render
+from tiddlywebplugins.markdown.plain import plain_html
+from tiddlywebplugins.markdown.render import (ALLOWED_SAFE_MODES, ENGINES,
+        EngineSettings)
+from tiddlyweb.model.tiddler import Tiddler
+
+
+# pieces of text which are, or are nearly, Markdown
+FRAGMENTS = [u'plain', u'words', u'here.', u'Caf\xe9', u'\xa0', u'"quoted"',
+        u"it's", u'(aside)', u'a|b', u'!', u'?', u'%', u'$5', u'x^2',
+        u'&', u'& b', u'&amp;', u'&#169;', u'&;', u'&copy', u'<b>', u'>',
+        u'<http://example.com>', u'http://example.com/', u'*', u'_', u'`',
+        u'\\', u'[', u']', u'[[link]]', u'{{tiddler}}', u'}', u'WikiLink',
+        u'~WikiLink', u'@target', u'a@b.org', u'#', u'# ', u'=', u'===',
+        u'-', u'- ', u'---', u'+ ', u':', u': ', u'~~~', u'1.', u'1. ',
+        u'2014.', u'3.14', u' ', u'  ', u'    ', u'\t', u'\r', u'\r\n',
+        u'\n', u'\n', u'\n\n', u'\n\n\n', u'\n \n', u'\x02', u'\x03']
+
+
+def make_environ(safe_mode=u'escape', base=None):
+    config = {'markdown.safe_mode': safe_mode}
+    if base is not None:
+        config['markdown.wiki_link_base'] = base
+    return {'tiddlyweb.config': config}
+
+
+def random_text(rand):
+    pieces = []
+    for _ in range(rand.randint(1, 12)):
+        if rand.random() < 0.5:
+            pieces.append(rand.choice([u'plain', u'words', u'here.']))
+        else:
+            pieces.append(rand.choice(FRAGMENTS))
+        pieces.append(rand.choice([u' ', u' ', u'', u'\n', u'\n\n']))
+    return u''.join(pieces)
+
+
+def test_plain_html():
+    assert plain_html(u'Hello world.') == u'<p>Hello world.</p>'
+    assert (plain_html(u'\nOne & two,\nthree.\n\n\n"Four"\n')
+            == u'<p>One &amp; two,\nthree.</p>\n<p>"Four"</p>')
+    assert plain_html(u'\n\n') == u''
+    assert plain_html(u'some *emphasis*') is None
+    assert plain_html(u'&copy; 2014') is None
+    assert plain_html(u'see http://example.com/') is None
+    assert plain_html(u'- item') is None
+    assert plain_html(u'a WikiLink') == u'<p>a WikiLink</p>'
+    assert plain_html(u'a WikiLink', wikilinks=True) is None
+    assert plain_html(u'ask @cdent', wikilinks=True) is None
+
+
+def test_same_as_markdown():
+    rand = random.Random(18)
+    texts = [random_text(rand) for _ in range(400)]
+    texts.extend(FRAGMENTS)
+    plain = 0
+    for safe_mode in ALLOWED_SAFE_MODES:
+        for base in [None, u'']:
+            settings = EngineSettings(make_environ(safe_mode,
+                base)['tiddlyweb.config'])
+            engine = settings.build()
+            for text in texts:
+                expected = engine.convert(text)
+                engine.reset()
+                output = plain_html(text, base is not None)
+                if output is not None:
+                    plain += 1
+                    assert output == expected, (safe_mode, base, text)
+    # the fast path was taken often enough to count
+    assert plain > 400
+
+
+def test_render_without_engine():
+    settings = EngineSettings(make_environ()['tiddlyweb.config'])
+    ENGINES.clear()
+    tiddler = Tiddler(u'plain')
+    tiddler.text = u'Just some text.\n\nAnd more.'
+    assert (render(tiddler, make_environ())
+            == u'<p>Just some text.</p>\n<p>And more.</p>')
+    assert ENGINES.idle_count(settings) == 0
+
+    tiddler.text = u'Some *text*.'
+    assert render(tiddler, make_environ()) == u'<p>Some <em>text</em>.</p>'
+    assert ENGINES.idle_count(settings) == 1
+
+    settings = EngineSettings({'markdown.extensions': (['abbr'], {})})
+    assert not settings.plain
@@ -0,0 +1,121 @@
+"""
+Test profiling the stages of rendering.
+"""
+
+import json
+import shutil
+
+from tiddlywebplugins.markdown import render
+from tiddlywebplugins.markdown.cache import MemoryCache
+from tiddlywebplugins.markdown.profile import PROFILE_KEY
+from tiddlywebplugins.markdown.render import EngineSettings
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.config import config
+
+from tiddlywebplugins.utils import get_store
+
+
+PROFILES = []
+
+
+def setup_module(module):
+    try:
+        shutil.rmtree('store')
+    except:
+        pass
+    store = get_store(config)
+    module.store = store
+
+    store.put(Bag('things'))
+    inner = Tiddler('inner', 'things')
+    inner.type = 'text/x-markdown'
+    inner.text = 'inner with a WikiLink'
+    store.put(inner)
+
+
+def collect(environ, profile):
+    PROFILES.append(profile)
+
+
+def make_environ(profile=None, cache=None):
+    environ = {
+        'tiddlyweb.config': {
+            'markdown.wiki_link_base': '',
+            'markdown.render_cache': cache,
+            'wikitext.type_render_map': {
+                'text/x-markdown': 'tiddlywebplugins.markdown'
+            },
+            'server_host': {
+                'scheme': 'http',
+                'host': 'example.com',
+                'port': '80'
+            }
+        },
+        'tiddlyweb.usersign': {'name': 'GUEST', 'roles': []},
+        'tiddlyweb.store': store,
+    }
+    if profile is not None:
+        environ['tiddlyweb.config']['markdown.profile'] = profile
+    return environ
+
+
+def page():
+    tiddler = Tiddler('page', 'things')
+    tiddler.text = ('# Page\n\nA WikiLink, a [[free link]], [[label|target]]'
+            ' and http://example.com/\n\n{{inner}}\n')
+    return tiddler
+
+
+def test_callback():
+    del PROFILES[:]
+    environ = make_environ(collect)
+    output = render(page(), environ)
+
+    assert output == render(page(), make_environ())
+    assert len(PROFILES) == 1
+    profile = PROFILES[0]
+    assert environ[PROFILE_KEY] is profile
+    assert profile.title == 'page'
+    assert not profile.cached
+
+    for name in ['parser', 'serializer', 'treeprocessor.inline',
+            'inline.links.regex', 'inline.links.handle',
+            'inline.twautolink.regex', 'postprocessor.transclusion',
+            'transclusion.fetch', 'transclusion.render']:
+        assert profile.seconds(name) > 0, name
+    assert profile.timings['inline.links.handle'][1] == 3
+    assert profile.seconds('transclusion.render') <= profile.seconds(
+            'postprocessor.transclusion')
+    assert profile.total >= profile.seconds('postprocessor.transclusion')
+
+    assert [child.title for child in profile.children] == ['inner']
+    assert profile.children[0].seconds('inline.links.handle') > 0
+
+    data = json.loads(json.dumps(profile.to_dict()))
+    assert data['children'][0]['title'] == 'inner'
+    assert data['timings']['parser']['calls'] == 1
+
+
+def test_attached_to_environ():
+    environ = make_environ(True)
+    render(page(), environ)
+    assert environ[PROFILE_KEY].seconds('parser') > 0
+
+
+def test_separate_engines():
+    settings = EngineSettings(make_environ()['tiddlyweb.config'])
+    profiled = EngineSettings(make_environ(True)['tiddlyweb.config'])
+    assert settings.key != profiled.key
+    environ = make_environ()
+    render(page(), environ)
+    assert PROFILE_KEY not in environ
+
+
+def test_cached():
+    cache = MemoryCache()
+    render(page(), make_environ(True, cache))
+    environ = make_environ(True, cache)
+    render(page(), environ)
+    assert environ[PROFILE_KEY].cached
+    assert environ[PROFILE_KEY].seconds('parser') == 0
@@ -0,0 +1,190 @@
+"""
+Test rendering with asyncio, on Python 3.
+"""
+
+import shutil
+import sys
+import time
+
+import pytest
+
+if sys.version_info < (3, 5):
+    pytest.skip('render_async requires Python 3', allow_module_level=True)
+
+import asyncio
+
+from tiddlywebplugins.markdown import render
+from tiddlywebplugins.markdown.aio import (AsyncStore, render_async,
+        render_with_dependencies_async)
+from tiddlywebplugins.markdown.cache import MemoryCache
+from tiddlywebplugins.markdown.render import render_with_dependencies
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.recipe import Recipe
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.config import config
+from tiddlyweb.store import HOOKS
+
+from tiddlywebplugins.utils import get_store
+
+
+def setup_module(module):
+    try:
+        shutil.rmtree('store')
+    except:
+        pass
+    store = get_store(config)
+    module.store = store
+
+    store.put(Bag('things'))
+    recipe = Recipe('site')
+    recipe.set_recipe([('things', '')])
+    store.put(recipe)
+
+    for title, text in [
+            ('alpha', 'alpha _text_\n\n{{beta}}\n'),
+            ('beta', 'beta _text_\n\n{{alpha}}\n\n{{gamma}}\n'),
+            ('gamma', 'gamma [[link]]\n')]:
+        tiddler = Tiddler(title, 'things')
+        tiddler.text = text
+        tiddler.type = 'text/x-markdown'
+        store.put(tiddler)
+    plain = Tiddler('plain', 'things')
+    plain.text = 'plain <text>'
+    plain.type = 'text/plain'
+    store.put(plain)
+
+
+def make_environ(**extra):
+    environ = {
+        'tiddlyweb.config': {
+            'markdown.wiki_link_base': '',
+            'wikitext.type_render_map': {
+                'text/x-markdown': 'tiddlywebplugins.markdown',
+                'text/plain': 'raw',
+            },
+            'server_host': {
+                'scheme': 'http',
+                'host': 'example.com',
+                'port': '80'
+            }
+        },
+        'tiddlyweb.usersign': {'name': 'GUEST', 'roles': []},
+        'tiddlyweb.store': store,
+    }
+    environ['tiddlyweb.config'].update(extra)
+    return environ
+
+
+def page():
+    tiddler = Tiddler('page')
+    tiddler.recipe = 'site'
+    tiddler.text = ('# Page\n\n{{alpha}}\n\n{{gamma}}\n\n{{plain}}\n\n'
+            '{{missing}}\n\n{{alpha}}\n\n    {{code}}\n')
+    return tiddler
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+def test_same_as_render():
+    expected, expected_dependencies = render_with_dependencies(page(),
+            make_environ())
+    output, dependencies = run(render_with_dependencies_async(page(),
+        make_environ()))
+
+    assert output == expected
+    assert dependencies == expected_dependencies
+    assert output.count('beta <em>text</em>') == 2
+    assert 'plain &lt;text&gt;' in output
+    assert '{{missing}}' in output
+
+
+def test_without_wiki_link_base():
+    tiddler = Tiddler('page')
+    tiddler.text = '{{alpha}} _text_'
+    environ = make_environ()
+    del environ['tiddlyweb.config']['markdown.wiki_link_base']
+    assert run(render_async(tiddler, environ)) == render(tiddler, environ)
+
+
+def test_render_cache():
+    cache = MemoryCache()
+    first = run(render_async(page(), make_environ(
+        **{'markdown.render_cache': cache})))
+    assert first == render(page(), make_environ())
+    hits = cache.stats()['hits']
+    assert run(render_async(page(), make_environ(
+        **{'markdown.render_cache': cache}))) == first
+    assert cache.stats()['hits'] == hits + 1
+
+
+def test_limits():
+    limits = {'markdown.max_transclusion_depth': 1}
+    expected = render(page(), make_environ(**limits))
+    environ = make_environ(**limits)
+    output = run(render_async(page(), environ))
+    assert output == expected
+    assert '<p>{{beta}}</p>' in output
+    assert set(exc.title for exc in environ['markdown.limits']) == set(
+            ['beta'])
+
+    environ = make_environ(**{'markdown.max_input_bytes': 10})
+    output = run(render_async(page(), environ))
+    assert output.startswith('<pre class="markdown-limit">')
+
+
+def test_loop_not_blocked():
+    ticks = []
+
+    def slow_get(store, tiddler):
+        time.sleep(0.02)
+
+    def tick():
+        ticks.append(time.time())
+        loop.call_later(0.002, tick)
+
+    loop = asyncio.new_event_loop()
+    HOOKS['tiddler']['get'].append(slow_get)
+    try:
+        loop.call_soon(tick)
+        output = loop.run_until_complete(render_async(page(),
+            make_environ()))
+    finally:
+        HOOKS['tiddler']['get'].remove(slow_get)
+        loop.close()
+
+    assert 'gamma <a' in output
+    # the loop kept running while tiddlers were got
+    assert len(ticks) > 10
+
+
+class CountingStore(AsyncStore):
+
+    def __init__(self, store):
+        AsyncStore.__init__(self, store)
+        self.got = []
+
+    def get(self, thing):
+        self.got.append(thing.title)
+        return self.run(self.store.get, thing)
+
+
+def test_async_store_factory():
+    stores = []
+
+    def factory(environ):
+        stores.append(CountingStore(environ['tiddlyweb.store']))
+        return stores[-1]
+
+    output = run(render_async(page(), make_environ(
+        **{'markdown.async_store': factory})))
+
+    assert output == render(page(), make_environ())
+    # one store for the whole render, passed down to transclusions
+    assert len(stores) == 1
+    assert sorted(set(stores[0].got)) == ['alpha', 'beta', 'gamma', 'plain']
@@ -0,0 +1,206 @@
+"""
+Test caching of rendered HTML.
+"""
+
+import os
+import shutil
+import tempfile
+
+from tiddlywebplugins.markdown import render
+from tiddlywebplugins.markdown.cache import (MemoryCache, DiskCache,
+        SharedCache, cache_key)
+from tiddlywebplugins.markdown.render import EngineSettings
+from tiddlyweb.model.tiddler import Tiddler
+
+
+def make_environ(cache, **config):
+    config['markdown.render_cache'] = cache
+    config.setdefault('markdown.wiki_link_base', '')
+    return {'tiddlyweb.config': config}
+
+
+def test_memory_hit_and_miss():
+    cache = MemoryCache()
+    environ = make_environ(cache)
+    tiddler = Tiddler('Foo')
+    tiddler.text = 'Some _text_ with a WikiLink'
+
+    first = render(tiddler, environ)
+    assert cache.stats()['misses'] == 1
+    assert cache.stats()['hits'] == 0
+
+    second = render(tiddler, environ)
+    assert second == first
+    assert cache.stats()['hits'] == 1
+    assert cache.stats()['entries'] == 1
+
+    tiddler.text = 'Other text'
+    render(tiddler, environ)
+    assert cache.stats()['misses'] == 2
+    assert cache.stats()['entries'] == 2
+
+
+def test_settings_in_key():
+    text = 'hello <b>WikiLink</b>'
+    keys = set([
+        cache_key(text, EngineSettings({})),
+        cache_key(text, EngineSettings({'markdown.wiki_link_base': ''})),
+        cache_key(text, EngineSettings({'markdown.safe_mode': 'remove'})),
+        cache_key(text, EngineSettings({'markdown.wiki_link_base': '',
+            'markdown.interlinker': make_environ})),
+    ])
+    assert len(keys) == 4
+
+
+def test_extension_instances():
+    from markdown.extensions.toc import TocExtension
+
+    def key(**configs):
+        return cache_key('[TOC]\n\n# Head', EngineSettings({
+            'markdown.extensions': ([TocExtension(**configs)], {})}))
+    assert key(title='Contents') == key(title='Contents')
+    assert key(title='Contents') != key(title='Index')
+
+    cache = MemoryCache()
+    tiddler = Tiddler('Foo')
+    tiddler.text = '[TOC]\n\n# Head'
+    environ = make_environ(cache, **{'markdown.extensions':
+        ([TocExtension(title='Contents')], {})})
+    first = render(tiddler, environ)
+    assert 'Contents' in first
+    assert render(tiddler, environ) == first
+    assert cache.stats()['hits'] == 1
+
+
+def test_byte_budget():
+    cache = MemoryCache(max_bytes=100)
+    cache.set('a', u'x' * 40)
+    cache.set('b', u'y' * 40)
+    assert cache.get('a') == (u'x' * 40, None)
+    cache.set('c', u'z' * 40)
+    assert cache.get('b') is None
+    assert cache.get('a') == (u'x' * 40, None)
+    assert cache.stats()['bytes'] == 80
+
+    cache.set('d', u'w' * 101)
+    assert cache.get('d') is None
+
+
+def test_transclusion_context():
+    cache = MemoryCache()
+    environ = make_environ(cache)
+    tiddler = Tiddler('Foo')
+    tiddler.text = 'hello\n\n{{bar}}\n'
+
+    render(tiddler, environ)
+    render(tiddler, environ)
+    assert cache.stats()['entries'] == 1
+    assert cache.stats()['hits'] == 1
+
+    tiddler.bag = 'other'
+    render(tiddler, environ)
+    assert cache.stats()['entries'] == 2
+
+    environ['tiddlyweb.usersign'] = {'name': 'cdent', 'roles': []}
+    render(tiddler, environ)
+    assert cache.stats()['entries'] == 3
+
+
+def test_disk_cache():
+    root = tempfile.mkdtemp()
+    try:
+        environ = make_environ(DiskCache(root))
+        tiddler = Tiddler('Foo')
+        tiddler.text = u'Some \u2603 text with a WikiLink'
+
+        first = render(tiddler, environ)
+        assert environ['tiddlyweb.config'][
+                'markdown.render_cache'].stats()['misses'] == 1
+
+        cache = DiskCache(root)
+        environ = make_environ(cache)
+        assert render(tiddler, environ) == first
+        assert cache.stats()['hits'] == 1
+
+        cache.clear()
+        assert cache.get(cache_key(tiddler.text,
+            EngineSettings(environ['tiddlyweb.config']))) is None
+    finally:
+        shutil.rmtree(root)
+
+
+def test_shared_cache():
+    root = tempfile.mkdtemp()
+    path = os.path.join(root, 'cache')
+    try:
+        environ = make_environ(SharedCache(path, max_bytes=64 * 1024))
+        tiddler = Tiddler('Foo')
+        tiddler.text = u'Some \u2603 text with a WikiLink'
+        first = render(tiddler, environ)
+
+        # another process, mapping the same file
+        cache = SharedCache(path, max_bytes=64 * 1024)
+        environ = make_environ(cache)
+        assert render(tiddler, environ) == first
+        assert cache.stats()['hits'] == 1
+
+        # the oldest entries are overwritten
+        for number in range(200):
+            cache.set(str(number), u'x' * 400)
+        assert cache.get('0') is None
+        assert cache.get('199') == (u'x' * 400, None)
+        cache.set('big', u'y' * 64 * 1024)
+        assert cache.get('big') is None
+        assert os.path.getsize(path) == 64 * 1024
+
+        cache.clear()
+        assert cache.get('199') is None
+        cache.close()
+
+        try:
+            SharedCache(path, max_bytes=128 * 1024)
+        except ValueError:
+            pass
+        else:
+            assert False, 'a cache of another size was opened'
+    finally:
+        shutil.rmtree(root)
+
+
+def test_shared_cache_forked_writers():
+    if not hasattr(os, 'fork'):
+        return
+    root = tempfile.mkdtemp()
+    path = os.path.join(root, 'cache')
+    size = 16 * 1024 * 1024
+    try:
+        # made and used before forking, as in tiddlywebconfig.py
+        cache = SharedCache(path, max_bytes=size)
+        cache.set('parent', u'parent')
+        start, go = os.pipe()
+        children = []
+        for child in range(4):
+            pid = os.fork()
+            if pid == 0:
+                try:
+                    os.close(go)
+                    # wait for every child to be ready
+                    os.read(start, 1)
+                    for number in range(200):
+                        cache.set('%s-%s' % (child, number),
+                                u'%s' % number * 20)
+                finally:
+                    os._exit(0)
+            children.append(pid)
+        os.close(start)
+        os.close(go)
+        for pid in children:
+            os.waitpid(pid, 0)
+
+        cache = SharedCache(path, max_bytes=size)
+        for child in range(4):
+            for number in range(200):
+                assert cache.get('%s-%s' % (child, number)) == (
+                        u'%s' % number * 20, None)
+    finally:
+        shutil.rmtree(root)
@@ -0,0 +1,102 @@
+"""
+Test rendering many tiddlers with a process pool.
+"""
+
+import shutil
+
+from tiddlywebplugins.markdown import render
+from tiddlywebplugins.markdown.bulk import render_many
+from tiddlywebplugins.markdown.cache import MemoryCache
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.config import config
+
+from tiddlywebplugins.utils import get_store
+
+
+def setup_module(module):
+    try:
+        shutil.rmtree('store')
+    except:
+        pass
+    store = get_store(config)
+    module.store = store
+
+    store.put(Bag('corpus'))
+    tiddlers = []
+    for index in range(50):
+        tiddler = Tiddler('tiddler%s' % index, 'corpus')
+        tiddler.type = 'text/x-markdown'
+        if index % 10 == 9:
+            tiddler.text = '# %s\n\n{{tiddler%s}}\n\n{{tiddler%s}}\n' % (
+                    index, index - 1, index + 1)
+        else:
+            tiddler.text = '# %s\n\nSome _text_ with a WikiLink [[%s]]\n' % (
+                    index, index + 1)
+        store.put(tiddler)
+        tiddlers.append(store.get(tiddler))
+    module.tiddlers = tiddlers
+
+
+def make_environ(cache=None):
+    return {
+        'tiddlyweb.config': {
+            'markdown.wiki_link_base': '',
+            'markdown.render_cache': cache,
+            'wikitext.type_render_map': {
+                'text/x-markdown': 'tiddlywebplugins.markdown'
+            },
+            'server_host': {
+                'scheme': 'http',
+                'host': 'example.com',
+                'port': '80'
+            }
+        },
+        'tiddlyweb.usersign': {'name': 'GUEST', 'roles': []},
+        'tiddlyweb.store': store,
+    }
+
+
+def test_same_as_render():
+    expected = [render(tiddler, make_environ()) for tiddler in tiddlers]
+
+    for workers in [1, 3]:
+        results = list(render_many(tiddlers, make_environ(),
+            workers=workers, chunksize=4))
+        assert [tiddler for tiddler, _ in results] == tiddlers
+        assert [output for _, output in results] == expected
+
+
+def test_interior_results_reused():
+    cache = MemoryCache()
+    results = list(render_many(iter(tiddlers), make_environ(cache),
+        workers=2, chunksize=4))
+    assert len(results) == 50
+
+    # plain tiddlers were rendered in the workers and cached here,
+    # so the transcluding tiddlers found every interior tiddler before
+    # them in the cache
+    assert cache.stats()['hits'] >= 5
+    assert 'tiddler8' in results[9][1]
+
+
+def test_stop_early():
+    results = render_many(tiddlers, make_environ(), workers=2, chunksize=2)
+    first = next(results)
+    assert first[0] is tiddlers[0]
+    results.close()
+
+
+def test_limited_not_cached():
+    cache = MemoryCache()
+    environ = make_environ(cache)
+    environ['tiddlyweb.config']['markdown.max_input_bytes'] = 10
+    plain = [tiddler for tiddler in tiddlers if '{{' not in tiddler.text]
+    results = list(render_many(plain, environ, workers=2, chunksize=4))
+    assert all('markdown-limit' in output for _, output in results)
+    assert cache.stats()['entries'] == 0
+
+    # rendering without the limit is not served the fallback
+    output = render(plain[0], make_environ(cache))
+    assert 'markdown-limit' not in output
+    assert '<h1' in output
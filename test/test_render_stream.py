@@ -0,0 +1,152 @@
+"""
+Test rendering as a stream of chunks.
+"""
+
+import shutil
+import time
+
+from tiddlywebplugins.markdown import render as render_markdown
+from tiddlywebplugins.markdown.cache import MemoryCache
+from tiddlywebplugins.markdown.limits import LIMITS_KEY
+from tiddlywebplugins.markdown.stream import render_stream
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.recipe import Recipe
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.config import config
+
+from tiddlywebplugins.utils import get_store
+
+
+RENDERED = []
+
+
+def render(tiddler, environ):
+    """
+    A slow renderer which notes what it renders, for text/x-noted.
+    """
+    RENDERED.append(tiddler.title)
+    time.sleep(0.2)
+    return render_markdown(tiddler, environ)
+
+
+def setup_module(module):
+    try:
+        shutil.rmtree('store')
+    except:
+        pass
+    store = get_store(config)
+    module.store = store
+
+    store.put(Bag('things'))
+    recipe = Recipe('site')
+    recipe.set_recipe([('things', '')])
+    store.put(recipe)
+
+    for title, text in [
+            ('alpha', 'alpha _text_\n\n{{beta}}\n'),
+            ('beta', 'beta _text_\n\n{{alpha}}\n\n{{gamma}}\n'),
+            ('gamma', 'gamma [[link]]\n\n- one\n- two\n'),
+            ('wrap', 'wrap\n\n{{noted}}\n\n{{gamma}}\n')]:
+        tiddler = Tiddler(title, 'things')
+        tiddler.text = text
+        tiddler.type = 'text/x-markdown'
+        store.put(tiddler)
+    noted = Tiddler('noted', 'things')
+    noted.text = 'noted'
+    noted.type = 'text/x-noted'
+    store.put(noted)
+
+
+def make_environ(**extra):
+    environ = {
+        'tiddlyweb.config': {
+            'markdown.wiki_link_base': '',
+            'wikitext.type_render_map': {
+                'text/x-markdown': 'tiddlywebplugins.markdown',
+                'text/x-noted': 'test.test_render_stream',
+            },
+            'server_host': {
+                'scheme': 'http',
+                'host': 'example.com',
+                'port': '80'
+            }
+        },
+        'tiddlyweb.usersign': {'name': 'GUEST', 'roles': []},
+        'tiddlyweb.store': store,
+    }
+    environ['tiddlyweb.config'].update(extra)
+    return environ
+
+
+def page(text):
+    tiddler = Tiddler('page')
+    tiddler.recipe = 'site'
+    tiddler.text = text
+    return tiddler
+
+
+TEXT = ('# Page\n\nintro[^1]\n\n{{alpha}}\n\n<b>html</b>\n\n'
+        '* {{gamma}}\n\n{{missing}}\n\n    code\n\n[^1]: a note\n')
+
+
+def test_same_as_render():
+    expected = render_markdown(page(TEXT), make_environ())
+    for chunk_size in [1, 40, 100000]:
+        chunks = list(render_stream(page(TEXT), make_environ(),
+            chunk_size=chunk_size))
+        assert ''.join(chunks) == expected
+
+    assert list(render_stream(page(''), make_environ())) == []
+
+
+def test_chunks():
+    text = '\n\n'.join('paragraph %s' % index for index in range(100))
+    chunks = list(render_stream(page(text), make_environ(), chunk_size=100))
+    assert len(chunks) > 10
+    assert all(len(chunk) < 150 for chunk in chunks)
+    assert chunks[0].startswith('<p>paragraph 0</p>')
+    assert chunks[-1].endswith('<p>paragraph 99</p>')
+
+
+def test_transclusion_is_lazy():
+    del RENDERED[:]
+    environ = make_environ()
+    chunks = render_stream(page('before\n\n{{noted}}\n\nafter'), environ,
+            chunk_size=1)
+    assert next(chunks) == '<p>before</p>'
+    assert RENDERED == []
+    assert next(chunks) == '\n'
+    assert next(chunks).startswith('<article id="t-noted"')
+    assert RENDERED == []
+    assert next(chunks) == '<p>noted</p>'
+    assert RENDERED == ['noted']
+    assert ''.join(chunks) == '</article>\n<p>after</p>'
+    assert not environ['markdown.transclusions']
+
+
+def test_cached():
+    cache = MemoryCache()
+    environ = make_environ(**{'markdown.render_cache': cache})
+    output = render_markdown(page('{{gamma}}'), environ)
+    assert list(render_stream(page('{{gamma}}'), environ)) == [output]
+
+
+def test_limits():
+    environ = make_environ(**{'markdown.max_input_bytes': 10})
+    output = ''.join(render_stream(page('far too much text'), environ))
+    assert output == '<pre class="markdown-limit">far too much text</pre>'
+    assert environ[LIMITS_KEY][0].limit == 'max_input_bytes'
+
+    # noted takes longer than that, so the render stops in it, and the
+    # articles it is in are closed
+    environ = make_environ(**{'markdown.max_render_time': 0.1})
+    output = ''.join(render_stream(page('top\n\n{{wrap}}'), environ,
+        chunk_size=1))
+    assert output.startswith('<p>top</p>')
+    assert 'data-title="gamma"' not in output
+    assert output.count('<article') == output.count('</article>') == 2
+    assert output.endswith('</article></article>'
+            '<div class="markdown-limit" data-limit="max_render_time">'
+            '</div>')
+    assert environ[LIMITS_KEY][0].limit == 'max_render_time'
+    assert not environ['markdown.transclusions']
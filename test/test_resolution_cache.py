@@ -0,0 +1,127 @@
+"""
+Test that recipe and bag resolution during transclusion is
+remembered for the length of a request.
+"""
+
+import shutil
+
+from tiddlywebplugins.markdown import render
+from tiddlywebplugins.markdown.transclusion import (RESOLUTION_KEY,
+        get_bag_from_recipe, resolution_cache)
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.policy import PermissionsError
+from tiddlyweb.model.recipe import Recipe
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.config import config
+from tiddlyweb.store import HOOKS, NoBagError
+
+from tiddlywebplugins.utils import get_store
+
+
+GETS = []
+
+
+def count_get(store, thing):
+    GETS.append(thing.__class__.__name__)
+
+
+def setup_module(module):
+    try:
+        shutil.rmtree('store')
+    except:
+        pass
+    store = get_store(config)
+    module.store = store
+
+    store.put(Bag('common'))
+    private = Bag('private')
+    private.policy.read = ['cdent']
+    store.put(private)
+    recipe = Recipe('site')
+    recipe.set_recipe([('common', ''), ('private', '')])
+    store.put(recipe)
+
+    for title, bag in [('one', 'common'), ('two', 'common'),
+            ('secret', 'private')]:
+        tiddler = Tiddler(title, bag)
+        tiddler.text = '%s _text_\n\n{{one}}\n' % title
+        tiddler.type = 'text/x-markdown'
+        store.put(tiddler)
+
+    for kind in ['recipe', 'bag']:
+        HOOKS[kind]['get'].append(count_get)
+
+
+def teardown_module(module):
+    for kind in ['recipe', 'bag']:
+        HOOKS[kind]['get'].remove(count_get)
+
+
+def make_environ():
+    return {
+        'tiddlyweb.config': {
+            'markdown.wiki_link_base': '',
+            'wikitext.type_render_map': {
+                'text/x-markdown': 'tiddlywebplugins.markdown'
+            },
+            'server_host': {
+                'scheme': 'http',
+                'host': 'example.com',
+                'port': '80'
+            }
+        },
+        'tiddlyweb.usersign': {'name': 'GUEST', 'roles': []},
+        'tiddlyweb.store': store,
+    }
+
+
+def page(repeat):
+    tiddler = Tiddler('page')
+    tiddler.recipe = 'site'
+    tiddler.text = '\n\n'.join(['{{one}}', '{{two}}', '{{secret}}',
+        '{{nothing}}'] * repeat)
+    return tiddler
+
+
+def test_many_transclusions():
+    del GETS[:]
+    render(page(1), make_environ())
+    single_gets = sorted(GETS)
+    # determine_bag_from_recipe gets bags of its own
+    assert single_gets.count('Recipe') == 1
+
+    environ = make_environ()
+    del GETS[:]
+    output = render(page(10), environ)
+
+    assert output.count('one <em>text</em>') == 20
+    assert output.count('two <em>text</em>') == 10
+    assert output.count('{{secret}}') == 10
+    assert output.count('{{nothing}}') == 10
+    assert sorted(GETS) == single_gets
+
+    cache = environ[RESOLUTION_KEY]
+    assert isinstance(cache.locations[('site', 'nothing')][1], NoBagError)
+    assert isinstance(cache.permissions[('Bag', 'private', 'read', 'GUEST',
+        ())][1], PermissionsError)
+
+    # the next request starts afresh
+    del GETS[:]
+    render(page(10), make_environ())
+    assert sorted(GETS) == single_gets
+
+
+def test_shared_with_direct_calls():
+    environ = make_environ()
+    del GETS[:]
+    bag = get_bag_from_recipe(environ, 'site', Tiddler('two'))
+    assert bag.name == 'common'
+    first_gets = len(GETS)
+    bag = get_bag_from_recipe(environ, 'site', Tiddler('two'))
+    assert bag.name == 'common'
+    assert len(GETS) == first_gets
+    assert resolution_cache(environ) is environ[RESOLUTION_KEY]
+
+    environ['tiddlyweb.usersign'] = {'name': 'cdent', 'roles': []}
+    bag = get_bag_from_recipe(environ, 'site', Tiddler('secret'))
+    assert bag.name == 'private'
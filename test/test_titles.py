@@ -0,0 +1,232 @@
+"""
+Test marking links to missing tiddlers with a title index.
+"""
+
+import os
+import shutil
+import tempfile
+
+from tiddlywebplugins.markdown import render, titles
+from tiddlywebplugins.markdown.cache import MemoryCache
+from tiddlywebplugins.markdown.titles import TitleIndex
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.recipe import Recipe
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.config import config
+
+from tiddlywebplugins.utils import get_store
+
+
+LISTED = []
+
+
+def setup_module(module):
+    try:
+        shutil.rmtree('store')
+    except:
+        pass
+    config['markdown.title_index'] = TitleIndex()
+    titles.init(config)
+    store = get_store(config)
+    module.store = store
+
+    store.put(Bag('things'))
+    store.put(Bag('other'))
+    recipe = Recipe('site')
+    recipe.set_recipe([('other', ''), ('things', '')])
+    store.put(recipe)
+
+    for title, bag in [('here', 'things'), ('ElseWhere', 'other')]:
+        tiddler = Tiddler(title, bag)
+        tiddler.text = 'text'
+        store.put(tiddler)
+
+    list_bag_tiddlers = store.list_bag_tiddlers
+
+    def listing(bag):
+        LISTED.append(bag.name)
+        return list_bag_tiddlers(bag)
+    store.list_bag_tiddlers = listing
+
+
+def teardown_module(module):
+    del config['markdown.title_index']
+
+
+def make_environ(**extra):
+    tiddlyweb_config = dict(config)
+    tiddlyweb_config['markdown.wiki_link_base'] = ''
+    tiddlyweb_config.update(extra)
+    return {
+        'tiddlyweb.config': tiddlyweb_config,
+        'tiddlyweb.store': store,
+        'tiddlyweb.usersign': {'name': 'GUEST', 'roles': []},
+    }
+
+
+def page(text, bag='things', recipe=None):
+    tiddler = Tiddler('page', bag)
+    tiddler.recipe = recipe
+    tiddler.text = text
+    return tiddler
+
+
+def test_missing_class():
+    config['markdown.title_index'].clear()
+    del LISTED[:]
+    output = render(page('[[here]] [[gone]] ElseWhere [[a|here]]'),
+            make_environ())
+    assert '<a class="wikilink" href="here">here</a>' in output
+    assert '<a class="wikilink missing" href="gone">gone</a>' in output
+    assert ('<a class="wikilink missing" href="ElseWhere">ElseWhere</a>'
+            in output)
+    assert '<a class="wikilink" href="here">a</a>' in output
+
+    output = render(page('ElseWhere [[gone]]', recipe='site'),
+            make_environ())
+    assert '<a class="wikilink" href="ElseWhere">ElseWhere</a>' in output
+    assert 'missing' in output
+    # each bag is listed once, not read per link
+    assert sorted(LISTED) == ['other', 'things']
+
+
+def test_not_without_index():
+    environ = make_environ()
+    del environ['tiddlyweb.config']['markdown.title_index']
+    assert 'missing' not in render(page('[[gone]]'), environ)
+    environ = make_environ()
+    del environ['tiddlyweb.config']['markdown.wiki_link_base']
+    assert 'missing' not in render(page('[[gone]]'), environ)
+
+
+def test_hooks():
+    cache = MemoryCache()
+    text = 'see [[new one]]'
+    output = render(page(text), make_environ(**{
+        'markdown.render_cache': cache}))
+    assert 'class="wikilink missing"' in output
+
+    tiddler = Tiddler('new one', 'things')
+    tiddler.text = 'new'
+    store.put(tiddler)
+    output = render(page(text), make_environ(**{
+        'markdown.render_cache': cache}))
+    assert 'class="wikilink"' in output
+
+    # edits keep the cached render
+    store.put(tiddler)
+    render(page(text), make_environ(**{'markdown.render_cache': cache}))
+    assert cache.stats()['hits'] == 1
+
+    store.delete(tiddler)
+    output = render(page(text), make_environ(**{
+        'markdown.render_cache': cache}))
+    assert 'class="wikilink missing"' in output
+
+
+def test_bag_made_again():
+    cache = MemoryCache()
+    store.put(Bag('fresh'))
+    tiddler = Tiddler('kept', 'fresh')
+    tiddler.text = 'kept'
+    store.put(tiddler)
+    environ = make_environ(**{'markdown.render_cache': cache})
+    output = render(page('[[kept]]', bag='fresh'), environ)
+    assert 'missing' not in output
+
+    # the titles of the new bag have a new version, missing the
+    # cached render
+    store.delete(Bag('fresh'))
+    store.put(Bag('fresh'))
+    environ = make_environ(**{'markdown.render_cache': cache})
+    output = render(page('[[kept]]', bag='fresh'), environ)
+    assert 'class="wikilink missing"' in output
+
+
+def test_transcluded_links():
+    cache = MemoryCache()
+    inner = Tiddler('inner', 'things')
+    inner.text = 'see [[Target]]'
+    inner.type = 'text/x-markdown'
+    store.put(inner)
+
+    def environ():
+        return make_environ(**{'markdown.render_cache': cache,
+            'wikitext.type_render_map': {
+                'text/x-markdown': 'tiddlywebplugins.markdown'}})
+    outer = page('top\n\n{{inner}}')
+    assert 'class="wikilink missing"' in render(outer, environ())
+
+    target = Tiddler('Target', 'things')
+    target.text = 'here now'
+    store.put(target)
+    try:
+        assert 'missing' not in render(inner, environ())
+        # the cached render of the transcluding tiddler is stale
+        assert 'missing' not in render(outer, environ())
+    finally:
+        store.delete(target)
+        store.delete(inner)
+
+
+def test_changed_while_listing():
+    index = TitleIndex()
+    store.put(Bag('busy'))
+    list_bag_tiddlers = store.list_bag_tiddlers
+
+    def listing(bag):
+        tiddlers = list(list_bag_tiddlers(bag))
+        tiddler = Tiddler('late', 'busy')
+        tiddler.text = 'late'
+        index.add(tiddler.bag, tiddler.title)
+        return tiddlers
+    store.list_bag_tiddlers = listing
+    try:
+        assert index.contains(store, 'busy', 'late')
+    finally:
+        store.list_bag_tiddlers = list_bag_tiddlers
+
+
+def test_log():
+    root = tempfile.mkdtemp()
+    interval = titles.CHECK_INTERVAL
+    titles.CHECK_INTERVAL = 0
+    try:
+        first = TitleIndex(root)
+        assert first.contains(store, 'things', 'here')
+        assert not first.contains(store, 'things', 'there')
+        listed = len(LISTED)
+
+        # another process, sharing the log
+        second = TitleIndex(root)
+        assert second.contains(store, 'things', 'here')
+        assert len(LISTED) == listed
+        version = second.version(store, 'things')
+
+        first.add('things', 'there')
+        assert second.contains(store, 'things', 'there')
+        assert second.version(store, 'things') != version
+        version = second.version(store, 'things')
+        first.add('things', 'there')
+        assert second.version(store, 'things') == version
+
+        for _ in range(100):
+            second.discard('things', 'there')
+            first.add('things', 'there')
+        # the log was rewritten, not left to grow
+        assert len(os.listdir(root)) == 1
+        path = os.path.join(root, os.listdir(root)[0])
+        assert os.path.getsize(path) < 2000
+        assert first.contains(store, 'things', 'there')
+        assert second.contains(store, 'things', 'there')
+        assert TitleIndex(root).contains(store, 'things', 'there')
+
+        version = first.version(store, 'things')
+        first.drop('things')
+        assert os.listdir(root) == []
+        assert not second.contains(store, 'things', 'there')
+        assert len(LISTED) == listed + 1
+        assert second.version(store, 'things') != version
+    finally:
+        titles.CHECK_INTERVAL = interval
+        shutil.rmtree(root)
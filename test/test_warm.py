@@ -0,0 +1,130 @@
+"""
+Test the markdown_warm twanager command.
+"""
+
+import json
+import os
+import shutil
+import tempfile
+
+from tiddlywebplugins.markdown import init, render
+from tiddlywebplugins.markdown.cache import DiskCache
+from tiddlywebplugins.markdown.warm import warm
+from tiddlyweb.manage import COMMANDS
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.recipe import Recipe
+from tiddlyweb.model.tiddler import Tiddler
+from tiddlyweb.config import config
+
+from tiddlywebplugins.utils import get_store
+
+
+class Output(object):
+
+    def __init__(self):
+        self.lines = []
+
+    def write(self, text):
+        self.lines.append(text)
+
+
+def setup_module(module):
+    try:
+        shutil.rmtree('store')
+    except:
+        pass
+    store = get_store(config)
+    module.store = store
+
+    store.put(Bag('pages'))
+    store.put(Bag('shared'))
+    recipe = Recipe('site')
+    recipe.set_recipe([('shared', ''), ('pages', '')])
+    store.put(recipe)
+
+    for index in range(12):
+        tiddler = Tiddler('page%02d' % index, 'pages')
+        tiddler.type = 'text/x-markdown'
+        tiddler.text = 'page _%s_\n\n{{header}}\n' % index
+        store.put(tiddler)
+    header = Tiddler('header', 'shared')
+    header.type = 'text/x-markdown'
+    header.text = '# Header'
+    store.put(header)
+    other = Tiddler('other', 'pages')
+    other.type = 'text/plain'
+    other.text = 'not markdown'
+    store.put(other)
+
+
+def setup_function(function):
+    root = tempfile.mkdtemp()
+    function.root = root
+    function.config = dict(config)
+    function.config.update({
+        'markdown.wiki_link_base': '',
+        'markdown.render_cache': DiskCache(os.path.join(root, 'cache')),
+        'markdown.warm_checkpoint': os.path.join(root, 'checkpoint.json'),
+        'wikitext.type_render_map': {
+            'text/x-markdown': 'tiddlywebplugins.markdown',
+            'text/plain': 'raw',
+        },
+    })
+
+
+def teardown_function(function):
+    shutil.rmtree(function.root)
+
+
+def make_environ(warm_config):
+    return {
+        'tiddlyweb.config': warm_config,
+        'tiddlyweb.usersign': {'name': 'GUEST', 'roles': []},
+        'tiddlyweb.store': store,
+    }
+
+
+def test_warm_recipe():
+    warm_config = test_warm_recipe.config
+    output = Output()
+    stats = warm(store, warm_config, 'site', workers=2, out=output)
+    assert stats['tiddlers'] == 14
+    assert stats['rendered'] == 13
+    assert 'site: 13 of 14 tiddlers rendered' in output.lines[-1]
+
+    cache = DiskCache(os.path.join(test_warm_recipe.root, 'cache'))
+    warm_config['markdown.render_cache'] = cache
+    tiddler = store.get(Tiddler('page03', 'pages'))
+    tiddler.recipe = 'site'
+    html = render(tiddler, make_environ(warm_config))
+    assert '<h1 id="header">Header</h1>' in html
+    assert cache.stats()['hits'] == 1
+    assert cache.stats()['misses'] == 0
+    assert not os.path.exists(warm_config['markdown.warm_checkpoint'])
+
+
+def test_resume():
+    warm_config = test_resume.config
+    with open(warm_config['markdown.warm_checkpoint'], 'w') as checkpoint:
+        json.dump({'name': 'pages', 'last': 'page07'}, checkpoint)
+
+    output = Output()
+    stats = warm(store, warm_config, 'pages', workers=1, out=output)
+    assert output.lines[0] == 'resuming pages after page07\n'
+    assert stats['rendered'] == 4
+
+    # a checkpoint for something else is ignored
+    with open(warm_config['markdown.warm_checkpoint'], 'w') as checkpoint:
+        json.dump({'name': 'site', 'last': 'page07'}, checkpoint)
+    stats = warm(store, warm_config, 'pages', workers=1, out=output)
+    assert stats['rendered'] == 12
+
+
+def test_command():
+    warm_config = test_command.config
+    init(warm_config)
+    assert 'markdown_warm' in COMMANDS
+    assert COMMANDS['markdown_warm'](['pages', '1'])
+    cache = DiskCache(os.path.join(test_command.root, 'cache'))
+    entries = [name for _, _, names in os.walk(cache.root) for name in names]
+    assert len(entries) == 12
@@ -0,0 +1,54 @@
+"""
+Test warming up before the first render.
+"""
+
+from tiddlywebplugins.markdown import init, warmup
+from tiddlywebplugins.markdown.cache import MemoryCache
+from tiddlywebplugins.markdown.patterns import _COMPILED
+from tiddlywebplugins.markdown.render import ENGINES, EngineSettings
+from tiddlywebplugins.markdown.transclusion import TRANSCLUDE_RE
+from tiddlywebplugins.markdown.warmup import CORPUS
+from tiddlyweb.config import config as tiddlyweb_config
+
+
+def test_engines():
+    config = {'markdown.wiki_link_base': ''}
+    settings = EngineSettings(config)
+    ENGINES.clear()
+    report = warmup(config, engines=3)
+    assert report['engines'] == 3
+    assert report['rendered'] == 0
+    assert ENGINES.idle_count(settings) == 3
+    assert ENGINES.idle_count() == 3
+    assert (TRANSCLUDE_RE, 0) in _COMPILED
+
+    # the pool is filled up to the settings, not beyond
+    warmup(config, engines=3)
+    assert ENGINES.idle_count(settings) == 3
+
+
+def test_corpus():
+    profiled = []
+    cache = MemoryCache()
+    config = {
+        'markdown.wiki_link_base': '',
+        'markdown.interlinker': lambda environ, target: '/' + target,
+        'markdown.render_cache': cache,
+        'markdown.profile': lambda environ, profile: profiled.append(profile),
+    }
+    ENGINES.clear()
+    report = warmup(config, corpus=True)
+    assert report['rendered'] == len(CORPUS)
+    assert report['idle'] == 1
+    # the engine used for the corpus is the one requests will use
+    assert ENGINES.idle_count() == 1
+    assert cache.stats()['entries'] == 0
+    assert profiled == []
+
+
+def test_init():
+    config = dict(tiddlyweb_config)
+    config['markdown.warmup'] = True
+    ENGINES.clear()
+    init(config)
+    assert ENGINES.idle_count(EngineSettings(config)) == 1
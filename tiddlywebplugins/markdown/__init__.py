@@ -82,6 +82,14 @@ If you want all tiddlers that have no type set to be rendered
 as markdown, then configure:
 
  'wikitext.default_renderer': 'tiddlywebplugins.markdown'
+
+Adding 'tiddlywebplugins.markdown' to 'twanager_plugins' provides the
+markdown_warm command, which pre-renders a bag or recipe into the
+render cache (see tiddlywebplugins.markdown.warm).
+
+Call warmup(config) from tiddlywebconfig.py or a server's post-fork
+hook, or set 'markdown.warmup', to build engines and compile patterns
+before the first request (see tiddlywebplugins.markdown.warmup).
 """
 
 __version__ = '1.2.10'
@@ -92,3 +100,20 @@ from .render import render as markdown_render
 
 # keep linters happy
 render = markdown_render
+
+from .warmup import warmup
+
+
+def init(config):
+    """
+    Establish the twanager commands and the store hooks, and warm up
+    if `markdown.warmup` is set.
+    """
+    from .backlinks import init as init_backlinks
+    from .titles import init as init_titles
+    from .warm import init as init_warm
+    init_backlinks(config)
+    init_titles(config)
+    init_warm(config)
+    if config.get('markdown.warmup'):
+        warmup(config, corpus=config['markdown.warmup'] == 'corpus')
@@ -0,0 +1,217 @@
+"""
+Render markdown from asyncio code without blocking the event loop
+on the store.
+
+    output = await render_async(tiddler, environ)
+
+The text is converted on the event loop but transclusions are left
+in place (see render.bind) and expanded afterwards, with every store
+access awaited through an AsyncStore. Transcluded markdown tiddlers
+are rendered the same way, concurrently with each other; other
+renderable types are rendered in the executor. Cycle detection, the
+dependencies recorded and the HTML are the same as for render().
+
+`markdown.async_store` may name a function which, given the environ,
+returns the AsyncStore to use. By default the TiddlyWeb store is
+wrapped in an ExecutorStore.
+
+This module requires Python 3 and is not imported by the package.
+"""
+
+import asyncio
+
+from tiddlyweb.model.policy import PermissionsError
+from tiddlyweb.store import StoreError
+from tiddlyweb.util import renderable
+from tiddlyweb.wikitext import render_wikitext
+
+from .dependencies import Dependencies, tracking
+from .limits import LimitExceeded, budgeting, fallback
+from .profile import profiling, timing
+from .render import (MARKDOWN_RENDERER, EngineSettings, render_key,
+        renderer_name, convert, limits_exceeded)
+from .transclusion import TRANSCLUDE_RE, TranscludeProcessor, load_tiddlers
+
+
+# as caught by load_tiddlers
+LOAD_ERRORS = (StoreError, KeyError, PermissionsError)
+
+
+class AsyncStore(object):
+    """
+    Awaitable access to a TiddlyWeb store.
+
+    Subclasses with a native asynchronous backend implement get()
+    and may implement get_tiddlers(). Recipe and bag resolution
+    uses tiddlyweb.control and so always goes through run().
+    """
+
+    def __init__(self, store, executor=None):
+        self.store = store
+        self.executor = executor
+
+    async def run(self, func, *args):
+        """
+        Call func, which may use the synchronous store, in the
+        executor.
+        """
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.executor, func, *args)
+
+    async def get(self, thing):
+        """
+        Load thing from the store.
+        """
+        raise NotImplementedError
+
+    async def get_tiddlers(self, tiddlers):
+        """
+        Load tiddlers, returning a dict as load_tiddlers does.
+        """
+        results = await asyncio.gather(*[self.get(tiddler)
+            for tiddler in tiddlers], return_exceptions=True)
+        loaded = {}
+        for tiddler, result in zip(tiddlers, results):
+            if (isinstance(result, BaseException)
+                    and not isinstance(result, LOAD_ERRORS)):
+                raise result
+            loaded[(tiddler.bag, tiddler.title)] = result
+        return loaded
+
+
+class ExecutorStore(AsyncStore):
+    """
+    Run a synchronous store in an executor.
+    """
+
+    async def get(self, thing):
+        return await self.run(self.store.get, thing)
+
+    async def get_tiddlers(self, tiddlers):
+        return await self.run(load_tiddlers, self.store, tiddlers)
+
+
+def async_store(environ):
+    """
+    The AsyncStore for environ.
+    """
+    config = environ.get('tiddlyweb.config', {})
+    factory = config.get('markdown.async_store')
+    if factory is not None:
+        return factory(environ)
+    return ExecutorStore(environ['tiddlyweb.store'])
+
+
+async def render_async(tiddler, environ, store=None):
+    """
+    Render text in the provided tiddler to HTML.
+    """
+    output, dependencies = await render_with_dependencies_async(tiddler,
+            environ, store)
+    return output
+
+
+async def render_with_dependencies_async(tiddler, environ, store=None):
+    """
+    Render text in the provided tiddler to HTML, returning the HTML
+    and the Dependencies it was made from, within the same limits
+    as render_with_dependencies().
+    """
+    with budgeting(environ, tiddler) as budget:
+        if budget is None:
+            return await render_within_budget_async(tiddler, environ, store)
+        try:
+            budget.check_input(tiddler)
+            return await render_within_budget_async(tiddler, environ, store)
+        except LimitExceeded as exc:
+            budget.note(exc)
+            return fallback(tiddler), Dependencies()
+
+
+async def render_within_budget_async(tiddler, environ, store=None):
+    """
+    render_with_dependencies_async() within the budget, if any, of
+    the outermost render.
+    """
+    config = environ.get('tiddlyweb.config', {})
+    settings = EngineSettings(config)
+    cache = config.get('markdown.render_cache')
+
+    with profiling(environ, tiddler) as profile:
+        with tracking(environ) as dependencies:
+            if environ.get('tiddlyweb.store') is None:
+                return convert(tiddler, environ, settings), dependencies
+            if store is None:
+                store = async_store(environ)
+
+            if cache is not None:
+                with timing(profile, 'cache'):
+                    key, transcludes = render_key(tiddler, environ, settings)
+                    # validating dependencies reads the store
+                    entry = await store.run(cache.get, key, environ)
+                if entry is not None:
+                    output, recorded = entry
+                    if recorded is not None:
+                        dependencies.update(recorded)
+                    if profile is not None:
+                        profile.cached = True
+                    return output, dependencies
+
+            exceeded = limits_exceeded(environ)
+            output = convert(tiddler, environ, settings,
+                    defer_transclusion=True)
+            if settings.base is not None:
+                output = await transclude_async(output, tiddler, environ,
+                        store, profile)
+
+            if cache is not None and limits_exceeded(environ) == exceeded:
+                await store.run(cache.set, key, output,
+                        dependencies if transcludes else None)
+            return output, dependencies
+
+
+async def transclude_async(text, tiddler, environ, store, profile=None):
+    """
+    Expand the transclusions left in text by a deferred conversion.
+    """
+    processor = TranscludeProcessor(TRANSCLUDE_RE,
+            {'environ': environ, 'tiddler': tiddler})
+    processor.md = None
+
+    matches, requests = processor.collect(text)
+    if not matches:
+        return text
+
+    with timing(profile, 'transclusion.fetch'):
+        resolved = await store.run(processor.resolve_all, requests)
+        loaded = processor.loaded(
+                await store.get_tiddlers(processor.distinct(resolved)))
+
+    with timing(profile, 'transclusion.render'):
+        rendered = {}
+        branches, rest = processor.branches(
+                processor.in_order(requests, resolved, loaded))
+        while branches:
+            articles = await asyncio.gather(*[
+                article_async(processor, interior_tiddler, branch_environ,
+                    store)
+                for interior_tiddler, branch_environ in branches])
+            processor.merge(branches, articles, rendered)
+            branches, rest = processor.branches(rest)
+
+        return processor.splice(text, matches, resolved, loaded, rendered)
+
+
+async def article_async(processor, interior_tiddler, environ, store):
+    """
+    Render interior_tiddler in environ and wrap it in an article.
+    """
+    if not renderable(interior_tiddler, environ):
+        content = ''
+    elif renderer_name(interior_tiddler, environ) == MARKDOWN_RENDERER:
+        content = await render_async(interior_tiddler, environ, store)
+    else:
+        content = await store.run(render_wikitext, interior_tiddler,
+                environ)
+    return processor.wrap(interior_tiddler, content)
+
@@ -8,17 +8,41 @@ Heavily based on:
 But simpler: just finds https? prefixed links.
 """
 
-from markdown.inlinepatterns import Pattern
+import re
+
 from markdown import Extension
 from markdown.util import etree, AtomicString
 
+from .patterns import SharedPattern
+from .scan import Finder, ScanMatch
+
 BARELINK = r'(?<!">|=")(https?://[-\w./#?%=&:;@~]+)'
+BARELINK_RE = re.compile(BARELINK, re.DOTALL | re.UNICODE)
+
+
+class URLFinder(Finder):
+    """
+    Find bare URLs, carrying on from the last one found.
+    """
+
+    def find(self, data, position):
+        url = BARELINK_RE.search(data, position)
+        if url is None:
+            return None
+        return ScanMatch(data, url.start(), url.end(), url=url.group(1))
+
+
+class LinkPattern(SharedPattern):
 
+    def __init__(self, pattern, md=None):
+        SharedPattern.__init__(self, pattern, md)
+        self.finder = URLFinder()
 
-class LinkPattern(Pattern):
+    def getCompiledRegExp(self):
+        return self.finder
 
     def handleMatch(self, match):
-        url = match.group(2)
+        url = match.url
         label = url
 
         link = etree.Element('a')
@@ -0,0 +1,172 @@
+"""
+Markdown backends, which turn the text of a tiddler into HTML.
+
+Python-Markdown, with the extensions listed in render, is the
+reference backend and the default. `markdown.backend` may name
+another, or a list of names to try in order:
+
+* `mistune`: the mistune parser, pure Python and several times
+  faster than Python-Markdown.
+* `cmarkgfm`: bindings to cmark-gfm, GitHub's CommonMark parser in C.
+* `python-markdown-postpass`: Python-Markdown without this package's
+  extensions, with the TiddlyWeb features added as they are for the
+  others. It is there to check the post-pass against the reference.
+
+A backend is used if its library can be imported and it can handle
+the configured `markdown.safe_mode`. Otherwise the next name is tried,
+and in the end Python-Markdown is used. Extra `markdown.extensions`
+are Python-Markdown extensions, so when they are configured
+Python-Markdown is always used.
+
+Other backends know nothing of TiddlyWeb. Wikilinks, freelinks,
+@target links, bare URLs and transclusion are added to their HTML by
+postpass.PostPass. They make no header ids, footnotes or definition
+lists, and where Markdown is ambiguous they follow their own reading of
+it, such as CommonMark's.
+"""
+
+import importlib
+import threading
+
+
+REFERENCE = 'python-markdown'
+
+# The backend used when config does not name one.
+DEFAULT_BACKEND = REFERENCE
+
+_LOADED = {}
+
+
+class Backend(object):
+    """
+    A Markdown library other than the reference, converting text
+    with the safe mode safe. Raises ImportError if the library is not
+    installed. Parsers are built per thread, as some keep state while
+    they parse.
+    """
+
+    name = None
+    module = None
+    safe_modes = ()
+
+    def __init__(self, safe):
+        self.safe = safe
+        self.library = importlib.import_module(self.module)
+        self.local = threading.local()
+
+    def parser(self):
+        try:
+            return self.local.parser
+        except AttributeError:
+            self.local.parser = self.build()
+            return self.local.parser
+
+    def build(self):
+        """
+        Make a parser: a function from text to HTML.
+        """
+        raise NotImplementedError
+
+    def convert(self, text):
+        return self.parser()(text)
+
+
+class MistuneBackend(Backend):
+
+    name = 'mistune'
+    module = 'mistune'
+    safe_modes = ('escape', False)
+
+    def build(self):
+        escape = self.safe == 'escape'
+        # create_markdown from mistune 2, Markdown before that
+        create = getattr(self.library, 'create_markdown', None)
+        if create is not None:
+            return create(escape=escape)
+        return self.library.Markdown(escape=escape)
+
+
+class CmarkgfmBackend(Backend):
+
+    name = 'cmarkgfm'
+    module = 'cmarkgfm'
+    # without the unsafe option raw HTML is left out
+    safe_modes = ('remove', False)
+
+    def build(self):
+        options = 0
+        if self.safe is False:
+            options = getattr(self.library.cmark.Options,
+                    'CMARK_OPT_UNSAFE', 0)
+        markdown_to_html = self.library.markdown_to_html
+        return lambda text: markdown_to_html(text, options)
+
+
+class PostPassBackend(Backend):
+
+    name = 'python-markdown-postpass'
+    module = 'markdown'
+    safe_modes = (False, 'replace', 'remove', 'escape')
+
+    def build(self):
+        from .render import DEFAULT_EXTENSIONS
+        extensions = [extension for extension in DEFAULT_EXTENSIONS
+                if extension != 'tiddlywebplugins.markdown.autolink']
+        engine = self.library.Markdown(extensions=extensions,
+                output_format='html5', safe_mode=self.safe)
+
+        def convert(text):
+            try:
+                return engine.convert(text)
+            finally:
+                engine.reset()
+        return convert
+
+
+BACKENDS = dict((backend.name, backend) for backend in
+        [MistuneBackend, CmarkgfmBackend, PostPassBackend])
+
+
+def backend_for(names, safe):
+    """
+    The first Backend of names which can be used with safe mode safe,
+    or None if that is the reference backend.
+    """
+    if not isinstance(names, (list, tuple)):
+        names = [names]
+    for name in names:
+        if name == REFERENCE:
+            return None
+        backend = loaded(name, safe)
+        if backend is not None:
+            return backend
+    return None
+
+
+def loaded(name, safe):
+    """
+    The Backend called name for safe mode safe, made the first time
+    it is asked for, or None if there is no such backend, it does not
+    handle safe or its library is not installed.
+    """
+    key = (name, safe)
+    try:
+        return _LOADED[key]
+    except KeyError:
+        pass
+    backend = None
+    backend_class = BACKENDS.get(name)
+    if backend_class is not None and safe in backend_class.safe_modes:
+        try:
+            backend = backend_class(safe)
+        except ImportError:
+            pass
+    return _LOADED.setdefault(key, backend)
+
+
+def available():
+    """
+    The names of the backends which can be used here.
+    """
+    return [REFERENCE] + sorted(name for name in BACKENDS
+            if loaded(name, BACKENDS[name].safe_modes[0]) is not None)
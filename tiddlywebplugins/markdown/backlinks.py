@@ -0,0 +1,366 @@
+"""
+Collect the links in a tiddler while it is rendered, and keep an
+index of backlinks from them.
+
+render_with_links() in render returns the HTML of a tiddler with the
+Outlinks of its text: the titles of its wikilinks and freelinks, the
+places and titles of its @target links and what it transcludes. They
+are noted by the link patterns and the transclusion postprocessor as
+they work. Links in transcluded tiddlers are not counted. The text is
+converted rather than taken from a render or block cache, so that the
+links are seen.
+
+If `markdown.backlink_index` is set to a BacklinkIndex, the tiddler
+put and delete hooks (registered by init) work out the Outlinks of
+each markdown tiddler saved, converting it without transcluding, and
+update the index. backlinks() then answers which tiddlers link to or
+transclude a title from the index, without reading any tiddlers.
+Links to titles are kept by title alone: which bag a link from a
+recipe leads to depends on the recipe, and is not resolved.
+
+A BacklinkIndex keeps its entries in memory, or with root in JSON
+files below root, shared by the processes on a host. Updates there
+are serialized with a lock file and each file is replaced whole, so
+reads take no lock.
+"""
+
+import hashlib
+import json
+import os
+import threading
+
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # not on Windows
+    fcntl = None
+
+
+LINKS_KEY = 'markdown.outlinks'
+INDEX_KEY = 'markdown.backlink_index'
+
+
+class Outlinks(object):
+    """
+    The links in the text of one tiddler.
+
+    titles holds the titles linked to by wikilinks and freelinks.
+    targets holds (target, title) for each @target link, with title
+    '' for a link to the target itself. transclusions holds (target,
+    title) for each transclusion, with target '' for one from the
+    tiddler's own recipe or bag.
+    """
+
+    def __init__(self):
+        self.titles = set()
+        self.targets = set()
+        self.transclusions = set()
+
+    def __len__(self):
+        return len(self.titles) + len(self.targets) + len(self.transclusions)
+
+    def __eq__(self, other):
+        return self.to_dict() == other.to_dict()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def keys(self):
+        """
+        The (target, title) of everything linked to, target '' for
+        titles in the tiddler's own recipe or bag.
+        """
+        return (set(('', title) for title in self.titles)
+                | self.targets | self.transclusions)
+
+    def to_dict(self):
+        """
+        A JSON friendly representation.
+        """
+        return {
+            'titles': sorted(self.titles),
+            'targets': sorted(list(key) for key in self.targets),
+            'transclusions': sorted(list(key) for key in self.transclusions),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Reverse to_dict.
+        """
+        outlinks = cls()
+        outlinks.titles.update(data['titles'])
+        outlinks.targets.update(tuple(key) for key in data['targets'])
+        outlinks.transclusions.update(tuple(key)
+                for key in data['transclusions'])
+        return outlinks
+
+
+@contextmanager
+def collecting(environ):
+    """
+    Collect the links of the tiddler rendered in the block into a new
+    Outlinks.
+    """
+    outlinks = Outlinks()
+    previous = environ.get(LINKS_KEY)
+    environ[LINKS_KEY] = outlinks
+    try:
+        yield outlinks
+    finally:
+        if previous is None:
+            environ.pop(LINKS_KEY, None)
+        else:
+            environ[LINKS_KEY] = previous
+
+
+def collector(environ):
+    """
+    The Outlinks being collected into, or None, as for the renders of
+    transcluded tiddlers.
+    """
+    if environ.get('markdown.transclusions'):
+        return None
+    return environ.get(LINKS_KEY)
+
+
+def note_title(environ, title):
+    outlinks = collector(environ)
+    if outlinks is not None:
+        outlinks.titles.add(title)
+
+
+def note_target(environ, target, title=''):
+    outlinks = collector(environ)
+    if outlinks is not None:
+        outlinks.targets.add((target, title))
+
+
+def note_transclusion(environ, title, target):
+    outlinks = collector(environ)
+    if outlinks is not None:
+        outlinks.transclusions.add((target or '', title))
+
+
+def outlinks_of(tiddler, environ):
+    """
+    The Outlinks of tiddler, converting its text without transcluding.
+    """
+    # render and transclusion import links, which imports this
+    from .render import EngineSettings, convert
+    from .transclusion import TRANSCLUDE_RE, TranscludeProcessor
+    settings = EngineSettings(environ.get('tiddlyweb.config', {}))
+    with collecting(environ) as outlinks:
+        html = convert(tiddler, environ, settings, defer_transclusion=True)
+        if settings.base is not None:
+            processor = TranscludeProcessor(TRANSCLUDE_RE,
+                    {'environ': environ, 'tiddler': tiddler})
+            processor.md = None
+            processor.collect(html)
+    return outlinks
+
+
+class BacklinkIndex(object):
+    """
+    The Outlinks of each tiddler, by (bag, title), and the reverse: the
+    tiddlers linking to each (target, title). In memory or, with root,
+    in files below root.
+    """
+
+    def __init__(self, root=None):
+        self.root = root
+        self._sources = {}
+        self._targets = {}
+        self._lock = threading.Lock()
+        if root is not None:
+            for directory in ['sources', 'targets']:
+                path = os.path.join(root, directory)
+                if not os.path.isdir(path):
+                    os.makedirs(path)
+
+    def backlinks(self, title, target=''):
+        """
+        The (bag, title) of the tiddlers which link to or transclude
+        title, in target if given, sorted.
+        """
+        return sorted(self._get_target((target, title)))
+
+    def outlinks(self, bag, title):
+        """
+        The Outlinks recorded for the tiddler title in bag, or None.
+        """
+        return self._get_source((bag, title))
+
+    def update(self, bag, title, outlinks):
+        """
+        Record outlinks, or None to forget them, for the tiddler title
+        in bag.
+        """
+        source = (bag, title)
+        with self._locked():
+            previous = self._get_source(source)
+            before = previous.keys() if previous is not None else set()
+            after = outlinks.keys() if outlinks else set()
+            for key in before - after:
+                sources = self._get_target(key)
+                sources.discard(source)
+                self._set_target(key, sources)
+            for key in after - before:
+                sources = self._get_target(key)
+                sources.add(source)
+                self._set_target(key, sources)
+            if outlinks or previous is not None:
+                self._set_source(source, outlinks or None)
+
+    def remove(self, bag, title):
+        self.update(bag, title, None)
+
+    def remove_bag(self, bag):
+        """
+        Forget the tiddlers in bag, as when it is deleted.
+        """
+        for source_bag, title in self._source_keys():
+            if source_bag == bag:
+                self.remove(source_bag, title)
+
+    @contextmanager
+    def _locked(self):
+        with self._lock:
+            if self.root is None or fcntl is None:
+                yield
+                return
+            with open(os.path.join(self.root, 'lock'), 'a') as lock:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+                yield
+
+    def _path(self, directory, key):
+        digest = hashlib.sha1('\0'.join(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.root, directory, digest + '.json')
+
+    def _get_source(self, key):
+        if self.root is None:
+            return self._sources.get(key)
+        data = read_json(self._path('sources', key))
+        if data is None:
+            return None
+        return Outlinks.from_dict(data['links'])
+
+    def _set_source(self, key, outlinks):
+        if self.root is None:
+            if outlinks is None:
+                self._sources.pop(key, None)
+            else:
+                self._sources[key] = outlinks
+            return
+        path = self._path('sources', key)
+        if outlinks is None:
+            remove(path)
+        else:
+            write_json(path, {'source': list(key),
+                'links': outlinks.to_dict()})
+
+    def _source_keys(self):
+        if self.root is None:
+            with self._lock:
+                return list(self._sources)
+        directory = os.path.join(self.root, 'sources')
+        keys = []
+        for filename in os.listdir(directory):
+            data = read_json(os.path.join(directory, filename))
+            if data is not None:
+                keys.append(tuple(data['source']))
+        return keys
+
+    def _get_target(self, key):
+        if self.root is None:
+            return set(self._targets.get(key, ()))
+        data = read_json(self._path('targets', key))
+        if data is None:
+            return set()
+        return set(tuple(source) for source in data['sources'])
+
+    def _set_target(self, key, sources):
+        if self.root is None:
+            if sources:
+                self._targets[key] = sources
+            else:
+                self._targets.pop(key, None)
+            return
+        path = self._path('targets', key)
+        if sources:
+            write_json(path, {'target': list(key),
+                'sources': sorted(list(source) for source in sources)})
+        else:
+            remove(path)
+
+
+def read_json(path):
+    try:
+        with open(path) as entry:
+            return json.load(entry)
+    except (IOError, ValueError):
+        return None
+
+
+def write_json(path, data):
+    """
+    Replace the file at path with data, so readers see all of the old
+    or all of the new.
+    """
+    temporary = '%s.%s.%s' % (path, os.getpid(),
+            threading.current_thread().ident)
+    with open(temporary, 'w') as entry:
+        json.dump(data, entry)
+    os.rename(temporary, path)
+
+
+def remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def hooked_index(store):
+    return store.environ.get('tiddlyweb.config', {}).get(INDEX_KEY)
+
+
+def tiddler_put_hook(store, tiddler):
+    index = hooked_index(store)
+    if index is None:
+        return
+    # render imports links, which imports this
+    from .render import MARKDOWN_RENDERER, renderer_name
+    environ = dict(store.environ)
+    environ['tiddlyweb.store'] = store
+    if renderer_name(tiddler, environ) == MARKDOWN_RENDERER:
+        index.update(tiddler.bag, tiddler.title,
+                outlinks_of(tiddler, environ))
+    else:
+        index.remove(tiddler.bag, tiddler.title)
+
+
+def tiddler_delete_hook(store, tiddler):
+    index = hooked_index(store)
+    if index is not None:
+        index.remove(tiddler.bag, tiddler.title)
+
+
+def bag_delete_hook(store, bag):
+    index = hooked_index(store)
+    if index is not None:
+        index.remove_bag(bag.name)
+
+
+def init(config):
+    """
+    Register the store hooks which keep the index up to date.
+    """
+    from tiddlyweb.store import HOOKS
+    for entity, action, hook in [
+            ('tiddler', 'put', tiddler_put_hook),
+            ('tiddler', 'delete', tiddler_delete_hook),
+            ('bag', 'delete', bag_delete_hook)]:
+        if hook not in HOOKS[entity][action]:
+            HOOKS[entity][action].append(hook)
@@ -0,0 +1,177 @@
+"""
+Render many tiddlers at once, for re-rendering whole bags or recipes.
+
+    for tiddler, output in render_many(tiddlers, environ, workers=4):
+        ...
+
+Tiddlers which do not transclude are sent, in chunks, to a pool of
+worker processes. Tiddlers which do transclude, or have links to mark
+missing (see titles), need the store and are rendered in this process
+when their turn comes; by then the output of every tiddler before
+them (and any finished after) is in the render cache, so interior
+tiddlers already rendered are not rendered again.
+Results come back in input order, and only a few chunks are in flight
+at any time, so memory use does not grow with the number of tiddlers.
+
+Worker processes get a copy of the environ without the store and the
+render cache, which must be usable in another process (as it is when
+processes are forked).
+"""
+
+from collections import deque
+from multiprocessing import Pool, cpu_count
+
+from tiddlyweb.model.tiddler import Tiddler
+
+from .cache import MemoryCache, cache_key
+from .limits import LIMITS_KEY
+from .render import EngineSettings, linking, render, transcluding
+
+
+CHUNK_SIZE = 16
+
+# How many chunks per worker to have in flight.
+CHUNKS_AHEAD = 2
+
+WORKER_ENVIRON = {}
+
+
+def render_many(tiddlers, environ, workers=None, chunksize=CHUNK_SIZE):
+    """
+    Render each of tiddlers, yielding (tiddler, html) in input order.
+
+    workers is the number of processes to use, by default one per
+    CPU. With fewer than two, everything is rendered in this process.
+    If no markdown.render_cache is configured a MemoryCache is used
+    for the length of the run.
+    """
+    config = environ.get('tiddlyweb.config', {})
+    settings = EngineSettings(config)
+    cache = config.get('markdown.render_cache')
+    if cache is None:
+        cache = MemoryCache()
+        config = dict(config)
+        config['markdown.render_cache'] = cache
+        environ = dict(environ)
+        environ['tiddlyweb.config'] = config
+
+    if workers is None:
+        workers = cpu_count()
+    if workers < 2:
+        for tiddler in tiddlers:
+            yield tiddler, render(tiddler, environ)
+        return
+
+    pool = Pool(workers, start_worker, (worker_environ(environ),))
+    try:
+        pending = deque()
+        for batch in batches(tiddlers, settings, chunksize):
+            pending.append(submit(pool, batch, cache, settings))
+            while len(pending) > workers * CHUNKS_AHEAD:
+                for result in finish(pending.popleft(), environ):
+                    yield result
+        while pending:
+            for result in finish(pending.popleft(), environ):
+                yield result
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def batches(tiddlers, settings, chunksize):
+    """
+    Group tiddlers into lists of up to chunksize tiddlers which do not
+    transclude, or single tiddlers which may (or which have links to
+    check against a title index), paired with whether they can be
+    rendered in a worker.
+    """
+    batch = []
+    for tiddler in tiddlers:
+        if transcluding(tiddler, settings) or linking(tiddler.text,
+                settings):
+            if batch:
+                yield batch, True
+                batch = []
+            yield [tiddler], False
+        else:
+            batch.append(tiddler)
+            if len(batch) >= chunksize:
+                yield batch, True
+                batch = []
+    if batch:
+        yield batch, True
+
+
+def submit(pool, batch, cache, settings):
+    """
+    Send batch to the pool if it can be rendered there. Outputs are
+    put in the render cache as soon as they arrive, unless a limit was
+    hit making them.
+    """
+    tiddlers, in_worker = batch
+    if not in_worker:
+        return tiddlers, None
+
+    def remember(outputs):
+        for tiddler, (output, limited) in zip(tiddlers, outputs):
+            if not limited:
+                cache.set(cache_key(tiddler.text, settings), output)
+
+    return tiddlers, pool.apply_async(render_chunk,
+            ([portable(tiddler) for tiddler in tiddlers],),
+            callback=remember)
+
+
+def finish(entry, environ):
+    """
+    Yield (tiddler, html) for a submitted batch.
+    """
+    tiddlers, result = entry
+    if result is None:
+        for tiddler in tiddlers:
+            yield tiddler, render(tiddler, environ)
+    else:
+        for tiddler, (output, _) in zip(tiddlers, result.get()):
+            yield tiddler, output
+
+
+def portable(tiddler):
+    """
+    What a worker needs of tiddler to render it.
+    """
+    return (tiddler.title, tiddler.bag, tiddler.recipe, tiddler.type,
+            tiddler.text)
+
+
+def worker_environ(environ):
+    """
+    The part of environ workers get.
+    """
+    config = dict(environ.get('tiddlyweb.config', {}))
+    config.pop('markdown.render_cache', None)
+    copy = dict((key, value) for key, value in environ.items()
+            if key != 'tiddlyweb.store' and not key.startswith('markdown.'))
+    copy['tiddlyweb.config'] = config
+    return copy
+
+
+def start_worker(environ):
+    WORKER_ENVIRON.clear()
+    WORKER_ENVIRON.update(environ)
+
+
+def render_chunk(chunk):
+    """
+    Render, in a worker, tiddlers sent by portable(). Returns (html,
+    limited) for each, limited if a limit (see limits) was hit.
+    """
+    outputs = []
+    for title, bag, recipe, tiddler_type, text in chunk:
+        tiddler = Tiddler(title, bag)
+        tiddler.recipe = recipe
+        tiddler.type = tiddler_type
+        tiddler.text = text
+        environ = dict(WORKER_ENVIRON)
+        output = render(tiddler, environ)
+        outputs.append((output, bool(environ.get(LIMITS_KEY))))
+    return outputs
@@ -0,0 +1,438 @@
+"""
+Caching of rendered HTML.
+
+If `markdown.render_cache` is set in config to an instance of one of
+the classes here, render() first looks for HTML previously produced
+from the same text under the same rendering configuration and only
+runs Python-Markdown on a miss:
+
+    from tiddlywebplugins.markdown.cache import MemoryCache
+    config = {
+        'markdown.render_cache': MemoryCache(max_bytes=64 * 1024 * 1024),
+    }
+
+Keys are a hash of the text and of the settings which affect the
+output, so a changed tiddler simply misses. HTML from tiddlers which
+transclude others is stored with the Dependencies of its render and is
+only returned while those are current.
+
+SharedCache(path) keeps entries in a memory-mapped file which every
+process on a host maps, so that pre-forked WSGI workers share one
+bounded cache instead of each holding (and warming) its own.
+
+Other backends need only implement _get, _set and clear.
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import struct
+import threading
+import zlib
+
+try:
+    import fcntl
+except ImportError:  # not on Windows
+    fcntl = None
+
+from collections import OrderedDict
+
+from . import __version__
+from .dependencies import Dependencies
+
+
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+
+
+def identity(thing):
+    """
+    A name for a configured function which is the same in every
+    process, so keys can be shared between processes.
+    """
+    if thing is None:
+        return ''
+    try:
+        return '%s.%s' % (thing.__module__, thing.__name__)
+    except AttributeError:
+        return repr(thing)
+
+
+def extension_identity(extension):
+    """
+    A name for a configured extension, given by name or as an
+    Extension instance, which is the same in every process.
+    """
+    if hasattr(extension, 'split'):
+        return extension
+    configs = getattr(extension, 'getConfigs', dict)()
+    return '%s.%s%r' % (extension.__class__.__module__,
+            extension.__class__.__name__, sorted(configs.items()))
+
+
+def cache_key(text, settings, context=()):
+    """
+    Hash text, the EngineSettings used to render it and any
+    further context strings the output depends on.
+    """
+    digest = hashlib.sha1()
+    for part in [__version__, repr(settings.safe), repr(settings.base),
+            identity(settings.interlinker),
+            '\0'.join(extension_identity(extension)
+                for extension in settings.extensions),
+            settings.configs_signature, settings.server,
+            settings.backend_name] + list(context):
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    digest.update(text.encode('utf-8'))
+    return digest.hexdigest()
+
+
+class RenderCache(object):
+    """
+    Base class for render caches, counting hits and misses. Entries
+    which are found but whose dependencies have changed count as
+    misses and as stale.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+
+    def get(self, key, environ=None):
+        """
+        Return the (html, dependencies) stored under key, or None
+        if there is no entry or its dependencies are not current
+        in environ. dependencies is None for HTML that depends on
+        nothing but the key.
+        """
+        entry = self._get(key)
+        if entry is not None and entry[1] is not None:
+            if environ is None or not entry[1].current(environ):
+                self.stale += 1
+                entry = None
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return entry
+
+    def set(self, key, html, dependencies=None):
+        """
+        Store html, rendered with dependencies, under key.
+        """
+        self._set(key, html, dependencies)
+
+    def stats(self):
+        """
+        Report cache effectiveness.
+        """
+        return {'hits': self.hits, 'misses': self.misses,
+                'stale': self.stale}
+
+    def clear(self):
+        raise NotImplementedError
+
+    def _get(self, key):
+        raise NotImplementedError
+
+    def _set(self, key, html, dependencies):
+        raise NotImplementedError
+
+
+class MemoryCache(RenderCache):
+    """
+    An in-process least recently used cache holding at most
+    max_bytes of (utf-8 encoded) HTML.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        RenderCache.__init__(self)
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, key):
+        with self._lock:
+            try:
+                html, dependencies, size = self._entries.pop(key)
+            except KeyError:
+                return None
+            self._entries[key] = (html, dependencies, size)
+            return html, dependencies
+
+    def _set(self, key, html, dependencies):
+        size = len(html.encode('utf-8'))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            try:
+                self.size -= self._entries.pop(key)[2]
+            except KeyError:
+                pass
+            self._entries[key] = (html, dependencies, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                self.size -= self._entries.popitem(last=False)[1][2]
+
+    def stats(self):
+        stats = RenderCache.stats(self)
+        stats.update({'entries': len(self._entries), 'bytes': self.size})
+        return stats
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+
+class DiskCache(RenderCache):
+    """
+    A cache keeping one JSON file per entry below root, which
+    survives restarts and may be shared by several processes.
+    """
+
+    def __init__(self, root):
+        RenderCache.__init__(self)
+        self.root = root
+
+    def _path(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    def _get(self, key):
+        try:
+            with open(self._path(key), 'rb') as entry:
+                data = json.loads(entry.read().decode('utf-8'))
+        except (IOError, OSError, ValueError):
+            return None
+        dependencies = data['dependencies']
+        if dependencies is not None:
+            dependencies = Dependencies.from_dict(dependencies)
+        return data['html'], dependencies
+
+    def _set(self, key, html, dependencies):
+        if dependencies is not None:
+            dependencies = dependencies.to_dict()
+        data = json.dumps({'html': html, 'dependencies': dependencies})
+        path = self._path(key)
+        directory = os.path.dirname(path)
+        try:
+            os.makedirs(directory)
+        except OSError:
+            if not os.path.isdir(directory):
+                raise
+        # write then rename so readers never see a partial entry
+        import tempfile
+        handle, temp_path = tempfile.mkstemp(dir=directory)
+        with os.fdopen(handle, 'wb') as entry:
+            entry.write(data.encode('utf-8'))
+        try:
+            os.rename(temp_path, path)
+        except OSError:
+            # another process got there first
+            os.unlink(temp_path)
+
+    def clear(self):
+        for directory in os.listdir(self.root):
+            directory = os.path.join(self.root, directory)
+            for name in os.listdir(directory):
+                os.unlink(os.path.join(directory, name))
+
+
+class SharedCache(RenderCache):
+    """
+    A cache of at most max_bytes in a memory-mapped file at path,
+    shared by every process which opens the same path.
+
+    The file holds a header, a table of slots and a ring of records.
+    Each record is the JSON of an entry with the SHA-1 of its key and a
+    CRC-32 of the JSON in front. A slot, found by probing from the
+    hash of the key, holds the key's SHA-1 and where its record is.
+    Records are written one after another around the ring, so the
+    oldest are overwritten first, and a slot is reused from the least
+    recently written of those probed.
+
+    Writers take an exclusive lock on the file. Readers take no lock:
+    a record which has been overwritten, or is being written, fails
+    the SHA-1 or CRC-32 check and counts as a miss.
+
+    Each process opens and maps the file itself, when it first uses the
+    cache, so a SharedCache made in tiddlywebconfig.py before a server
+    forks is opened again in each worker. Locks on a file opened
+    before the fork would be shared by the workers, and so exclude
+    none of them.
+    """
+
+    MAGIC = b'MDCACHE1'
+    HEADER = struct.Struct('<8sIQQQ')  # magic, slots, ring size, head, serial
+    SLOT = struct.Struct('<20sQIQ')  # digest, offset, length, serial
+    RECORD = struct.Struct('<20sII')  # digest, length, crc32
+    SLOT_BYTES = 2048  # of max_bytes, per slot
+    PROBES = 8
+
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES):
+        RenderCache.__init__(self)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.slots = max(64, max_bytes // self.SLOT_BYTES)
+        self.ring_start = self.HEADER.size + self.slots * self.SLOT.size
+        self.ring_size = max_bytes - self.ring_start
+        if self.ring_size < 4096:
+            raise ValueError('max_bytes too small for a SharedCache')
+        # (pid, file, map, lock) of the process which opened the file
+        self._opened = self._open()
+
+    def _open(self):
+        """
+        Open, and if it is new set up, the file at path, and map it.
+        """
+        handle = os.fdopen(os.open(self.path, os.O_RDWR | os.O_CREAT), 'r+b')
+        lock = threading.Lock()
+        with FileLock(lock, handle):
+            if os.fstat(handle.fileno()).st_size == 0:
+                handle.truncate(self.max_bytes)
+                handle.seek(0)
+                handle.write(self.HEADER.pack(self.MAGIC, self.slots,
+                    self.ring_size, 0, 0))
+                handle.flush()
+            handle.seek(0)
+            header = handle.read(self.HEADER.size)
+        # other processes may have the file mapped, so it is not resized
+        if (os.fstat(handle.fileno()).st_size != self.max_bytes
+                or self.HEADER.unpack(header)[:3] != (self.MAGIC,
+                    self.slots, self.ring_size)):
+            handle.close()
+            raise ValueError('%s is not a SharedCache of %s bytes'
+                    % (self.path, self.max_bytes))
+        return (os.getpid(), handle, mmap.mmap(handle.fileno(),
+            self.max_bytes), lock)
+
+    def _current(self):
+        """
+        The (pid, file, map, lock) of this process, opening the file
+        again if it was opened by another.
+        """
+        opened = self._opened
+        if opened[0] != os.getpid():
+            opened = self._opened = self._open()
+        return opened
+
+    def _get(self, key):
+        digest = hashlib.sha1(key.encode('utf-8')).digest()
+        mapped = self._current()[2]
+        for position in self._probes(digest):
+            slot_digest, offset, length, _ = self.SLOT.unpack_from(
+                    mapped, position)
+            if slot_digest == digest:
+                break
+        else:
+            return None
+        if offset + self.RECORD.size + length > self.ring_size:
+            return None
+        start = self.ring_start + offset
+        record_digest, record_length, crc = self.RECORD.unpack_from(
+                mapped, start)
+        if record_digest != digest or record_length != length:
+            return None
+        start += self.RECORD.size
+        payload = mapped[start:start + length]
+        if zlib.crc32(payload) & 0xffffffff != crc:
+            return None
+        try:
+            data = json.loads(payload.decode('utf-8'))
+        except ValueError:
+            return None
+        dependencies = data['dependencies']
+        if dependencies is not None:
+            dependencies = Dependencies.from_dict(dependencies)
+        return data['html'], dependencies
+
+    def _set(self, key, html, dependencies):
+        if dependencies is not None:
+            dependencies = dependencies.to_dict()
+        payload = json.dumps({'html': html,
+            'dependencies': dependencies}).encode('utf-8')
+        size = self.RECORD.size + len(payload)
+        # keep room for more than one entry
+        if size > self.ring_size // 4:
+            return
+        digest = hashlib.sha1(key.encode('utf-8')).digest()
+        _, handle, mapped, lock = self._current()
+        with FileLock(lock, handle):
+            _, _, _, head, serial = self.HEADER.unpack_from(mapped, 0)
+            if head + size > self.ring_size:
+                head = 0
+            serial += 1
+            start = self.ring_start + head
+            mapped[start + self.RECORD.size:start + size] = payload
+            self.RECORD.pack_into(mapped, start, digest, len(payload),
+                    zlib.crc32(payload) & 0xffffffff)
+            self.SLOT.pack_into(mapped, self._free_slot(mapped, digest),
+                    digest, head, len(payload), serial)
+            self.HEADER.pack_into(mapped, 0, self.MAGIC, self.slots,
+                    self.ring_size, head + size, serial)
+
+    def _probes(self, digest):
+        """
+        The positions of the slots where the key with digest may be.
+        """
+        bucket = struct.unpack('<Q', digest[:8])[0]
+        for probe in range(self.PROBES):
+            yield (self.HEADER.size
+                    + ((bucket + probe) % self.slots) * self.SLOT.size)
+
+    def _free_slot(self, mapped, digest):
+        """
+        The position of the slot to put the key with digest in: its
+        own, or else the least recently written of its probes.
+        """
+        oldest = None
+        for position in self._probes(digest):
+            slot_digest, _, _, serial = self.SLOT.unpack_from(
+                    mapped, position)
+            if slot_digest == digest:
+                return position
+            if oldest is None or serial < oldest[0]:
+                oldest = (serial, position)
+        return oldest[1]
+
+    def stats(self):
+        stats = RenderCache.stats(self)
+        stats.update({'bytes': self.max_bytes, 'slots': self.slots})
+        return stats
+
+    def clear(self):
+        _, handle, mapped, lock = self._current()
+        with FileLock(lock, handle):
+            mapped[self.HEADER.size:self.ring_start] = (
+                    b'\0' * (self.ring_start - self.HEADER.size))
+            self.HEADER.pack_into(mapped, 0, self.MAGIC, self.slots,
+                    self.ring_size, 0, 0)
+
+    def close(self):
+        _, handle, mapped, _ = self._opened
+        mapped.close()
+        handle.close()
+
+
+class FileLock(object):
+    """
+    Hold lock, and an exclusive lock on the open file handle, for the
+    length of a with block.
+    """
+
+    def __init__(self, lock, handle):
+        self.lock = lock
+        self.handle = handle
+
+    def __enter__(self):
+        self.lock.acquire()
+        if fcntl is not None:
+            fcntl.flock(self.handle.fileno(), fcntl.LOCK_EX)
+
+    def __exit__(self, *exc_info):
+        if fcntl is not None:
+            fcntl.flock(self.handle.fileno(), fcntl.LOCK_UN)
+        self.lock.release()
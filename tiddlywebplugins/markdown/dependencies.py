@@ -0,0 +1,175 @@
+"""
+Track what the HTML rendered from a tiddler depends on besides its
+own text: the tiddlers it transcludes (at the revisions used), how
+each transcluded title was resolved to a bag, the recipes and bags
+whose contents or policies took part in that resolution, and, with a
+title index (see titles), the versions of the titles links were
+checked against.
+
+Every render() records into a fresh Dependencies which, when the
+render is nested inside another (by transclusion), is merged into the
+outer one. A cached render is reused only while Dependencies.current()
+holds, so HTML from transcluding tiddlers can be cached without a TTL.
+
+TiddlyWeb recipes and bags carry no revision, so a fingerprint of
+their recipe list and policy is recorded in place of one.
+"""
+
+import hashlib
+
+from contextlib import contextmanager
+
+
+STACK_KEY = 'markdown.dependencies'
+
+
+class Dependencies(object):
+    """
+    The inputs, other than its text, of one render.
+
+    tiddlers maps (bag, title) to the revision transcluded, or None
+    if the tiddler could not be found. resolutions maps (target,
+    recipe, bag, title), describing a transclusion and the context it
+    happened in, to the name of the bag it resolved to, or None.
+    recipes and bags map names to fingerprints, or None if missing.
+    links maps (recipe, bag), where links were marked missing or not,
+    to the versions of the titles there (see titles.versions).
+    """
+
+    def __init__(self):
+        self.tiddlers = {}
+        self.resolutions = {}
+        self.recipes = {}
+        self.bags = {}
+        self.links = {}
+
+    def __len__(self):
+        return (len(self.tiddlers) + len(self.resolutions)
+                + len(self.recipes) + len(self.bags) + len(self.links))
+
+    def __eq__(self, other):
+        return self.to_dict() == other.to_dict()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def update(self, other):
+        """
+        Merge the dependencies in other into these.
+        """
+        self.tiddlers.update(other.tiddlers)
+        self.resolutions.update(other.resolutions)
+        self.recipes.update(other.recipes)
+        self.bags.update(other.bags)
+        self.links.update(other.links)
+
+    def current(self, environ):
+        """
+        True if every input is unchanged in the store in environ.
+        """
+        # transclusion imports this module
+        from .transclusion import current_dependencies
+        return current_dependencies(environ, self)
+
+    def to_dict(self):
+        """
+        A JSON friendly representation.
+        """
+        return {
+            'tiddlers': sorted([bag, title, revision] for (bag, title),
+                revision in self.tiddlers.items()),
+            'resolutions': sorted(list(key) + [bag] for key, bag
+                in self.resolutions.items()),
+            'recipes': self.recipes,
+            'bags': self.bags,
+            'links': sorted([recipe, bag, versions] for (recipe, bag),
+                versions in self.links.items()),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Reverse to_dict.
+        """
+        dependencies = cls()
+        for bag, title, revision in data['tiddlers']:
+            dependencies.tiddlers[(bag, title)] = revision
+        for target, recipe, bag, title, resolved in data['resolutions']:
+            dependencies.resolutions[(target, recipe, bag, title)] = resolved
+        dependencies.recipes.update(data['recipes'])
+        dependencies.bags.update(data['bags'])
+        for recipe, bag, versions in data.get('links', []):
+            dependencies.links[(recipe, bag)] = versions
+        return dependencies
+
+
+@contextmanager
+def tracking(environ):
+    """
+    Record dependencies into a new Dependencies for the duration
+    of the block, then merge them into any enclosing render's.
+    """
+    dependencies = Dependencies()
+    stack = environ.setdefault(STACK_KEY, [])
+    stack.append(dependencies)
+    try:
+        yield dependencies
+    finally:
+        stack.pop()
+        if stack:
+            stack[-1].update(dependencies)
+
+
+def recording(environ):
+    """
+    The Dependencies currently being recorded into, or None.
+    """
+    stack = environ.get(STACK_KEY)
+    if stack:
+        return stack[-1]
+    return None
+
+
+def fingerprint(entity):
+    """
+    Stand in for a revision of a recipe or bag: a hash of its
+    policy and, for recipes, its recipe list.
+    """
+    policy = entity.policy
+    parts = [getattr(policy, attribute) for attribute in policy.attributes]
+    if hasattr(entity, 'get_recipe'):
+        parts.append(entity.get_recipe())
+    return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+
+
+def note_tiddler(environ, bag, title, revision):
+    dependencies = recording(environ)
+    if dependencies is not None:
+        dependencies.tiddlers[(bag, title)] = revision
+
+
+def note_resolution(environ, target, tiddler, title, bag):
+    dependencies = recording(environ)
+    if dependencies is not None:
+        dependencies.resolutions[(target or '', tiddler.recipe or '',
+            tiddler.bag or '', title)] = bag
+
+
+def note_recipe(environ, name, recipe):
+    dependencies = recording(environ)
+    if dependencies is not None:
+        dependencies.recipes[name] = (None if recipe is None
+                else fingerprint(recipe))
+
+
+def note_bag(environ, name, bag):
+    dependencies = recording(environ)
+    if dependencies is not None:
+        dependencies.bags[name] = None if bag is None else fingerprint(bag)
+
+
+def note_links(environ, tiddler, versions):
+    dependencies = recording(environ)
+    if dependencies is not None:
+        dependencies.links[(tiddler.recipe or '', tiddler.bag or '')] = \
+                versions
@@ -0,0 +1,171 @@
+"""
+Incremental rendering: after an edit, convert again only the parts of
+a tiddler which changed.
+
+If `markdown.block_cache` is set to a render cache (see cache), the
+text of a tiddler is split into groups of top level blocks and each
+group is converted on its own, with its HTML cached under a hash of
+its text. After a small edit to a long tiddler only the edited group
+misses.
+
+The text is split at blank lines, except where Python-Markdown may
+add the block after to an element of the block before: a list item
+or indented line after a list, a quote after a quote, an indented
+line after code or a definition, and a definition (or the paragraph
+which is the term of one) after a definition list. Nor is it split
+within or straight after fenced code, whose HTML is followed by a
+newline of its own, or after code followed by more than one blank
+line.
+
+Some features reach across the whole document, so tiddlers which use
+them are converted whole: footnotes, reference definitions, HTML
+blocks, and extensions from `markdown.extensions`. The same happens
+when two groups give headers the same id, because headerid would have
+numbered them apart.
+"""
+
+import re
+
+from markdown.extensions.fenced_code import FencedBlockPreprocessor
+
+
+FENCED_BLOCK_RE = FencedBlockPreprocessor.FENCED_BLOCK_RE
+
+# The kinds of element a run of lines may end with, to which
+# Python-Markdown can add the next block.
+KINDS = [(kind, re.compile(expression, re.MULTILINE)) for kind, expression
+        in [('code', r'^[ \t]'),
+            ('list', r'^ {0,3}(?:[*+-]|\d+\.)[ \t]'),
+            ('quote', r'^ {0,3}>'),
+            ('definition', r'^ {0,3}:[ ]{1,3}')]]
+KINDS_BY_NAME = dict(KINDS)
+INDENTED_KINDS = set(['code', 'list', 'definition'])
+
+# Features which need the whole document.
+WHOLE_DOCUMENT_RE = re.compile(r'\[\^|^ {0,3}\[[^\]\n]*\]:|^<',
+        re.MULTILINE)
+
+HEADER_ID_RE = re.compile(r'<h[1-6] id="([^"]*)"')
+
+
+def blank(line):
+    return not line.strip(' \t')
+
+
+def paragraphs(lines):
+    """
+    The (first, last) line indexes of the runs of lines in lines
+    between blank lines.
+    """
+    runs = []
+    first = None
+    for index, line in enumerate(lines):
+        if blank(line):
+            if first is not None:
+                runs.append((first, index - 1))
+                first = None
+        elif first is None:
+            first = index
+    if first is not None:
+        runs.append((first, len(lines) - 1))
+    return runs
+
+
+def fenced_lines(text):
+    """
+    The indexes of the lines in text which are within fenced code,
+    after its first line.
+    """
+    inside = set()
+    line = 0
+    position = 0
+    for match in FENCED_BLOCK_RE.finditer(text):
+        line += text.count('\n', position, match.start())
+        lines = match.group(0).count('\n')
+        inside.update(range(line + 1, line + lines + 1))
+        line += lines
+        position = match.end()
+    return inside
+
+
+def run_kinds(run):
+    """
+    The kinds of element run, some lines of text, may end with.
+    """
+    return set(kind for kind, expression in KINDS if expression.search(run))
+
+
+def begins(kind, line):
+    return bool(KINDS_BY_NAME[kind].match(line))
+
+
+def joins(line, kinds, next_line, ending):
+    """
+    Whether a run starting with line, with kinds of lines, and followed
+    by a run starting with next_line, may be added to an element of a
+    kind in ending.
+    """
+    return ((begins('list', line) and 'list' in ending)
+            or (begins('quote', line) and 'quote' in ending)
+            or (line[:1] in (' ', '\t') and bool(ending & INDENTED_KINDS))
+            # a definition without a term takes the paragraph before
+            or begins('definition', line)
+            or (('definition' in kinds or begins('definition', next_line))
+                and 'definition' in ending))
+
+
+def block_groups(text):
+    """
+    Split text into groups of top level blocks which convert the same
+    on their own as within text, or return None if text uses features
+    which need the whole document.
+    """
+    text = text.replace('\r\n', '\n').replace('\r', '\n')
+    if WHOLE_DOCUMENT_RE.search(text):
+        return None
+
+    lines = text.split('\n')
+    fenced = fenced_lines(text)
+    runs = []
+    for first, last in paragraphs(lines):
+        if first in fenced:
+            runs[-1] = (runs[-1][0], last)
+        else:
+            runs.append((first, last))
+    if not runs:
+        return None
+
+    kinds = [run_kinds('\n'.join(lines[first:last + 1]))
+        for first, last in runs]
+    # the first line of each run, and of none after the last
+    heads = [lines[first] for first, _ in runs] + ['']
+
+    starts = [0]
+    # what the group so far may end with
+    ending = set(kinds[0])
+    for index, ((_, end), (first, _)) in enumerate(zip(runs, runs[1:])):
+        if (joins(heads[index + 1], kinds[index + 1], heads[index + 2],
+                    ending)
+                or ('code' in ending and first - end > 2)
+                or end in fenced):
+            ending.update(kinds[index + 1])
+        else:
+            starts.append(first)
+            ending = set(kinds[index + 1])
+
+    ends = starts[1:] + [len(lines)]
+    return ['\n'.join(lines[start:end]) for start, end in zip(starts, ends)]
+
+
+def join_groups(outputs):
+    """
+    The HTML of a document from the HTML of its groups, or None if
+    two groups have headers with the same id.
+    """
+    seen = set()
+    for output in outputs:
+        ids = set(HEADER_ID_RE.findall(output))
+        if ids & seen:
+            return None
+        seen.update(ids)
+    return '\n'.join(output for output in outputs if output)
@@ -0,0 +1,228 @@
+"""
+Budgets for rendering, so that one huge or widely transcluding
+tiddler cannot tie up a worker.
+
+Each is a config setting, off unless set:
+
+* `markdown.max_input_bytes`: the most text, in bytes of UTF-8, a
+  tiddler may have to be rendered. Larger tiddlers are shown as
+  escaped text in a `<pre>`, or if transcluded left as `{{title}}`.
+* `markdown.max_render_time`: the seconds a render may take, along
+  with everything it transcludes. It is checked between the stages of
+  Python-Markdown, between inline pattern matches and before each
+  transclusion; once it has run out the whole render is shown as
+  escaped text in a `<pre>`.
+* `markdown.max_transclusion_depth`: how deeply transclusions may
+  nest. Deeper ones are left as `{{title}}`.
+* `markdown.max_transcluded_bytes`: the most text, in bytes of UTF-8,
+  which may be transcluded into one render. Transclusions past that
+  are left as `{{title}}`.
+
+A Budget is kept in the environ for the outermost render and shared
+by everything it transcludes. When that render finishes, the limits
+hit, as LimitExceeded exceptions, are put in the environ as
+`markdown.limits`. Output for which a limit was hit is not put in
+the render cache.
+"""
+
+import threading
+import time
+
+from contextlib import contextmanager
+
+
+BUDGET_KEY = 'markdown.budget'
+LIMITS_KEY = 'markdown.limits'
+
+LIMITS = ['max_input_bytes', 'max_render_time', 'max_transclusion_depth',
+        'max_transcluded_bytes']
+
+clock = getattr(time, 'monotonic', time.time)
+
+
+class LimitExceeded(Exception):
+    """
+    A render went over limit with tiddler: amount is more than
+    maximum.
+    """
+
+    def __init__(self, limit, tiddler, amount, maximum):
+        Exception.__init__(self, '%s exceeded by %s in %s: %s > %s' % (
+            limit, tiddler.title, tiddler.bag, amount, maximum))
+        self.limit = limit
+        self.bag = tiddler.bag
+        self.title = tiddler.title
+        self.amount = amount
+        self.maximum = maximum
+
+
+class Budget(object):
+    """
+    What is left of the limits for one outermost render.
+    """
+
+    def __init__(self, tiddler, max_input_bytes=None, max_render_time=None,
+            max_transclusion_depth=None, max_transcluded_bytes=None):
+        self.tiddler = tiddler
+        self.max_input_bytes = max_input_bytes
+        self.max_render_time = max_render_time
+        self.max_transclusion_depth = max_transclusion_depth
+        self.max_transcluded_bytes = max_transcluded_bytes
+        self.started = clock()
+        self.transcluded_bytes = 0
+        self.exceeded = []
+        self._lock = threading.Lock()
+
+    def note(self, exc):
+        """
+        Record that the limit of exc was hit.
+        """
+        with self._lock:
+            self.exceeded.append(exc)
+
+    def check_input(self, tiddler):
+        """
+        Raise LimitExceeded if tiddler has too much text.
+        """
+        if self.max_input_bytes is not None:
+            size = text_bytes(tiddler)
+            if size > self.max_input_bytes:
+                raise LimitExceeded('max_input_bytes', tiddler, size,
+                        self.max_input_bytes)
+
+    def check_time(self):
+        """
+        Raise LimitExceeded if the render has taken too long.
+        """
+        if self.max_render_time is not None:
+            elapsed = clock() - self.started
+            if elapsed > self.max_render_time:
+                raise LimitExceeded('max_render_time', self.tiddler,
+                        elapsed, self.max_render_time)
+
+    def admit(self, interior_tiddler, depth):
+        """
+        Count interior_tiddler, transcluded depth levels down, against
+        the budget. Raises LimitExceeded, without counting it, if
+        there is not room.
+        """
+        self.check_time()
+        if (self.max_transclusion_depth is not None
+                and depth > self.max_transclusion_depth):
+            raise LimitExceeded('max_transclusion_depth', interior_tiddler,
+                    depth, self.max_transclusion_depth)
+        self.check_input(interior_tiddler)
+        if self.max_transcluded_bytes is not None:
+            size = text_bytes(interior_tiddler)
+            with self._lock:
+                total = self.transcluded_bytes + size
+                if total > self.max_transcluded_bytes:
+                    raise LimitExceeded('max_transcluded_bytes',
+                            interior_tiddler, total,
+                            self.max_transcluded_bytes)
+                self.transcluded_bytes = total
+
+
+def text_bytes(tiddler):
+    text = tiddler.text or ''
+    if not isinstance(text, bytes):
+        text = text.encode('utf-8')
+    return len(text)
+
+
+def budget_for(tiddler, config):
+    """
+    A Budget for rendering tiddler under config, or None if no
+    limits are set.
+    """
+    limits = dict((limit, config.get('markdown.%s' % limit))
+            for limit in LIMITS)
+    if all(value is None for value in limits.values()):
+        return None
+    return Budget(tiddler, **limits)
+
+
+def current_budget(environ):
+    """
+    The Budget of the render in progress, or None.
+    """
+    if environ:
+        return environ.get(BUDGET_KEY)
+    return None
+
+
+@contextmanager
+def budgeting(environ, tiddler):
+    """
+    Start a Budget for the duration of the block if this is the
+    outermost render and limits are set. Yields the Budget, if it
+    was started here, or None.
+    """
+    if BUDGET_KEY in environ:
+        yield None
+        return
+    budget = budget_for(tiddler, environ.get('tiddlyweb.config', {}))
+    if budget is None:
+        yield None
+        return
+    environ[BUDGET_KEY] = budget
+    try:
+        yield budget
+    finally:
+        del environ[BUDGET_KEY]
+        environ[LIMITS_KEY] = budget.exceeded
+
+
+def fallback(tiddler):
+    """
+    The text of tiddler, escaped, for when it is not rendered.
+    """
+    # tiddlyweb.web.util is costly to import
+    from tiddlyweb.web.util import html_encode
+    return '<pre class="markdown-limit">%s</pre>' % html_encode(
+            tiddler.text or '')
+
+
+def guarded(engine, func):
+    """
+    Wrap func to check the time left in the budget bound to engine
+    before calling it.
+    """
+    def wrapper(*args, **kwargs):
+        budget = engine.budget
+        if budget is not None:
+            budget.check_time()
+        return func(*args, **kwargs)
+    return wrapper
+
+
+class GuardedRegex(object):
+    """
+    Stand in for a compiled pattern which checks the time left
+    before each match().
+    """
+
+    def __init__(self, engine, regex):
+        self.regex = regex
+        self.match = guarded(engine, regex.match)
+
+    def __getattr__(self, attribute):
+        return getattr(self.regex, attribute)
+
+
+def guard(engine):
+    """
+    Wrap the processors, parser and inline patterns of engine so that
+    they stop the conversion when the time in engine.budget has run
+    out.
+    """
+    for processor in engine.preprocessors.values():
+        processor.run = guarded(engine, processor.run)
+    engine.parser.parseDocument = guarded(engine, engine.parser.parseDocument)
+    for processor in engine.treeprocessors.values():
+        processor.run = guarded(engine, processor.run)
+    for pattern in engine.inlinePatterns.values():
+        regex = GuardedRegex(engine, pattern.getCompiledRegExp())
+        pattern.getCompiledRegExp = lambda regex=regex: regex
+    for processor in engine.postprocessors.values():
+        processor.run = guarded(engine, processor.run)
@@ -1,30 +1,32 @@
 """
 Markdown extensions for freelinks and wikilinks, with
 optional @target handling.
-"""
 
-import re
+With a `markdown.title_index`, links to tiddlers which do not exist
+get the class missing (see titles). Each link made is noted for
+render_with_links (see backlinks).
+"""
 
-from markdown import util, inlinepatterns
+from markdown import util
 from markdown.extensions.wikilinks import (WikiLinkExtension,
         WikiLinks)
 from tiddlyweb.fixups import quote
 
+from .backlinks import note_target, note_title
+from .memo import NAMES, interlink
+from .patterns import SharedPattern
+from .scan import Finder, ScanMatch, Brackets
+# all of these are still importable from here
+from .syntax import (FRONTBOUND, FREELINKRAW, FREELINKB, WIKILINKB,
+        FREELINK, WIKILINK, TARGETLINK_BASE, TARGETLINK, WIKITARGET,
+        FREETARGET, WIKILINK_RE, FLAGS, FREE_HEAD, TARGET_HEAD, WIKI_HEAD,
+        TARGET_WORD)
+from .titles import missing
 
-FRONTBOUND = r'(?:^|(?<=[\s|\(]))'
-FREELINKRAW = r'\[\[([^]]+?)\]\]'
-#FREELINKRAW = r'\[\[[^]]+?\]\]'
-FREELINKB = FRONTBOUND + FREELINKRAW
-WIKILINKB = FRONTBOUND + r'(~?[A-Z][a-z]+[A-Z]\w+\b)'
-
-FREELINK = FREELINKB + '(?!@)'
-WIKILINK = WIKILINKB + '(?!@)'
 
-TARGETLINK_BASE = (r'(@(?:' + FREELINKRAW +
-    r'|([0-9A-Za-z][0-9A-Za-z\-]*[0-9A-Za-z])))(?=\b|$|[^]])')
-TARGETLINK = FRONTBOUND + TARGETLINK_BASE
-WIKITARGET = WIKILINKB + TARGETLINK_BASE
-FREETARGET = FREELINKB + TARGETLINK_BASE
+# The order in which the separate patterns were once tried.
+LINK_FORMS = ['freelink', 'freetarget', 'wikitarget', 'target', 'wikilink']
+TARGET_FORMS = ['freetarget', 'wikitarget', 'target']
 
 
 class MarkdownLinksExtension(WikiLinkExtension):
@@ -35,104 +37,330 @@ class MarkdownLinksExtension(WikiLinkExtension):
                 'end_url': ['', 'String to append to end of URL.'],
                 'html_class': ['wikilink', 'CSS hook. Leave blank for none.'],
                 'environ': [{}, 'Base wsgi environ'],
+                'interlinker': [None, 'Function that links to @targets'],
         }
+        # Work around isinstance bool handling in superclass
         for key, value in kwargs.items():
-            self.setConfig(key, value)
+            self.config[key][0] = value
 
     def extendMarkdown(self, md, md_globals):
         self.md = md
         configs = self.getConfigs()
-        tiddlywebconfig = configs['environ'].get('tiddlyweb.config', {})
-        interlinker = tiddlywebconfig.get('markdown.interlinker', None)
+        interlinker = configs['interlinker']
+        if not interlinker:
+            tiddlywebconfig = configs['environ'].get('tiddlyweb.config', {})
+            interlinker = tiddlywebconfig.get('markdown.interlinker', None)
+            configs['interlinker'] = interlinker
+
+        linksPattern = LinkScanner(configs, targets=bool(interlinker))
+        linksPattern.md = md
+        md.inlinePatterns.add('links', linksPattern, '<link')
+
+
+class LinkScanner(WikiLinks, SharedPattern):
+    """
+    Find wikilinks, freelinks and, if targets is true, the @target
+    forms of links with one inline pattern, and make the link for
+    whichever form matched.
+    """
+
+    def __init__(self, config, targets=True):
+        # matching is done by self.finder
+        WikiLinks.__init__(self, WIKILINK, config)
+        self.interlinker = config['interlinker']
+        self.finder = LinkFinder([form for form in LINK_FORMS
+            if targets or form not in TARGET_FORMS])
+
+    def getCompiledRegExp(self):
+        return self.finder
+
+    def handleMatch(self, m):
+        if m.form in ('freelink', 'wikilink'):
+            return self.wikilink(m.text)
+        if m.form == 'target':
+            return target_link(self, m.text, m.target)
+        return page_target_link(self, m.text, m.target)
 
-        wikilinkPattern = MarkdownLinks(WIKILINK, configs)
-        wikilinkPattern.md = md
-        md.inlinePatterns.add('wikilink', wikilinkPattern, '<link')
+    def wikilink(self, matched_text):
+        """
+        Link to the tiddler named by matched_text, or for ~WikiLink
+        the text without the ~.
+        """
+        matched_text = matched_text.strip()
+        if '|' in matched_text:
+            label, target = matched_text.split('|', 1)
+        else:
+            # short circuit escaping of ~WikiLink
+            if (matched_text.startswith('~')
+                    and WIKILINK_RE.match(matched_text)):
+                return matched_text[1:]
+            label = target = matched_text
+        return wiki_link(self, label, target)
+
+
+class LinkFinder(Finder):
+    """
+    Find the forms of link in text, in linear time.
+
+    Python-Markdown once tried each form as a pattern of its own: all
+    matches of the first form in a piece of text, then all of the
+    next, never going back. Where matches of different forms overlap
+    (as when the [[ ]] of a target contains a freelink) that order
+    decides the output, so it is kept: the finder carries on from the
+    form it had got to when it is given the text after a replacement.
+    """
 
-        freelinkPattern = MarkdownLinks(FREELINK, configs)
-        freelinkPattern.md = md
-        md.inlinePatterns.add('freelink', freelinkPattern, '<wikilink')
+    # A form can only match text which contains these.
+    NEEDS = {
+        'freelink': '[[',
+        'freetarget': '[[',
+        'wikitarget': '@',
+        'target': '@',
+        'wikilink': '',
+    }
 
-        if interlinker:
-            wikitargetlinkPattern = TargetLinks(WIKITARGET, configs)
-            wikitargetlinkPattern.md = md
-            md.inlinePatterns.add('wikitargetlink', wikitargetlinkPattern,
-                    '<wikilink')
+    def __init__(self, forms):
+        self.forms = [(form, self.NEEDS[form], getattr(self, form))
+                for form in forms]
+        Finder.__init__(self)
 
-            freetargetlinkPattern = TargetLinks(FREETARGET, configs)
-            freetargetlinkPattern.md = md
-            md.inlinePatterns.add('freetargetlink', freetargetlinkPattern,
-                    '<wikitargetlink')
+    def restart(self):
+        self.index = 0
 
-            targetlinkPattern = TargetLinks(TARGETLINK, configs)
-            targetlinkPattern.md = md
-            md.inlinePatterns.add('targetlink', targetlinkPattern,
-                    '>wikitargetlink')
+    def find(self, data, position):
+        brackets = Brackets(data)
+        while self.index < len(self.forms):
+            form, needs, find = self.forms[self.index]
+            if position or needs in data:
+                match = find(data, position, brackets)
+                if match is not None:
+                    return match
+            self.index += 1
+            position = 0
+            brackets = Brackets(data)
+        return None
 
+    def freelink(self, data, position, brackets):
+        """
+        [[title]] or [[label|title]], not followed by @.
+        """
+        while True:
+            head = FREE_HEAD.search(data, position)
+            if head is None:
+                return None
+            start = head.end()
+            close = brackets.close(start)
+            if close == -1:
+                return None
+            if (close > start and data.startswith(']', close + 1)
+                    and not data.startswith('@', close + 2)):
+                return ScanMatch(data, head.start(), close + 2,
+                        form='freelink', text=data[start:close])
+            # any [[ before close is closed, or not, at close too
+            position = close
 
-class TargetLinks(inlinepatterns.Pattern):
+    def freetarget(self, data, position, brackets):
+        """
+        [[title]]@target or [[label|title]]@target.
+        """
+        while True:
+            head = FREE_HEAD.search(data, position)
+            if head is None:
+                return None
+            start = head.end()
+            close = brackets.close(start)
+            if close == -1:
+                return None
+            if close > start and data.startswith(']', close + 1):
+                target = target_at(data, close + 2, brackets)
+                if target is not None:
+                    end, target = target
+                    return ScanMatch(data, head.start(), end,
+                            form='freetarget', text=data[start:close],
+                            target=target)
+            position = close
+
+    def wikitarget(self, data, position, brackets):
+        """
+        WikiWord@target.
+        """
+        while True:
+            head = WIKI_HEAD.search(data, position)
+            if head is None:
+                return None
+            target = target_at(data, head.end(), brackets)
+            if target is not None:
+                end, target = target
+                return ScanMatch(data, head.start(), end,
+                        form='wikitarget', text=head.group(), target=target)
+            position = head.end()
+
+    def target(self, data, position, brackets):
+        """
+        @target or @[[target]].
+        """
+        while True:
+            head = TARGET_HEAD.search(data, position)
+            if head is None:
+                return None
+            target = target_at(data, head.start(), brackets)
+            if target is not None:
+                end, target = target
+                return ScanMatch(data, head.start(), end, form='target',
+                        text=data[head.start():end], target=target)
+            position = head.end()
+
+    def wikilink(self, data, position, brackets):
+        """
+        WikiWord or ~WikiWord, not followed by @.
+        """
+        while True:
+            head = WIKI_HEAD.search(data, position)
+            if head is None:
+                return None
+            if not data.startswith('@', head.end()):
+                return ScanMatch(data, head.start(), head.end(),
+                        form='wikilink', text=head.group())
+            position = head.end()
+
+
+def target_at(data, position, brackets):
+    """
+    If there is an @target at position in data, where it ends and the
+    target, otherwise None.
+    """
+    if not data.startswith('@', position):
+        return None
+    if data.startswith('[[', position + 1):
+        start = position + 3
+        close = brackets.close(start)
+        if (close > start and data.startswith(']', close + 1)
+                and not data.startswith(']', close + 2)):
+            return close + 2, data[start:close]
+        return None
+    word = TARGET_WORD.match(data, position + 1)
+    if word is not None:
+        word = word.group().rstrip('-')
+        if len(word) > 1:
+            return position + 1 + len(word), word
+    return None
+
+
+class TargetLinks(SharedPattern):
     def __init__(self, pattern, config):
-        inlinepatterns.Pattern.__init__(self, pattern)
+        SharedPattern.__init__(self, pattern)
         self.config = config
-        tiddlywebconfig = config['environ'].get('tiddlyweb.config', {})
-        self.interlinker = tiddlywebconfig.get('markdown.interlinker', None)
+        self.interlinker = config['interlinker']
 
     def handleMatch(self, m):
         if m.lastindex == 6:  # we have a wikitargetlink or freetarget
             page = m.group(2)
             target = m.group(3)
             if page and target:
-                if '|' in page:
-                    label, destination = page.split('|', 1)
-                else:
-                    label = destination = page
-                a = util.etree.Element('a')
-                a.text = util.AtomicString(label)
                 # Target regexp returns a different group depending on
                 # the match.
-                target = m.group(5) or m.group(4)
-                target_base = self.interlinker(self.config['environ'], target)
-                if not target_base.endswith('/'):
-                    target_base = target_base + '/'
-                a.set('href', target_base + encode_name(destination))
-                return a
+                return page_target_link(self, page, m.group(5) or m.group(4))
         else:
             matched_text = m.group(2)
             if matched_text:
-                a = util.etree.Element('a')
-                a.text = util.AtomicString(matched_text)
-                target = m.group(4) or m.group(3)
-                a.set('href', self.interlinker(self.config['environ'], target))
-                return a
+                return target_link(self, matched_text,
+                        m.group(4) or m.group(3))
         return ''
 
 
-class MarkdownLinks(WikiLinks):
+class MarkdownLinks(WikiLinks, SharedPattern):
 
     def handleMatch(self, m):
         matched_text = m.group(2)
         if matched_text:
             matched_text = matched_text.strip()
-            base_url, end_url, html_class = self._getMeta()
             if '|' in matched_text:
                 label, target = matched_text.split('|', 1)
             else:
                 # short circuit escaping of ~WikiLink
-                if (re.match(WIKILINK, matched_text)
+                if (WIKILINK_RE.match(matched_text)
                         and matched_text.startswith('~')):
                     return matched_text[1:]
                 label = target = matched_text
-            url = '%s%s%s' % (base_url, encode_name(target), end_url)
-            a = util.etree.Element('a')
-            a.text = util.AtomicString(label)
-            a.set('href', url)
-            if html_class:
-                a.set('class', html_class)
+            a = wiki_link(self, label, target)
         else:
             a = ''
         return a
 
 
+def wiki_link(pattern, label, target):
+    """
+    A link, labeled label, to the tiddler target.
+    """
+    base_url, end_url, html_class = pattern._getMeta()
+    url = '%s%s%s' % (base_url, encode_name(target), end_url)
+    a = util.etree.Element('a')
+    a.text = util.AtomicString(label)
+    a.set('href', url)
+    environ, tiddler = link_source(pattern)
+    note_title(environ, target)
+    if missing(environ, tiddler, target):
+        html_class = ' '.join(name for name in [html_class, 'missing']
+                if name)
+    if html_class:
+        a.set('class', html_class)
+    return a
+
+
+def link_source(pattern):
+    """
+    The environ and the tiddler of the render pattern is working in.
+    """
+    md = getattr(pattern, 'md', None)
+    environ = getattr(md, 'environ', None)
+    if environ is None:
+        environ = pattern.config.get('environ', {})
+    return environ, getattr(md, 'tiddler', None)
+
+
+def page_target_link(pattern, page, target):
+    """
+    A link to the tiddler named in page, which may be label|title,
+    in target.
+    """
+    if '|' in page:
+        label, destination = page.split('|', 1)
+    else:
+        label = destination = page
+    a = util.etree.Element('a')
+    a.text = util.AtomicString(label)
+    environ = engine_environ(pattern.md, pattern.config)
+    note_target(environ, target, destination)
+    target_base = interlink(environ, pattern.interlinker, target)
+    if not target_base.endswith('/'):
+        target_base = target_base + '/'
+    a.set('href', target_base + encode_name(destination))
+    return a
+
+
+def target_link(pattern, label, target):
+    """
+    A link, labeled label, to target itself.
+    """
+    a = util.etree.Element('a')
+    a.text = util.AtomicString(label)
+    environ = engine_environ(pattern.md, pattern.config)
+    note_target(environ, target)
+    a.set('href', interlink(environ, pattern.interlinker, target))
+    return a
+
+
+def engine_environ(md, config):
+    """
+    The environ bound to the Markdown instance for the current
+    render, or failing that the one the extension was configured with.
+    """
+    environ = getattr(md, 'environ', None)
+    if environ is None:
+        environ = config['environ']
+    return environ
+
+
 def makeExtension(**kwargs):
     return MarkdownLinksExtension(**kwargs)
 
@@ -140,5 +368,10 @@ def makeExtension(**kwargs):
 def encode_name(name):
     """
     Like the encode_name found in tiddlyweb, but does not escape #.
+    Results are memoized (see memo).
     """
-    return quote(name.encode('utf-8'), safe=".!~*'()#")
+    encoded = NAMES.get(name)
+    if encoded is None:
+        encoded = quote(name.encode('utf-8'), safe=".!~*'()#")
+        NAMES.set(name, encoded)
+    return encoded
@@ -0,0 +1,156 @@
+"""
+Bounded memos of the URLs made for links.
+
+On tiddlers full of navigation the same few hundred titles and
+targets are linked to again and again. encode_name() in links quotes
+each title, and the `markdown.interlinker` and
+`markdown.transclude_url` functions, which often work out the host
+from the environ as well, are called for every @target link and
+transclusion. Each result is kept in a bounded Memo.
+
+Encoded titles depend on nothing but the title, so one memo, NAMES,
+serves the whole process. Interlinker and transclude_url results can
+depend on the environ, so by default they are kept for one request,
+in a memo in the environ shared by nested renders. Setting
+`markdown.url_memo` to 'process' keeps them in URLS, shared by every
+request, which is only right for functions whose result depends on
+nothing but the target or tiddler and the config. Set it to False to
+call the functions every time.
+
+The stats() of each memo (and stats() here, of them all) count hits,
+misses and entries, to help size MAX_NAMES and MAX_URLS.
+"""
+
+import threading
+
+
+CONFIG_KEY = 'markdown.url_memo'
+# where the memo of a request is kept in its environ
+MEMO_KEY = 'markdown.request_memo'
+
+# How many encoded titles, and interlinker and transclude_url results,
+# to keep.
+MAX_NAMES = 4096
+MAX_URLS = 1024
+
+
+class Memo(object):
+    """
+    A memo of at most max_entries results, dropping those least
+    recently used first, counting hits and misses.
+
+    Moving an entry to the end of an OrderedDict on every hit costs
+    more than quoting a title, so recency is only tracked by halves:
+    results go into a young generation, which when it holds half of
+    max_entries becomes the old one, replacing the last old one. A
+    hit on an old result moves it back into the young generation.
+    Lookups take no lock, so under threads the counts are
+    approximate.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._young = {}
+        self._old = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        The result kept for key, or None.
+        """
+        value = self._young.get(key)
+        if value is None:
+            value = self._old.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.set(key, value)
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        young = self._young
+        young[key] = value
+        if len(young) >= max(self.max_entries // 2, 1):
+            with self._lock:
+                if young is self._young:
+                    self._old = young
+                    self._young = {}
+
+    def stats(self):
+        """
+        Report memo effectiveness.
+        """
+        return {'hits': self.hits, 'misses': self.misses,
+                'entries': len(set(self._young) | set(self._old)),
+                'max_entries': self.max_entries}
+
+    def clear(self):
+        with self._lock:
+            self._young = {}
+            self._old = {}
+            self.hits = self.misses = 0
+
+
+NAMES = Memo(MAX_NAMES)
+URLS = Memo(MAX_URLS)
+
+
+def url_memo(environ):
+    """
+    The Memo for interlinker and transclude_url results in environ, or
+    None if they are not memoized.
+    """
+    scope = environ.get('tiddlyweb.config', {}).get(CONFIG_KEY, 'request')
+    if not scope:
+        return None
+    if scope == 'process':
+        return URLS
+    memo = environ.get(MEMO_KEY)
+    if memo is None:
+        memo = environ[MEMO_KEY] = Memo(MAX_URLS)
+    return memo
+
+
+def interlink(environ, interlinker, target):
+    """
+    interlinker(environ, target), memoized.
+    """
+    memo = url_memo(environ)
+    if memo is None:
+        return interlinker(environ, target)
+    key = ('interlinker', interlinker, target)
+    url = memo.get(key)
+    if url is None:
+        url = interlinker(environ, target)
+        memo.set(key, url)
+    return url
+
+
+def tiddler_link(environ, transclude_url, tiddler):
+    """
+    transclude_url(environ, tiddler), memoized.
+    """
+    memo = url_memo(environ)
+    if memo is None:
+        return transclude_url(environ, tiddler)
+    key = ('transclude_url', transclude_url, tiddler.recipe, tiddler.bag,
+            tiddler.title)
+    url = memo.get(key)
+    if url is None:
+        url = transclude_url(environ, tiddler)
+        memo.set(key, url)
+    return url
+
+
+def stats(environ=None):
+    """
+    The stats of the process memos and, if environ has one, of the
+    memo of its request.
+    """
+    report = {'names': NAMES.stats(), 'urls': URLS.stats()}
+    if environ is not None and environ.get(MEMO_KEY) is not None:
+        report['request'] = environ[MEMO_KEY].stats()
+    return report
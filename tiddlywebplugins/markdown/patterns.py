@@ -0,0 +1,59 @@
+"""
+A registry of compiled regular expressions, shared by every engine
+and render in a process.
+
+Python-Markdown compiles the expression of an inline pattern, wrapped
+as ^(.*?)expression(.*)$, whenever the pattern is made, so every
+engine built compiles them all again. Calling re.match() and friends
+with an expression string looks it up in the re module's cache on
+every call, and Python 2 empties that cache whenever it passes 100
+entries. Here each expression is compiled once and the same object
+is handed out after that.
+
+The inline patterns of this package are SharedPatterns, and the
+transclusion postprocessor takes its expression from compiled().
+"""
+
+import re
+
+from markdown.inlinepatterns import Pattern
+
+
+INLINE_FLAGS = re.DOTALL | re.UNICODE
+
+_COMPILED = {}
+
+
+def compiled(expression, flags=0):
+    """
+    expression compiled with flags, compiling it only the first time.
+    """
+    key = (expression, flags)
+    try:
+        return _COMPILED[key]
+    except KeyError:
+        # setdefault keeps the first of racing compiles
+        return _COMPILED.setdefault(key, re.compile(expression, flags))
+
+
+def inline(expression):
+    """
+    expression compiled as Python-Markdown compiles an inline pattern.
+    """
+    return compiled(r'^(.*?)%s(.*)$' % expression, INLINE_FLAGS)
+
+
+class SharedPattern(Pattern):
+    """
+    An inline pattern whose compiled expression comes from the
+    registry. Put it after other Pattern subclasses in the bases of a
+    class, so their calls to Pattern.__init__ end up here.
+    """
+
+    def __init__(self, pattern, markdown_instance=None):
+        # as Pattern.__init__, but without compiling
+        self.pattern = pattern
+        self.compiled_re = inline(pattern)
+        self.safe_mode = False
+        if markdown_instance:
+            self.markdown = markdown_instance
@@ -0,0 +1,50 @@
+"""
+A fast path for text with no Markdown in it.
+
+Most tiddlers are a line or a few paragraphs of plain prose, which
+Python-Markdown turns into <p> elements holding the escaped text, but
+only after running every preprocessor, block processor, inline pattern
+and postprocessor over it. plain_html() checks cheaply that text has
+nothing any of them would act on and makes those <p> elements itself.
+
+The check is conservative. Text is passed over to Python-Markdown if it
+has any of:
+
+* characters which start inline syntax or HTML: \\ ` * _ [ ] < > { }
+  and entities such as &amp;
+* a bare URL (://), or with the TiddlyWeb features a WikiWord or @
+* tabs, carriage returns or Python-Markdown's placeholder characters
+* a line which starts with whitespace, # = + - : ~ or a number and a
+  full stop, or which ends with whitespace
+
+Whatever the safe mode, what is left converts to the same HTML as
+Python-Markdown makes for it (see test/test_plain.py).
+"""
+
+import re
+
+from .syntax import WIKI_HEAD
+
+
+SYNTAX_RE = re.compile(r'[\\`*_\[\]<>{}\t\r\x02\x03]|&[#a-zA-Z0-9]*;'
+        r'|://|^(?:[^\S\n]|[#=+\-:~]|\d+\.)|[^\S\n]$',
+        re.MULTILINE | re.UNICODE)
+PARAGRAPH_BREAK_RE = re.compile(r'\n\n+')
+
+
+def plain_html(text, wikilinks=False):
+    """
+    The HTML Python-Markdown would make from text, if text has no
+    Markdown, otherwise None. With wikilinks, text which might hold
+    TiddlyWeb links (WikiWords and @targets) is not plain.
+    """
+    if SYNTAX_RE.search(text):
+        return None
+    if wikilinks and ('@' in text or WIKI_HEAD.search(text)):
+        return None
+    text = text.strip('\n')
+    if not text:
+        return ''
+    text = text.replace('&', '&amp;')
+    return '\n'.join('<p>%s</p>' % paragraph
+            for paragraph in PARAGRAPH_BREAK_RE.split(text))
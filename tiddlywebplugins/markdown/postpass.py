@@ -0,0 +1,144 @@
+"""
+The TiddlyWeb features as a pass over HTML, for the backends (see
+backends) which know nothing of them.
+
+With Python-Markdown, links, bare URLs and transclusions are made by
+the extensions in links, autolink and transclusion. A PostPass finds
+the same forms in HTML from any Markdown library, using the same
+finders, and makes the same elements with the same functions:
+
+* Each run of text outside a, code, pre, script and style elements is
+  searched for wikilinks, freelinks and @target links (with an
+  interlinker), then bare URLs, as the inline patterns search it.
+* Then the transclusions are expanded, as the transclusion
+  postprocessor does.
+
+The text is searched after the backend has made emphasis and other
+markup, so a link whose text is marked up, as in `[[a *b* c]]`, is
+not found.
+"""
+
+import re
+
+from markdown import util
+from markdown.serializers import to_html_string
+
+from .autolink import BARELINK, LinkPattern
+from .links import LinkScanner
+from .transclusion import TRANSCLUDE_RE, TranscludeProcessor
+
+try:
+    from html import unescape
+except ImportError:  # Python 2
+    from HTMLParser import HTMLParser
+    unescape = HTMLParser().unescape
+
+
+TAG_RE = re.compile(r'(<!--.*?-->|<[^>]*>)', re.DOTALL)
+TAG_NAME_RE = re.compile(r'<(/?)([A-Za-z][A-Za-z0-9]*)')
+
+# Elements whose text is not searched for links.
+UNLINKED = frozenset(['a', 'code', 'pre', 'script', 'style'])
+
+
+class PostPass(object):
+    """
+    Add the features of EngineSettings settings to HTML. Like an
+    engine, it is bound to the environ and tiddler being rendered
+    (see render.bind) before run().
+    """
+
+    def __init__(self, settings):
+        self.patterns = []
+        self.transclusion = None
+        if settings.base is not None:
+            links = LinkScanner({
+                'base_url': settings.base,
+                'end_url': '',
+                'html_class': 'wikilink',
+                'environ': {},
+                'interlinker': settings.interlinker,
+            }, targets=bool(settings.interlinker))
+            links.md = self
+            self.patterns.append(links)
+            self.transclusion = TranscludeProcessor(TRANSCLUDE_RE,
+                    {'environ': {}, 'tiddler': None})
+            self.transclusion.md = self
+        self.patterns.append(LinkPattern(BARELINK))
+
+    def run(self, html):
+        """
+        html with links made in its text and transclusions expanded.
+        """
+        output = []
+        unlinked = 0
+        for index, piece in enumerate(TAG_RE.split(html)):
+            if index % 2:
+                tag = TAG_NAME_RE.match(piece)
+                if tag is not None and tag.group(2).lower() in UNLINKED:
+                    if tag.group(1):
+                        unlinked = max(unlinked - 1, 0)
+                    elif not piece.endswith('/>'):
+                        unlinked += 1
+                output.append(piece)
+            elif unlinked or not piece.strip():
+                output.append(piece)
+            else:
+                output.append(self.link(piece))
+        html = ''.join(output)
+        if self.transclusion is not None:
+            html = self.transclusion.run(html)
+        return html
+
+    def link(self, text):
+        """
+        The HTML for text, a run of escaped text, with links made.
+        """
+        data = unescape(text)
+        stash = []
+        for pattern in self.patterns:
+            data = self.apply(pattern, data, stash)
+        if not stash:
+            return text
+
+        output = []
+        pieces = util.INLINE_PLACEHOLDER_RE.split(data)
+        for index, piece in enumerate(pieces):
+            if index % 2 and int(piece) < len(stash):
+                output.append(stash[int(piece)])
+            elif index % 2:
+                output.append(escape(util.INLINE_PLACEHOLDER % piece))
+            else:
+                output.append(escape(piece))
+        return ''.join(output)
+
+    def apply(self, pattern, data, stash):
+        """
+        Replace each match of pattern in data with a placeholder for
+        the HTML it makes, kept in stash, carrying on from each
+        placeholder as Python-Markdown does.
+        """
+        finder = pattern.getCompiledRegExp()
+        finder.restart()
+        position = 0
+        while True:
+            match = finder.find(data, position)
+            if match is None:
+                return data
+            node = pattern.handleMatch(match)
+            if isinstance(node, util.string_type):
+                stash.append(escape(node))
+            else:
+                stash.append(to_html_string(node))
+            data = '%s%s%s' % (data[:match.start],
+                    util.INLINE_PLACEHOLDER % (len(stash) - 1),
+                    data[match.end:])
+            position = match.start
+
+
+def escape(text):
+    """
+    Escape text as Python-Markdown serializes text.
+    """
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace(
+            '>', '&gt;')
@@ -0,0 +1,195 @@
+"""
+Time the stages of rendering.
+
+If `markdown.profile` is set in config, each render records a Profile
+of where its time went:
+
+* `preprocessor.<name>`, `parser`, `treeprocessor.<name>`, `serializer`
+  and `postprocessor.<name>` for the stages of Python-Markdown.
+* `inline.<name>.regex` and `inline.<name>.handle` for each inline
+  pattern (such as links and twautolink): the time spent matching its
+  regular expression and building the element for a match. Both are
+  included in `treeprocessor.inline`.
+* `transclusion.fetch`, resolving and loading transcluded tiddlers,
+  and `transclusion.render`, rendering and splicing them in. Both are
+  included in `postprocessor.transclusion`.
+* `backend.<name>` and `postpass` in place of the Python-Markdown
+  stages when another backend is used (see backends). Transclusion
+  is included in `postpass`.
+
+Renders of transcluded tiddlers are recorded as children of the
+profile of the tiddler transcluding them. When the outermost render
+finishes its Profile is put in the environ as `markdown.profile` and,
+if the config setting is a callable rather than just true, passed to
+it with the environ.
+
+Engines which record profiles are built and pooled separately, so
+there is no cost when profiling is off.
+"""
+
+import time
+
+from contextlib import contextmanager
+
+
+PROFILE_KEY = 'markdown.profile'
+STACK_KEY = 'markdown.profile_stack'
+
+clock = getattr(time, 'perf_counter', time.time)
+
+
+class Profile(object):
+    """
+    Where the time went while rendering one tiddler.
+
+    timings maps a name to [seconds, calls]. total is the time for
+    the whole render, cached whether it came from the render cache.
+    """
+
+    def __init__(self, tiddler):
+        self.bag = tiddler.bag
+        self.recipe = tiddler.recipe
+        self.title = tiddler.title
+        self.timings = {}
+        self.children = []
+        self.total = 0
+        self.cached = False
+
+    def add(self, name, seconds):
+        try:
+            timing = self.timings[name]
+            timing[0] += seconds
+            timing[1] += 1
+        except KeyError:
+            self.timings[name] = [seconds, 1]
+
+    def seconds(self, name):
+        """
+        The time recorded for name, or 0.
+        """
+        return self.timings.get(name, [0, 0])[0]
+
+    def to_dict(self):
+        """
+        A JSON friendly representation.
+        """
+        return {
+            'bag': self.bag,
+            'recipe': self.recipe,
+            'title': self.title,
+            'total': self.total,
+            'cached': self.cached,
+            'timings': dict((name, {'seconds': seconds, 'calls': calls})
+                for name, (seconds, calls) in self.timings.items()),
+            'children': [child.to_dict() for child in self.children],
+        }
+
+
+@contextmanager
+def profiling(environ, tiddler):
+    """
+    Profile the render of tiddler for the duration of the block, if
+    markdown.profile is set. Yields the Profile, or None.
+    """
+    setting = environ.get('tiddlyweb.config', {}).get('markdown.profile')
+    if not setting:
+        yield None
+        return
+
+    profile = Profile(tiddler)
+    stack = environ.setdefault(STACK_KEY, [])
+    if stack:
+        stack[-1].children.append(profile)
+    stack.append(profile)
+    start = clock()
+    try:
+        yield profile
+    finally:
+        profile.total = clock() - start
+        stack.pop()
+        if not stack:
+            environ[PROFILE_KEY] = profile
+            if callable(setting):
+                setting(environ, profile)
+
+
+def current_profile(environ):
+    """
+    The Profile being recorded into, or None.
+    """
+    stack = environ.get(STACK_KEY) if environ else None
+    if stack:
+        return stack[-1]
+    return None
+
+
+@contextmanager
+def timing(profile, name):
+    """
+    Add the time taken by the block to name in profile, if there
+    is one.
+    """
+    if profile is None:
+        yield
+        return
+    start = clock()
+    try:
+        yield
+    finally:
+        profile.add(name, clock() - start)
+
+
+def timed(engine, func, name):
+    """
+    Wrap func to add the time it takes to name in the profile bound
+    to engine.
+    """
+    def wrapper(*args, **kwargs):
+        profile = engine.profile
+        if profile is None:
+            return func(*args, **kwargs)
+        start = clock()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profile.add(name, clock() - start)
+    return wrapper
+
+
+class TimedRegex(object):
+    """
+    Stand in for a compiled pattern which times match().
+    """
+
+    def __init__(self, engine, regex, name):
+        self.engine = engine
+        self.regex = regex
+        self.name = name
+        self.match = timed(engine, regex.match, name)
+
+    def __getattr__(self, attribute):
+        return getattr(self.regex, attribute)
+
+
+def instrument(engine):
+    """
+    Wrap the processors, parser, inline patterns and serializer of
+    engine so that they record into engine.profile.
+    """
+    for name, processor in engine.preprocessors.items():
+        processor.run = timed(engine, processor.run, 'preprocessor.%s' % name)
+    engine.parser.parseDocument = timed(engine, engine.parser.parseDocument,
+            'parser')
+    for name, processor in engine.treeprocessors.items():
+        processor.run = timed(engine, processor.run,
+                'treeprocessor.%s' % name)
+    for name, pattern in engine.inlinePatterns.items():
+        regex = TimedRegex(engine, pattern.getCompiledRegExp(),
+                'inline.%s.regex' % name)
+        pattern.getCompiledRegExp = lambda regex=regex: regex
+        pattern.handleMatch = timed(engine, pattern.handleMatch,
+                'inline.%s.handle' % name)
+    engine.serializer = timed(engine, engine.serializer, 'serializer')
+    for name, processor in engine.postprocessors.items():
+        processor.run = timed(engine, processor.run,
+                'postprocessor.%s' % name)
@@ -4,47 +4,492 @@ Markdown rendering subsystem.
 We keep the actual activity in here to avoid import difficulties
 while still maintaining easy configuration of the module (in
 tiddlywebconfig.py).
+
+Building a Markdown instance loads every extension by name and
+compiles all of their patterns, which can cost more than converting
+a short tiddler. Instances are therefore kept in a pool keyed by the
+configuration that built them, reset() after each use and handed out
+again. The WSGI environ and the tiddler being rendered are bound to
+an engine when it is checked out, not baked into its extension
+configuration.
+
+If `markdown.backend` names another Markdown library (see backends),
+it converts the text instead and the TiddlyWeb features are added by
+a post-pass over its HTML.
+
+Python-Markdown, and the modules for features which are off unless
+configured, are imported when first needed, so that importing the
+plugin stays cheap for tools which never render. preload() imports
+them all at a time of the caller's choosing instead.
 """
 
-import markdown
+import threading
+
+from importlib import import_module
+
+from . import backends
+from .backlinks import collecting, collector
+from .cache import cache_key, identity
+from .dependencies import Dependencies, note_links, tracking
+from .limits import (LimitExceeded, budgeting, current_budget, fallback,
+        guard)
+from .plain import plain_html
+from .profile import profiling, current_profile, timing, instrument
+from .syntax import FREE_HEAD, WIKI_HEAD
+from .titles import INDEX_KEY, versions
 
 
 ALLOWED_SAFE_MODES = [False, 'replace', 'remove', 'escape']
 DEFAULT_SAFE_MODE = 'escape'
 
+DEFAULT_EXTENSIONS = ['headerid', 'footnotes', 'fenced_code', 'def_list',
+        'tiddlywebplugins.markdown.autolink',
+        'tiddlywebplugins.markdown.scan']
+LINKS_EXTENSION = 'tiddlywebplugins.markdown.links'
+TRANSCLUSION_EXTENSION = 'tiddlywebplugins.markdown.transclusion'
+
+MARKDOWN_RENDERER = 'tiddlywebplugins.markdown'
+
+# How many idle engines to keep for any one configuration.
+MAX_IDLE_ENGINES = 8
+
+# Modules imported when first needed rather than with this one.
+DEFERRED_MODULES = ['markdown', 'markdown.serializers',
+        'markdown.extensions.fenced_code', 'tempfile', 'tiddlyweb.control',
+        'tiddlyweb.model.bag', 'tiddlyweb.specialbag', 'tiddlyweb.store',
+        'tiddlyweb.web.util', 'tiddlywebplugins.markdown.incremental',
+        'tiddlywebplugins.markdown.links',
+        'tiddlywebplugins.markdown.postpass',
+        'tiddlywebplugins.markdown.transclusion']
+
+
+class EngineSettings(object):
+    """
+    The rendering relevant parts of the TiddlyWeb config, from
+    which a Markdown instance is built. key identifies engines
+    built from equivalent settings.
+    """
+
+    def __init__(self, config):
+        self.base = config.get('markdown.wiki_link_base')
+        self.safe = config.get('markdown.safe_mode', DEFAULT_SAFE_MODE)
+        if self.safe not in ALLOWED_SAFE_MODES:
+            self.safe = DEFAULT_SAFE_MODE
+        self.interlinker = config.get('markdown.interlinker', None)
+        self.title_index = None
+        if self.base is not None:
+            self.title_index = config.get(INDEX_KEY)
+        # interlinkers and transcluded tiddler URIs use the server's
+        # location, which is output affecting but not engine affecting
+        self.server = repr((config.get('server_host'),
+            config.get('server_prefix', '')))
+        extra_extensions, extra_configs = config.get('markdown.extensions',
+                ([], {}))
+
+        self.extensions = DEFAULT_EXTENSIONS + list(extra_extensions)
+        self.extension_configs = {}
+        self.extension_configs.update(extra_configs)
+
+        if self.base is not None:
+            self.extensions.append(LINKS_EXTENSION)
+            self.extensions.append(TRANSCLUSION_EXTENSION)
+            self.extension_configs[LINKS_EXTENSION] = {
+                'base_url': self.base,
+                'interlinker': self.interlinker,
+            }
+
+        # other backends cannot run extensions from config
+        self.backend = None
+        if not extra_extensions:
+            self.backend = backends.backend_for(config.get(
+                'markdown.backend', backends.DEFAULT_BACKEND), self.safe)
+        if self.backend is None:
+            self.backend_name = backends.REFERENCE
+        else:
+            self.backend_name = self.backend.name
+
+        # text with no Markdown is made into paragraphs without an
+        # engine (see plain), which extensions from config might
+        # not expect
+        self.plain = not extra_extensions and self.backend is None
+
+        # groups of blocks are converted apart, which extensions
+        # from config might not expect, and are split where
+        # Python-Markdown would end a block
+        self.block_cache = None
+        if not extra_extensions and self.backend is None:
+            self.block_cache = config.get('markdown.block_cache')
+
+        self.profiling = bool(config.get('markdown.profile'))
+        self.timed = config.get('markdown.max_render_time') is not None
+
+        # extension configuration values need not be hashable
+        self.configs_signature = repr(sorted(extra_configs.items()))
+        self.key = (self.safe, self.base, self.interlinker,
+                tuple(self.extensions), self.configs_signature,
+                self.profiling, self.timed, self.backend_name)
+
+    def build(self):
+        """
+        Create a new Markdown instance for these settings.
+        """
+        import markdown
+        engine = markdown.Markdown(extensions=self.extensions,
+                extension_configs=self.extension_configs,
+                output_format='html5',
+                safe_mode=self.safe)
+        if self.profiling:
+            instrument(engine)
+        if self.timed:
+            guard(engine)
+        unbind(engine)
+        return engine
+
+
+class EnginePool(object):
+    """
+    Idle Markdown instances keyed by EngineSettings.key.
+
+    An engine is checked out for the length of one conversion, so
+    nested renders (from transclusion) and concurrent requests each
+    get an engine of their own.
+    """
+
+    def __init__(self, max_idle=MAX_IDLE_ENGINES):
+        self.max_idle = max_idle
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, settings):
+        """
+        Return an idle engine for settings, building one if needed.
+        """
+        with self._lock:
+            idle = self._idle.get(settings.key)
+            if idle:
+                return idle.pop()
+        return settings.build()
+
+    def release(self, settings, engine):
+        """
+        Reset engine and make it available for reuse.
+        """
+        engine.reset()
+        unbind(engine)
+        with self._lock:
+            idle = self._idle.setdefault(settings.key, [])
+            if len(idle) < self.max_idle:
+                idle.append(engine)
+
+    def idle_count(self, settings=None):
+        """
+        The number of idle engines, for settings or overall.
+        """
+        with self._lock:
+            if settings is not None:
+                return len(self._idle.get(settings.key, []))
+            return sum(len(idle) for idle in self._idle.values())
+
+    def clear(self):
+        """
+        Discard all idle engines.
+        """
+        with self._lock:
+            self._idle.clear()
+
+
+ENGINES = EnginePool()
+
+
+def bind(engine, environ, tiddler, defer_transclusion=False):
+    """
+    Attach the per-request state the TiddlyWeb extensions need.
+    With defer_transclusion, transclusions are left in the output
+    for the caller to expand.
+    """
+    engine.environ = environ
+    engine.tiddler = tiddler
+    engine.defer_transclusion = defer_transclusion
+    engine.profile = current_profile(environ)
+    engine.budget = current_budget(environ)
+
+
+def unbind(engine):
+    """
+    Drop per-request state so idle engines do not hold on to it.
+    """
+    engine.environ = None
+    engine.tiddler = None
+    engine.defer_transclusion = False
+    engine.profile = None
+    engine.budget = None
+
+
+def preload(config=None):
+    """
+    Import the DEFERRED_MODULES and the modules of the Markdown
+    extensions config uses now, rather than in the first render.
+    """
+    settings = EngineSettings(config or {})
+    for name in DEFERRED_MODULES:
+        import_module(name)
+    for name in settings.extensions:
+        # extensions may be given as instances too
+        if hasattr(name, 'split'):
+            import_module(extension_module(name))
+
+
+def extension_module(name):
+    """
+    The module Python-Markdown imports for the extension name.
+    """
+    name = name.split('(', 1)[0].split(':', 1)[0]
+    if '.' not in name:
+        return 'markdown.extensions.' + name
+    return name
+
 
 def render(tiddler, environ):
     """
     Render text in the provided tiddler to HTML.
     """
+    return render_with_dependencies(tiddler, environ)[0]
+
+
+def render_with_links(tiddler, environ):
+    """
+    Render text in the provided tiddler to HTML, returning the HTML
+    and the Outlinks (see backlinks) of its text. The text is
+    converted, not taken from the render or block cache, so that its
+    links are seen.
+    """
+    with collecting(environ) as outlinks:
+        output = render_with_dependencies(tiddler, environ)[0]
+    return output, outlinks
+
+
+def render_with_dependencies(tiddler, environ):
+    """
+    Render text in the provided tiddler to HTML, returning the HTML
+    and the Dependencies (transcluded tiddlers and how they were
+    found) it was made from.
+
+    If the outermost render goes over a limit (see limits) the text
+    is returned escaped in a <pre> instead.
+    """
+    with budgeting(environ, tiddler) as budget:
+        if budget is None:
+            return render_within_budget(tiddler, environ)
+        try:
+            budget.check_input(tiddler)
+            return render_within_budget(tiddler, environ)
+        except LimitExceeded as exc:
+            budget.note(exc)
+            return fallback(tiddler), Dependencies()
+
+
+def render_within_budget(tiddler, environ):
+    """
+    render_with_dependencies() within the budget, if any, of the
+    outermost render.
+    """
+    config = environ.get('tiddlyweb.config', {})
+    settings = EngineSettings(config)
+    cache = config.get('markdown.render_cache')
+
+    with profiling(environ, tiddler) as profile:
+        with tracking(environ) as dependencies:
+            if cache is None:
+                return convert(tiddler, environ, settings), dependencies
+
+            with timing(profile, 'cache'):
+                key, transcludes = render_key(tiddler, environ, settings)
+                entry = None
+                if collector(environ) is None:
+                    entry = cache.get(key, environ)
+            if entry is not None:
+                output, recorded = entry
+                if recorded is not None:
+                    dependencies.update(recorded)
+                if profile is not None:
+                    profile.cached = True
+                return output, dependencies
+
+            exceeded = limits_exceeded(environ)
+            output = convert(tiddler, environ, settings)
+            if limits_exceeded(environ) == exceeded:
+                cache.set(key, output,
+                        dependencies if transcludes else None)
+            return output, dependencies
+
+
+def limits_exceeded(environ):
+    """
+    How many limits have been hit so far in the current render.
+    Output made while one was hit is not cached.
+    """
+    budget = current_budget(environ)
+    if budget is None:
+        return 0
+    return len(budget.exceeded)
+
+
+def render_key(tiddler, environ, settings):
+    """
+    The render cache key for tiddler, and whether it may transclude.
+    """
+    transcludes = transcluding(tiddler, settings)
+    context = link_context(tiddler.text, tiddler, environ, settings)
+    if transcludes:
+        key = cache_key(tiddler.text, settings,
+                transclusion_context(tiddler, environ) + context)
+    else:
+        key = cache_key(tiddler.text, settings, context)
+    return key, transcludes
+
+
+def renderer_name(tiddler, environ):
+    """
+    The wikitext renderer render_wikitext would use for tiddler.
+    """
+    config = environ.get('tiddlyweb.config', {})
+    if tiddler.type and tiddler.type != 'None':
+        renderer = config.get('wikitext.type_render_map', {}).get(
+                tiddler.type)
+        if renderer:
+            return renderer
+    return config.get('wikitext.default_renderer')
+
+
+def linking(text, settings):
+    """
+    Whether text, from a tiddler, may have links which are marked
+    missing or not depending on which tiddlers exist (see titles).
+    """
+    return settings.title_index is not None and bool(
+            FREE_HEAD.search(text) or WIKI_HEAD.search(text))
+
+
+def link_context(text, tiddler, environ, settings):
+    """
+    The versions of the titles links in text, from tiddler, are
+    checked against, if they are. They are noted as a dependency, so
+    that a render transcluding tiddler is not reused once they change.
+    """
+    if linking(text, settings):
+        context = versions(environ, tiddler)
+        note_links(environ, tiddler, context)
+        return [context]
+    return []
+
+
+def transcluding(tiddler, settings):
+    """
+    Whether the text of tiddler may transclude other tiddlers,
+    in which case the HTML depends on more than the text.
+    """
+    return settings.base is not None and '{{' in tiddler.text
+
+
+def transclusion_context(tiddler, environ):
+    """
+    What, besides the text, decides which tiddlers are transcluded
+    and how: where tiddler is, who is looking, how targets are
+    resolved and linked, and which transclusions enclose this one.
+    """
     config = environ.get('tiddlyweb.config', {})
-    base = config.get('markdown.wiki_link_base')
-    safe = config.get('markdown.safe_mode', DEFAULT_SAFE_MODE)
-    extra_extensions, extra_configs = config.get('markdown.extensions',
-            ([], {}))
-
-    if safe not in ALLOWED_SAFE_MODES:
-        safe = DEFAULT_SAFE_MODE
-
-    extensions = ['headerid', 'footnotes', 'fenced_code', 'def_list',
-            'tiddlywebplugins.markdown.autolink'] + extra_extensions
-    extension_configs = {}
-    extension_configs.update(extra_configs)
-
-    if base is not None:
-        extensions.append('tiddlywebplugins.markdown.links')
-        extensions.append('tiddlywebplugins.markdown.transclusion')
-        extension_configs['tiddlywebplugins.markdown.links'] = {
-            'base_url': base,
-            'environ': environ
-        }
-        extension_configs['tiddlywebplugins.markdown.transclusion'] = {
-            'environ': environ,
-            'tiddler': tiddler
-        }
-
-    return markdown.markdown(tiddler.text,
-            extensions=extensions,
-            extension_configs=extension_configs,
-            output_format='html5',
-            safe_mode=safe)
+    usersign = environ.get('tiddlyweb.usersign', {})
+    return [tiddler.recipe or '', tiddler.bag or '',
+            usersign.get('name', ''),
+            ','.join(sorted(usersign.get('roles', []))),
+            identity(config.get('markdown.target_resolver')),
+            identity(config.get('markdown.transclude_url')),
+            '\0'.join(environ.get('markdown.transclusions', []))]
+
+
+def convert(tiddler, environ, settings, defer_transclusion=False):
+    """
+    Run the text of tiddler through a pooled engine, a group of
+    blocks at a time if there is a block cache (see incremental).
+    """
+    if settings.block_cache is not None and collector(environ) is None:
+        from .incremental import block_groups
+        groups = block_groups(tiddler.text)
+        if groups is not None and len(groups) > 1:
+            output = convert_groups(groups, tiddler, environ, settings,
+                    defer_transclusion)
+            if output is not None:
+                return output
+    return convert_text(tiddler.text, tiddler, environ, settings,
+            defer_transclusion)
+
+
+def convert_groups(groups, tiddler, environ, settings, defer_transclusion):
+    """
+    Convert each of groups from the text of tiddler, taking the HTML
+    of those converted before from the block cache. Returns None if
+    the groups must be converted together after all.
+    """
+    cache = settings.block_cache
+    outputs = []
+    links = None
+    for text in groups:
+        if settings.base is not None and '{{' in text:
+            outputs.append(convert_text(text, tiddler, environ, settings,
+                defer_transclusion))
+            continue
+        context = ['block']
+        if linking(text, settings):
+            if links is None:
+                links = link_context(text, tiddler, environ, settings)
+            context += links
+        key = cache_key(text, settings, context)
+        entry = cache.get(key)
+        if entry is not None:
+            outputs.append(entry[0])
+            continue
+        exceeded = limits_exceeded(environ)
+        output = convert_text(text, tiddler, environ, settings,
+                defer_transclusion)
+        if limits_exceeded(environ) == exceeded:
+            cache.set(key, output)
+        outputs.append(output)
+    from .incremental import join_groups
+    return join_groups(outputs)
+
+
+def convert_text(text, tiddler, environ, settings, defer_transclusion):
+    """
+    Run text, from tiddler, through a pooled engine, or the backend
+    of settings. Plain text does not need either.
+    """
+    if settings.plain:
+        output = plain_html(text, settings.base is not None)
+        if output is not None:
+            return output
+    if settings.backend is not None:
+        return convert_backend(text, tiddler, environ, settings,
+                defer_transclusion)
+    engine = ENGINES.acquire(settings)
+    bind(engine, environ, tiddler, defer_transclusion)
+    # An engine which raised may be part way through a document,
+    # so it is only returned to the pool after a clean conversion.
+    output = engine.convert(text)
+    ENGINES.release(settings, engine)
+    return output
+
+
+def convert_backend(text, tiddler, environ, settings, defer_transclusion):
+    """
+    Convert text, from tiddler, with the backend of settings, then
+    add the TiddlyWeb features with a PostPass.
+    """
+    from .postpass import PostPass
+    features = PostPass(settings)
+    bind(features, environ, tiddler, defer_transclusion)
+    with timing(features.profile, 'backend.%s' % settings.backend_name):
+        html = settings.backend.convert(text)
+    if features.budget is not None:
+        features.budget.check_time()
+    with timing(features.profile, 'postpass'):
+        return features.run(html).strip()
@@ -0,0 +1,185 @@
+"""
+Linear time matching for inline patterns.
+
+Python-Markdown wraps the expression of an inline pattern as
+^(.*?)expression(.*)$ and, after each replacement, matches it again
+from the start of the text. An expression which may read to the end of
+the line from each place it could start (such as [[ with no ]]) costs
+the square of the length of the line, and so does starting over when
+a line has many links.
+
+A Finder stands in for the compiled expression of a pattern. It finds
+matches by hand, reading each character a bounded number of times,
+and when Python-Markdown comes back with the text of the last match
+replaced by a placeholder it carries on from the placeholder rather
+than starting over.
+"""
+
+import re
+
+from markdown import Extension, util
+
+
+class ScanMatch(object):
+    """
+    What Python-Markdown uses of a match: the text before the match
+    as group 1, any inner groups the pattern expects, and the text
+    after it as the last group. Whatever the Finder found out about
+    the match is kept as attributes.
+    """
+
+    def __init__(self, data, start, end, inner=(), **found):
+        self.data = data
+        self.start = start
+        self.end = end
+        self.inner = tuple(inner)
+        self.__dict__.update(found)
+
+    def group(self, index=0):
+        if index == 0:
+            return self.data
+        return self.groups()[index - 1]
+
+    def groups(self):
+        return ((self.data[:self.start],) + self.inner +
+                (self.data[self.end:],))
+
+    def span(self, index=0):
+        if index == 0:
+            return (0, len(self.data))
+        if index == 1:
+            return (0, self.start)
+        if index == len(self.inner) + 2:
+            return (self.end, len(self.data))
+        raise NotImplementedError('span of an inner group')
+
+
+class Finder(object):
+    """
+    Base for the stand in expressions. Subclasses implement find().
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.before = self.after = None
+
+    def restart(self):
+        """
+        Called when match() is given new text rather than the
+        text of the last match with a placeholder.
+        """
+        pass
+
+    def find(self, data, position):
+        """
+        The first ScanMatch in data which starts at or after position,
+        or None.
+        """
+        raise NotImplementedError
+
+    def continues(self, data):
+        """
+        Whether data is the text of the last match with the match
+        replaced by a placeholder.
+
+        Python-Markdown calls match() again straight after each
+        replacement, until there is no match, so only the shape of
+        data is checked rather than comparing all of it. Finders are
+        reset() with the engine, in case a render failed half way.
+        """
+        if self.before is None:
+            return False
+        seam = len(data) - self.after
+        placeholder = util.INLINE_PLACEHOLDER_RE.match(data, self.before,
+                seam)
+        return placeholder is not None and placeholder.end() == seam
+
+    def match(self, data):
+        # Nothing which starts before the placeholder can match now if
+        # it did not before, so carry on from there.
+        if self.continues(data):
+            position = self.before
+        else:
+            self.restart()
+            position = 0
+        match = self.find(data, position)
+        if match is None:
+            self.reset()
+        else:
+            self.before = match.start
+            self.after = len(data) - match.end
+        return match
+
+
+class Brackets(object):
+    """
+    Find the first ] at or after a position in data, reading each
+    character once so long as positions only increase.
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self.start = len(data) + 1
+        self.found = -1
+
+    def close(self, position):
+        if self.start <= position and (self.found == -1
+                or position <= self.found):
+            return self.found
+        self.start = position
+        self.found = self.data.find(']', position)
+        return self.found
+
+
+SHORT_REFERENCE_HEAD = re.compile(r'(?<!\!)\[', re.DOTALL | re.UNICODE)
+
+
+class ShortReferenceFinder(Finder):
+    """
+    Find [reference] as Python-Markdown's short_reference pattern
+    does, with the reference as group 2.
+    """
+
+    def find(self, data, position):
+        brackets = Brackets(data)
+        while True:
+            head = SHORT_REFERENCE_HEAD.search(data, position)
+            if head is None:
+                return None
+            close = brackets.close(head.end())
+            if close == -1:
+                return None
+            if close > head.end():
+                return ScanMatch(data, head.start(), close + 1,
+                        inner=[data[head.end():close]])
+            position = head.end()
+
+
+class LinearScanning(Extension):
+    """
+    Give Python-Markdown patterns which are quadratic on runs of
+    brackets a Finder, and reset the Finders of all patterns with
+    the engine.
+    """
+
+    def extendMarkdown(self, md, md_globals):
+        self.md = md
+        if 'short_reference' in md.inlinePatterns:
+            finder = ShortReferenceFinder()
+            md.inlinePatterns['short_reference'].getCompiledRegExp = (
+                    lambda: finder)
+        md.registerExtension(self)
+
+    def reset(self):
+        for pattern in self.md.inlinePatterns.values():
+            # compiled expressions have no reset, Finders (and the
+            # stand ins which time them) do
+            reset = getattr(pattern.getCompiledRegExp(), 'reset', None)
+            if reset is not None:
+                reset()
+
+
+def makeExtension(**kwargs):
+    return LinearScanning(**kwargs)
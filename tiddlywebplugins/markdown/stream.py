@@ -0,0 +1,276 @@
+"""
+Render markdown as a sequence of HTML chunks, so that the output of a
+very large tiddler, or of a deep tree of transclusions, need not be
+held in memory at once.
+
+    for chunk in render_stream(tiddler, environ):
+        write(chunk)
+
+Python-Markdown still parses the whole text into a tree, but the tree
+is serialized and post-processed a few top level blocks (about
+chunk_size characters) at a time. Transclusions are left in place (see
+render.bind) and each is expanded when it is reached, with transcluded
+markdown tiddlers themselves rendered as streams. Joined, the chunks
+are the HTML render() makes.
+
+A render cache is read, and a hit is yielded whole, but not written:
+entries hold whole renders. Postprocessors from `markdown.extensions`
+are run on each group of blocks rather than on the whole document.
+Other backends (see backends) convert the whole text at once.
+
+Limits (see limits) apply as for render(). If the time runs out after
+some HTML has been yielded, the stream ends with an empty
+`<div class="markdown-limit">` in place of the rest, after closing any
+articles it was in.
+"""
+
+from markdown import util
+
+from tiddlyweb.util import renderable
+from tiddlyweb.wikitext import render_wikitext
+
+from .dependencies import tracking
+from .limits import LimitExceeded, budgeting, fallback
+from .profile import profiling, timing
+from .plain import plain_html
+from .render import (ENGINES, MARKDOWN_RENDERER, EngineSettings, bind,
+        convert_backend, render_key, renderer_name)
+from .transclusion import (TRANSCLUDE_RE, TranscludeProcessor, semaphore,
+        transclusion_request)
+
+
+CHUNK_SIZE = 16384
+
+STOPPED = '<div class="markdown-limit" data-limit="%s"></div>'
+
+
+def render_stream(tiddler, environ, chunk_size=CHUNK_SIZE):
+    """
+    Render text in the provided tiddler to HTML, yielding it in
+    chunks.
+    """
+    with budgeting(environ, tiddler) as budget:
+        if budget is None:
+            for chunk in stream_within_budget(tiddler, environ, chunk_size):
+                yield chunk
+            return
+        started = False
+        try:
+            budget.check_input(tiddler)
+            for chunk in stream_within_budget(tiddler, environ, chunk_size):
+                started = True
+                yield chunk
+        except LimitExceeded as exc:
+            budget.note(exc)
+            if started:
+                yield STOPPED % exc.limit
+            else:
+                yield fallback(tiddler)
+
+
+def stream_within_budget(tiddler, environ, chunk_size):
+    """
+    render_stream() within the budget, if any, of the outermost
+    render.
+    """
+    config = environ.get('tiddlyweb.config', {})
+    settings = EngineSettings(config)
+    cache = config.get('markdown.render_cache')
+
+    with profiling(environ, tiddler) as profile:
+        with tracking(environ) as dependencies:
+            if cache is not None:
+                with timing(profile, 'cache'):
+                    key, transcludes = render_key(tiddler, environ, settings)
+                    entry = cache.get(key, environ)
+                if entry is not None:
+                    output, recorded = entry
+                    if recorded is not None:
+                        dependencies.update(recorded)
+                    if profile is not None:
+                        profile.cached = True
+                    if output:
+                        yield output
+                    return
+
+            chunks = stripped(convert_stream(tiddler, environ, settings,
+                chunk_size))
+            if settings.base is None or not environ.get('tiddlyweb.store'):
+                for chunk in chunks:
+                    yield chunk
+                return
+
+            processor = TranscludeProcessor(TRANSCLUDE_RE,
+                    {'environ': environ, 'tiddler': tiddler})
+            processor.md = None
+            admitted = {}
+            for html in chunks:
+                for chunk in transclude_stream(html, processor, admitted,
+                        profile, chunk_size):
+                    yield chunk
+
+
+def convert_stream(tiddler, environ, settings, chunk_size):
+    """
+    Run the text of tiddler through a pooled engine, leaving
+    transclusions in place, and yield the HTML in chunks.
+    """
+    # plain text (see plain) is made in one piece
+    if settings.plain and len(tiddler.text) < chunk_size:
+        html = plain_html(tiddler.text, settings.base is not None)
+        if html is not None:
+            yield html
+            return
+    if settings.backend is not None:
+        yield convert_backend(tiddler.text, tiddler, environ, settings,
+                defer_transclusion=True)
+        return
+    engine = ENGINES.acquire(settings)
+    bind(engine, environ, tiddler, defer_transclusion=True)
+    for html in blocks(engine, tiddler.text, chunk_size):
+        yield html
+    # as for render.convert, only an engine which finished goes back
+    ENGINES.release(settings, engine)
+
+
+def blocks(engine, text, chunk_size):
+    """
+    Convert text as engine.convert() does, but serialize and
+    post-process the top level blocks in groups of about chunk_size
+    characters, yielding each group. Whitespace around the whole is
+    not stripped (see stripped).
+    """
+    if not text.strip():
+        return
+
+    engine.lines = util.text_type(text).split('\n')
+    for preprocessor in engine.preprocessors.values():
+        engine.lines = preprocessor.run(engine.lines)
+    root = engine.parser.parseDocument(engine.lines).getroot()
+    for treeprocessor in engine.treeprocessors.values():
+        new_root = treeprocessor.run(root)
+        if new_root is not None:
+            root = new_root
+
+    if not engine.stripTopLevelTags:
+        yield postprocess(engine, engine.serializer(root))
+        return
+
+    # Let go of each block once it is serialized.
+    children = list(root)
+    del root[:]
+    group = [root.text or '']
+    size = 0
+    for index, child in enumerate(children):
+        children[index] = None
+        html = engine.serializer(child)
+        group.append(html)
+        size += len(html)
+        if size >= chunk_size:
+            yield postprocess(engine, ''.join(group))
+            group = []
+            size = 0
+    if group:
+        yield postprocess(engine, ''.join(group))
+
+
+def postprocess(engine, html):
+    for postprocessor in engine.postprocessors.values():
+        html = postprocessor.run(html)
+    return html
+
+
+def stripped(chunks):
+    """
+    Yield chunks without the whitespace at the start and end of the
+    whole, as Python-Markdown strips its output.
+    """
+    started = False
+    pending = ''
+    for chunk in chunks:
+        if not started:
+            chunk = chunk.lstrip()
+            if not chunk:
+                continue
+            started = True
+        content = chunk.rstrip()
+        if content:
+            yield pending + content
+            pending = chunk[len(content):]
+        else:
+            pending += chunk
+
+
+def transclude_stream(html, processor, admitted, profile, chunk_size):
+    """
+    Yield html with the transclusions left in it by a deferred
+    conversion expanded, each as it is reached. admitted remembers
+    whether the tiddlers already met fit the budget.
+    """
+    matches, requests = processor.collect(html)
+    if not matches:
+        yield html
+        return
+
+    with timing(profile, 'transclusion.fetch'):
+        resolved = processor.resolve_all(requests)
+        loaded = processor.load_all(processor.distinct(resolved))
+
+    position = 0
+    for match in matches:
+        if match.start() > position:
+            yield html[position:match.start()]
+        interior_tiddler = resolved[transclusion_request(match)]
+        if interior_tiddler is not None:
+            interior_tiddler = loaded[(interior_tiddler.bag,
+                interior_tiddler.title)]
+        for chunk in article_stream(processor, match, interior_tiddler,
+                admitted, chunk_size):
+            yield chunk
+        position = match.end()
+    if position < len(html):
+        yield html[position:]
+
+
+def article_stream(processor, match, interior_tiddler, admitted,
+        chunk_size):
+    """
+    As TranscludeProcessor.transclude(), but yield the article in
+    chunks as interior_tiddler is rendered.
+    """
+    if interior_tiddler is None:
+        yield match.group(0)
+        return
+
+    environ = processor.environ
+    semaphore_title = semaphore(interior_tiddler)
+    seen_titles = environ.get('markdown.transclusions', [])
+    if semaphore_title in seen_titles:
+        yield match.group(0)
+        return
+    if semaphore_title not in admitted:
+        admitted[semaphore_title] = processor.admit(interior_tiddler,
+                seen_titles)
+    if not admitted[semaphore_title]:
+        yield match.group(0)
+        return
+
+    seen_titles.append(semaphore_title)
+    environ['markdown.transclusions'] = seen_titles
+    try:
+        yield processor.opening(interior_tiddler)
+        try:
+            if not renderable(interior_tiddler, environ):
+                pass
+            elif renderer_name(interior_tiddler, environ) == MARKDOWN_RENDERER:
+                for chunk in render_stream(interior_tiddler, environ,
+                        chunk_size):
+                    yield chunk
+            else:
+                yield render_wikitext(interior_tiddler, environ)
+        except LimitExceeded as exc:
+            yield '</article>'
+            raise exc
+        yield '</article>'
+    finally:
+        seen_titles.pop()
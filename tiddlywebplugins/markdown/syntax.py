@@ -0,0 +1,34 @@
+"""
+The regular expressions for the wikilink, freelink and @target
+syntax, kept apart from links so that what only looks for links
+(render, plain) does not import Python-Markdown.
+"""
+
+import re
+
+
+FRONTBOUND = r'(?:^|(?<=[\s|\(]))'
+FREELINKRAW = r'\[\[([^]]+?)\]\]'
+#FREELINKRAW = r'\[\[[^]]+?\]\]'
+FREELINKB = FRONTBOUND + FREELINKRAW
+WIKILINKB = FRONTBOUND + r'(~?[A-Z][a-z]+[A-Z]\w+\b)'
+
+FREELINK = FREELINKB + '(?!@)'
+WIKILINK = WIKILINKB + '(?!@)'
+
+TARGETLINK_BASE = (r'(@(?:' + FREELINKRAW +
+    r'|([0-9A-Za-z][0-9A-Za-z\-]*[0-9A-Za-z])))(?=\b|$|[^]])')
+TARGETLINK = FRONTBOUND + TARGETLINK_BASE
+WIKITARGET = WIKILINKB + TARGETLINK_BASE
+FREETARGET = FREELINKB + TARGETLINK_BASE
+
+WIKILINK_RE = re.compile(WIKILINK)
+
+# The starts of the forms above. None of these can read further than
+# the end of a word, so searching with them takes linear time. The
+# rest of each form is matched by hand.
+FLAGS = re.DOTALL | re.UNICODE
+FREE_HEAD = re.compile(FRONTBOUND + r'\[\[', FLAGS)
+TARGET_HEAD = re.compile(FRONTBOUND + '@', FLAGS)
+WIKI_HEAD = re.compile(FRONTBOUND + r'~?[A-Z][a-z]+[A-Z]\w+', FLAGS)
+TARGET_WORD = re.compile(r'[0-9A-Za-z][0-9A-Za-z\-]*')
@@ -0,0 +1,437 @@
+"""
+Mark links to tiddlers which do not exist.
+
+If `markdown.title_index` is set to a TitleIndex, wikilinks and
+freelinks to a title which is in none of the bags of the recipe (or
+the bag) of the tiddler being rendered get the class `missing` as
+well as `wikilink`. Links with an @target are not checked.
+
+Asking the store about each link would cost a read per link, so the
+index keeps the titles of each bag in memory. A bag is listed once,
+when it is first needed; after that the tiddler put and delete hooks
+(registered by init) add and remove titles as tiddlers come and go.
+Recipe filters are not applied, and a special bag (one the store
+makes up on the fly) is taken to hold every title.
+
+With a root directory the titles of each bag are also kept in a log
+file below it, a line for each title added or removed, so that they
+outlive the process and are shared by the processes on a host. A
+process reads whatever others have appended to a bag's log before
+using its titles, at most once every CHECK_INTERVAL seconds.
+A log which has grown to many times the titles it holds is rewritten.
+Without a root each process keeps its own titles, which only its own
+hooks update, so use one when several processes render.
+
+Which links are marked depends on which tiddlers exist, so the
+version of each bag's titles is part of the render and block cache
+keys of text with links in it (see render.link_context). Adding or
+removing a tiddler changes the version of its bag; editing one does
+not. A version is a generation, new each time a bag is listed (or
+its log written afresh), with a count of changes since, so a bag
+deleted and made again does not repeat an old version.
+
+Tiddlers added or removed while a bag is being listed are applied to
+its titles once the listing is done.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+
+try:
+    import fcntl
+except ImportError:  # not on Windows
+    fcntl = None
+
+
+INDEX_KEY = 'markdown.title_index'
+
+# Rewrite a log once it has this many records per title in it.
+COMPACT_RATIO = 4
+
+# Seconds between reads of the log of a bag for others' changes.
+CHECK_INTERVAL = 1.0
+
+clock = getattr(time, 'monotonic', time.time)
+
+
+class BagTitles(object):
+    """
+    The titles in one bag, or None if it may hold any title, and for
+    a logged bag how much of its log has been read.
+    """
+
+    def __init__(self, titles):
+        self.titles = titles
+        self.generation = uuid.uuid4().hex
+        self.changes = 0
+        self.inode = None
+        self.offset = 0
+        self.records = 0
+        self.checked = clock()
+
+    @property
+    def version(self):
+        if self.inode is not None:
+            return '%s.%s' % (self.generation, self.offset)
+        return '%s.%s' % (self.generation, self.changes)
+
+
+class TitleIndex(object):
+    """
+    The titles of the tiddlers in each bag, listed from the store when
+    first needed, kept in memory and, with root, in a log file per bag.
+    """
+
+    def __init__(self, root=None):
+        self.root = root
+        self._bags = {}
+        # bag name to [listings in progress, changes made meanwhile]
+        self._listing = {}
+        self._lock = threading.Lock()
+        if root is not None and not os.path.isdir(root):
+            os.makedirs(root)
+
+    def contains(self, store, bag_name, title):
+        """
+        Whether the bag called bag_name may hold a tiddler titled title.
+        """
+        titles = self._titles(store, bag_name).titles
+        return titles is None or title in titles
+
+    def version(self, store, bag_name):
+        """
+        A string which changes whenever the titles in bag_name do.
+        """
+        return self._titles(store, bag_name).version
+
+    def add(self, bag_name, title):
+        self._change(bag_name, title, '+')
+
+    def discard(self, bag_name, title):
+        self._change(bag_name, title, '-')
+
+    def drop(self, bag_name):
+        """
+        Forget the titles of bag_name, as when it is deleted.
+        """
+        with self._lock:
+            self._bags.pop(bag_name, None)
+            if bag_name in self._listing:
+                self._listing[bag_name][1].append(('drop', None))
+            if self.root is not None:
+                try:
+                    os.remove(self._path(bag_name))
+                except OSError:
+                    pass
+
+    def clear(self):
+        """
+        Forget the titles of every bag, to be listed again.
+        """
+        with self._lock:
+            names = list(self._bags)
+        for name in names:
+            self.drop(name)
+        if self.root is not None:
+            for filename in os.listdir(self.root):
+                if filename.endswith('.titles'):
+                    os.remove(os.path.join(self.root, filename))
+
+    def _titles(self, store, bag_name):
+        with self._lock:
+            bag = self._current(bag_name)
+            if bag is not None:
+                return bag
+            listing = self._listing.setdefault(bag_name, [0, []])
+            listing[0] += 1
+        try:
+            titles = list_titles(store, bag_name)
+        except Exception:
+            with self._lock:
+                self._listed(bag_name, listing)
+            raise
+        with self._lock:
+            self._listed(bag_name, listing)
+            bag = self._current(bag_name)
+            if bag is None:
+                bag = self._create(bag_name, titles)
+                # changed while being listed
+                changes, listing[1] = listing[1], []
+                for op, title in changes:
+                    bag = self._apply(bag_name, bag, op, title)
+            return bag
+
+    def _listed(self, bag_name, listing):
+        listing[0] -= 1
+        if not listing[0] and self._listing.get(bag_name) is listing:
+            del self._listing[bag_name]
+
+    def _current(self, bag_name, check=False):
+        """
+        The titles of bag_name known so far, brought up to date with
+        its log if it was last read CHECK_INTERVAL ago or check is
+        true, or None if it has not been listed.
+        """
+        bag = self._bags.get(bag_name)
+        if self.root is None or (bag is not None and (bag.titles is None
+                or (not check and clock() - bag.checked < CHECK_INTERVAL))):
+            return bag
+        bag = self._read(bag_name, bag)
+        if bag is None:
+            self._bags.pop(bag_name, None)
+        else:
+            self._bags[bag_name] = bag
+        return bag
+
+    def _create(self, bag_name, titles):
+        bag = BagTitles(titles)
+        if self.root is not None and titles is not None:
+            self._rewrite(bag_name, titles)
+            bag = self._read(bag_name, None)
+        self._bags[bag_name] = bag
+        return bag
+
+    def _change(self, bag_name, title, op):
+        with self._lock:
+            bag = self._current(bag_name, check=True)
+            if bag is None:
+                if bag_name in self._listing:
+                    self._listing[bag_name][1].append((op, title))
+                # otherwise listed when it is needed
+                return
+            self._apply(bag_name, bag, op, title)
+
+    def _apply(self, bag_name, bag, op, title):
+        """
+        Add ('+') or remove ('-') title in bag, or with 'drop' remove
+        every title. Returns the bag, as read again from a log.
+        """
+        if bag is None or bag.titles is None:
+            return bag
+        if op == 'drop':
+            for title in sorted(bag.titles):
+                bag = self._apply(bag_name, bag, '-', title)
+            return bag
+        if (title in bag.titles) == (op == '+'):
+            return bag
+        if self.root is None:
+            apply_record(bag.titles, op, title)
+            bag.changes += 1
+        else:
+            self._append(bag_name, record(op, title))
+            bag = self._read(bag_name, bag)
+            if bag is not None and bag.records > COMPACT_RATIO * (
+                    len(bag.titles) + 16):
+                self._rewrite(bag_name, None)
+                bag = self._read(bag_name, None)
+            self._bags[bag_name] = bag
+        return bag
+
+    def _path(self, bag_name):
+        digest = hashlib.sha1(bag_name.encode('utf-8')).hexdigest()
+        return os.path.join(self.root, digest + '.titles')
+
+    def _read(self, bag_name, bag):
+        """
+        Bring bag up to date with the log of bag_name, reading it all
+        if bag is None or the log has been rewritten. None if there is
+        no log.
+        """
+        path = self._path(bag_name)
+        try:
+            log = open(path, 'rb')
+        except IOError:
+            return None
+        with log:
+            inode = os.fstat(log.fileno()).st_ino
+            if bag is None or bag.inode != inode:
+                bag = BagTitles(set())
+                bag.inode = inode
+            log.seek(bag.offset)
+            data = log.read()
+        bag.checked = clock()
+        # a record still being written is read next time
+        end = data.rfind(b'\n') + 1
+        for line in data[:end].splitlines():
+            if line.startswith(b'#'):
+                bag.generation = line[1:].decode('ascii')
+                continue
+            apply_record(bag.titles, *parse_record(line))
+            bag.records += 1
+        bag.offset += end
+        return bag
+
+    def _append(self, bag_name, line):
+        path = self._path(bag_name)
+        while True:
+            with open(path, 'ab') as log:
+                locked(log)
+                # a rewrite may have replaced the file meanwhile
+                try:
+                    current = os.stat(path).st_ino
+                except OSError:
+                    return
+                if current == os.fstat(log.fileno()).st_ino:
+                    log.write(line)
+                    return
+
+    def _rewrite(self, bag_name, titles):
+        """
+        Replace the log of bag_name with a new generation and a record
+        per title, reading the titles from the log if titles is None.
+        """
+        path = self._path(bag_name)
+        temporary = '%s.%s.%s' % (path, os.getpid(),
+                threading.current_thread().ident)
+        with open(path, 'ab') as log:
+            locked(log)
+            if titles is None:
+                titles = self._read(bag_name, None).titles
+            with open(temporary, 'wb') as new_log:
+                new_log.write(('#%s\n' % uuid.uuid4().hex).encode('ascii'))
+                for title in sorted(titles):
+                    new_log.write(record('+', title))
+            os.rename(temporary, path)
+
+
+def record(op, title):
+    return (op + json.dumps(title) + '\n').encode('utf-8')
+
+
+def parse_record(line):
+    line = line.decode('utf-8')
+    return line[0], json.loads(line[1:])
+
+
+def apply_record(titles, op, title):
+    if op == '+':
+        titles.add(title)
+    else:
+        titles.discard(title)
+
+
+def locked(log):
+    """
+    Hold an exclusive lock on the open file log until it is closed.
+    """
+    if fcntl is not None:
+        fcntl.flock(log.fileno(), fcntl.LOCK_EX)
+
+
+def list_titles(store, bag_name):
+    """
+    The set of titles in the bag called bag_name, or None for a special
+    bag.
+    """
+    from tiddlyweb.model.bag import Bag
+    from tiddlyweb.specialbag import get_bag_retriever
+    from tiddlyweb.store import NoBagError
+    if get_bag_retriever(store.environ, bag_name):
+        return None
+    try:
+        return set(tiddler.title for tiddler in
+                store.list_bag_tiddlers(Bag(bag_name)))
+    except NoBagError:
+        return set()
+
+
+def title_index(environ):
+    """
+    The configured TitleIndex and the store, or (None, None).
+    """
+    store = environ.get('tiddlyweb.store')
+    index = environ.get('tiddlyweb.config', {}).get(INDEX_KEY)
+    if store is None or index is None:
+        return None, None
+    return index, store
+
+
+def context_bags(environ, tiddler):
+    """
+    The names of the bags links from tiddler are to tiddlers in, or
+    None if that cannot be told.
+    """
+    if tiddler is None:
+        return None
+    if tiddler.recipe:
+        # imported here as transclusion imports links, which imports this
+        from tiddlyweb.control import recipe_template
+        from tiddlyweb.store import StoreError
+        from .transclusion import resolution_cache
+        try:
+            recipe = resolution_cache(environ).get_recipe(tiddler.recipe)
+        except StoreError:
+            return None
+        return [bag for bag, _ in
+                recipe.get_recipe(recipe_template(environ))]
+    if tiddler.bag:
+        return [tiddler.bag]
+    return None
+
+
+def missing(environ, tiddler, title):
+    """
+    Whether there is no tiddler titled title where links from tiddler
+    lead, as far as the index knows.
+    """
+    index, store = title_index(environ)
+    if index is None:
+        return False
+    bags = context_bags(environ, tiddler)
+    if bags is None:
+        return False
+    return not any(index.contains(store, bag, title) for bag in bags)
+
+
+def versions(environ, tiddler):
+    """
+    The versions of the titles in the bags links from tiddler lead to,
+    as a string, or '' if links are not checked.
+    """
+    index, store = title_index(environ)
+    if index is None:
+        return ''
+    bags = context_bags(environ, tiddler)
+    if bags is None:
+        return ''
+    return '\0'.join('%s\0%s' % (bag, index.version(store, bag))
+            for bag in bags)
+
+
+def hooked_index(store):
+    return store.environ.get('tiddlyweb.config', {}).get(INDEX_KEY)
+
+
+def tiddler_put_hook(store, tiddler):
+    index = hooked_index(store)
+    if index is not None:
+        index.add(tiddler.bag, tiddler.title)
+
+
+def tiddler_delete_hook(store, tiddler):
+    index = hooked_index(store)
+    if index is not None:
+        index.discard(tiddler.bag, tiddler.title)
+
+
+def bag_delete_hook(store, bag):
+    index = hooked_index(store)
+    if index is not None:
+        index.drop(bag.name)
+
+
+def init(config):
+    """
+    Register the store hooks which keep the index up to date.
+    """
+    from tiddlyweb.store import HOOKS
+    for entity, action, hook in [
+            ('tiddler', 'put', tiddler_put_hook),
+            ('tiddler', 'delete', tiddler_delete_hook),
+            ('bag', 'delete', bag_delete_hook)]:
+        if hook not in HOOKS[entity][action]:
+            HOOKS[entity][action].append(hook)
@@ -2,14 +2,18 @@
 Unworking stub for doing transclusion in markdown.
 """
 
-import re
+import os
+import threading
+
+from multiprocessing.pool import ThreadPool
 
 from markdown.postprocessors import Postprocessor
 from markdown.extensions import Extension
 
 from tiddlyweb.control import determine_bag_from_recipe
 from tiddlyweb.util import renderable
-from tiddlyweb.store import StoreError
+from tiddlyweb.specialbag import get_bag_retriever
+from tiddlyweb.store import StoreError, NoTiddlerError, HOOKS
 from tiddlyweb.model.bag import Bag
 from tiddlyweb.model.policy import PermissionsError
 from tiddlyweb.model.recipe import Recipe
@@ -17,12 +21,100 @@ from tiddlyweb.model.tiddler import Tiddler
 from tiddlyweb.web.util import tiddler_url, encode_name
 from tiddlyweb.wikitext import render_wikitext
 
-from .links import FREELINKRAW
+from .backlinks import note_transclusion
+from .dependencies import (STACK_KEY, Dependencies, recording,
+        note_tiddler, note_resolution, note_recipe, note_bag, fingerprint)
+from .limits import LimitExceeded, current_budget
+from .links import engine_environ
+from .memo import tiddler_link
+from .patterns import compiled
+from .profile import STACK_KEY as PROFILE_STACK_KEY, timing
+from .syntax import FREELINKRAW
+from .titles import versions
 
 
 TRANSCLUDE_RE = (r'<p>{{([^}]+)}}(?:@(?:' + FREELINKRAW +
     r'|([0-9A-Za-z][0-9A-Za-z\-_]*[0-9A-Za-z])))?</p>')
 
+RESOLUTION_KEY = 'markdown.resolution_cache'
+BRANCH_KEY = 'markdown.transclusion_branch'
+
+# ThreadPools by (pid, workers): a pool made before a fork has no
+# threads in the child
+THREAD_POOLS = {}
+THREAD_POOLS_LOCK = threading.Lock()
+
+
+class ResolutionCache(object):
+    """
+    Memo of the recipe and bag reads, policy checks and recipe
+    title to bag resolutions made while transcluding, so that many
+    transclusions from the same recipe cost one of each. Failures
+    are remembered too.
+
+    It lives in the WSGI environ for the length of a request and is
+    shared by nested renders; see resolution_cache().
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.recipes = {}
+        self.bags = {}
+        self.permissions = {}
+        self.locations = {}
+
+    def get_recipe(self, name):
+        return self._remember(self.recipes, name,
+                lambda: self.store.get(Recipe(name)))
+
+    def get_bag(self, name):
+        return self._remember(self.bags, name,
+                lambda: self.store.get(Bag(name)))
+
+    def allows(self, entity, usersign, constraint):
+        """
+        Check constraint on the policy of entity (a recipe or bag)
+        for usersign. Raises PermissionsError.
+        """
+        key = (entity.__class__.__name__, entity.name, constraint,
+                usersign.get('name'), tuple(usersign.get('roles', [])))
+        return self._remember(self.permissions, key,
+                lambda: entity.policy.allows(usersign, constraint))
+
+    def bag_name_for(self, recipe, tiddler, environ):
+        """
+        The name of the bag in recipe which holds tiddler.
+        """
+        return self._remember(self.locations, (recipe.name, tiddler.title),
+                lambda: determine_bag_from_recipe(recipe, tiddler,
+                    environ).name)
+
+    def _remember(self, memo, key, action):
+        try:
+            result, error = memo[key]
+        except KeyError:
+            try:
+                result, error = action(), None
+            except (StoreError, PermissionsError) as exc:
+                result, error = None, exc
+            memo[key] = (result, error)
+        if error is not None:
+            raise error
+        return result
+
+
+def resolution_cache(environ):
+    """
+    Return the ResolutionCache for the current request, creating
+    it if need be.
+    """
+    store = environ['tiddlyweb.store']
+    cache = environ.get(RESOLUTION_KEY)
+    if cache is None or cache.store is not store:
+        cache = ResolutionCache(store)
+        environ[RESOLUTION_KEY] = cache
+    return cache
+
 
 def get_bag_from_recipe(environ, recipe_name, tiddler):
     """
@@ -30,15 +122,106 @@ def get_bag_from_recipe(environ, recipe_name, tiddler):
     ought to come from, and check that bag's policy too.
     Raises StoreError and PermissionsError.
     """
-    store = environ['tiddlyweb.store']
-    recipe = store.get(Recipe(recipe_name))
-    recipe.policy.allows(environ['tiddlyweb.usersign'], 'read')
-    bag = determine_bag_from_recipe(recipe, tiddler, environ)
-    bag = store.get(Bag(bag.name))
-    bag.policy.allows(environ['tiddlyweb.usersign'], 'read')
+    resolver = resolution_cache(environ)
+    usersign = environ['tiddlyweb.usersign']
+    try:
+        recipe = resolver.get_recipe(recipe_name)
+    except StoreError:
+        note_recipe(environ, recipe_name, None)
+        raise
+    note_recipe(environ, recipe_name, recipe)
+    resolver.allows(recipe, usersign, 'read')
+    bag_name = resolver.bag_name_for(recipe, tiddler, environ)
+    try:
+        bag = resolver.get_bag(bag_name)
+    except StoreError:
+        note_bag(environ, bag_name, None)
+        raise
+    note_bag(environ, bag_name, bag)
+    resolver.allows(bag, usersign, 'read')
     return bag
 
 
+def resolve_interior(environ, tiddler, target, title):
+    """
+    Create a Tiddler for title, transcluded into tiddler, with the
+    bag it is to be loaded from: via target if one is given,
+    otherwise from tiddler's recipe or bag.
+    Raises StoreError, KeyError and PermissionsError.
+    """
+    interior_tiddler = Tiddler(title)
+    if target:
+        tiddlywebconfig = environ['tiddlyweb.config']
+        target_resolver = tiddlywebconfig.get('markdown.target_resolver')
+        if not target_resolver:
+            interior_tiddler.bag = 'NoSuchBag'
+        else:
+            target_resolver(environ, target, interior_tiddler)
+    else:
+        if tiddler.recipe:
+            interior_bag = get_bag_from_recipe(environ,
+                    tiddler.recipe, interior_tiddler)
+            interior_tiddler.bag = interior_bag.name
+        else:
+            interior_tiddler.bag = tiddler.bag
+    return interior_tiddler
+
+
+def current_dependencies(environ, dependencies):
+    """
+    Check that the recipes, bags, title resolutions and tiddlers
+    recorded in dependencies are unchanged in the store, and the
+    titles links were checked against in the title index.
+    """
+    store = environ.get('tiddlyweb.store')
+    if not store:
+        return not dependencies
+    resolver = resolution_cache(environ)
+
+    for name, recorded in dependencies.recipes.items():
+        try:
+            found = fingerprint(resolver.get_recipe(name))
+        except StoreError:
+            found = None
+        if found != recorded:
+            return False
+
+    for name, recorded in dependencies.bags.items():
+        try:
+            found = fingerprint(resolver.get_bag(name))
+        except StoreError:
+            found = None
+        if found != recorded:
+            return False
+
+    for (target, recipe, bag, title), recorded in \
+            dependencies.resolutions.items():
+        context = Tiddler(title, bag or None)
+        context.recipe = recipe or None
+        try:
+            found = resolve_interior(environ, context, target, title).bag
+        except (StoreError, KeyError, PermissionsError):
+            found = None
+        if found != recorded:
+            return False
+
+    for (bag, title), recorded in dependencies.tiddlers.items():
+        try:
+            found = store.get(Tiddler(title, bag)).revision
+        except (StoreError, KeyError, PermissionsError):
+            found = None
+        if found != recorded:
+            return False
+
+    for (recipe, bag), recorded in dependencies.links.items():
+        context = Tiddler('', bag or None)
+        context.recipe = recipe or None
+        if versions(environ, context) != recorded:
+            return False
+
+    return True
+
+
 # XXX: This should be moved to the tiddlyspace code repo at some
 # point.
 def tiddlyspace_target_resolver(environ, space, interior_tiddler):
@@ -53,83 +236,420 @@ def tiddlyspace_target_resolver(environ, space, interior_tiddler):
     interior_tiddler.recipe = space_recipe
 
 
+def thread_pool(workers):
+    """
+    The process wide ThreadPool with workers threads, made in this
+    process rather than inherited through a fork.
+    """
+    key = (os.getpid(), workers)
+    with THREAD_POOLS_LOCK:
+        if key not in THREAD_POOLS:
+            THREAD_POOLS[key] = ThreadPool(workers)
+        return THREAD_POOLS[key]
+
+
+def semaphore(tiddler):
+    """
+    The name by which tiddler is known to cycle detection.
+    """
+    return '%s:%s' % (tiddler.bag, tiddler.title)
+
+
+def transclusion_request(match):
+    """
+    The (title, target) a transclusion match asks for.
+    """
+    try:
+        target = match.group(2) or match.group(3)
+    except IndexError:
+        target = None
+    return match.group(1), target
+
+
+def load_tiddlers(store, tiddlers):
+    """
+    Load tiddlers, which have title and bag set, from store. Returns
+    a dict of (bag, title) to the loaded tiddler or the exception
+    raised trying to load it.
+
+    If the storage implements tiddlers_get, it is called once with
+    a list of tiddlers (none in special bags) and should return the
+    loaded tiddlers, leaving out any that do not exist. Otherwise
+    tiddlers are got one at a time.
+    """
+    loaded = {}
+    remaining = list(tiddlers)
+
+    bulk_get = getattr(store.storage, 'tiddlers_get', None)
+    if bulk_get is not None:
+        plain = []
+        special = []
+        for tiddler in remaining:
+            if get_bag_retriever(store.environ, tiddler.bag):
+                special.append(tiddler)
+            else:
+                plain.append(tiddler)
+        remaining = special
+        if plain:
+            for tiddler in bulk_get(plain):
+                # as store.get would
+                tiddler.store = store
+                for hook in HOOKS['tiddler']['get']:
+                    hook(store, tiddler)
+                loaded[(tiddler.bag, tiddler.title)] = tiddler
+            for tiddler in plain:
+                if (tiddler.bag, tiddler.title) not in loaded:
+                    loaded[(tiddler.bag, tiddler.title)] = NoTiddlerError(
+                            '%s not in %s' % (tiddler.title, tiddler.bag))
+
+    for tiddler in remaining:
+        try:
+            loaded[(tiddler.bag, tiddler.title)] = store.get(tiddler)
+        except (StoreError, KeyError, PermissionsError) as exc:
+            loaded[(tiddler.bag, tiddler.title)] = exc
+    return loaded
+
+
 class TranscludeProcessor(Postprocessor):
 
     def __init__(self, pattern, config):
         Postprocessor.__init__(self)
         self.pattern = pattern
-        self.environ = config['environ']
-        self.tiddler = config['tiddler']
-        self.store = self.environ.get('tiddlyweb.store')
+        self.expression = compiled(pattern)
+        self.config = config
 
-    def transcluder(self, match):
-        if 'markdown.transclusions' in self.environ:
-            seen_titles = self.environ['markdown.transclusions']
-        else:
-            seen_titles = []
+    @property
+    def environ(self):
+        return engine_environ(self.md, self.config)
 
-        interior_title = match.group(1)
-        try:
-            target = match.group(2) or match.group(3)
-        except IndexError:
-            target = None
+    @property
+    def tiddler(self):
+        tiddler = getattr(self.md, 'tiddler', None)
+        if tiddler is None:
+            tiddler = self.config['tiddler']
+        return tiddler
+
+    @property
+    def store(self):
+        return self.environ.get('tiddlyweb.store')
 
+    def transcluder(self, match):
+        """
+        Replace one transclusion match.
+        """
         # bail out if we have no store
         if not self.store:
             return match.group(0)
+        request = transclusion_request(match)
+        interior_tiddler = self.resolve_all([request])[request]
+        if interior_tiddler is not None:
+            interior_tiddler = self.load_all([interior_tiddler])[
+                    (interior_tiddler.bag, interior_tiddler.title)]
+        return self.transclude(match, interior_tiddler, {})
 
-        try:
-            interior_tiddler = self.resolve_tiddler(target, interior_title)
-            interior_tiddler = self.store.get(interior_tiddler)
-        except (StoreError, KeyError, PermissionsError):
+    def resolve_all(self, requests):
+        """
+        Determine the bag for each (title, target) in requests. Returns
+        a dict of request to Tiddler (not yet loaded), or None if the
+        tiddler cannot be resolved.
+        """
+        resolved = {}
+        for request in requests:
+            interior_title, target = request
+            try:
+                interior_tiddler = self.resolve_tiddler(target,
+                        interior_title)
+            except (StoreError, KeyError, PermissionsError):
+                note_resolution(self.environ, target, self.tiddler,
+                        interior_title, None)
+                resolved[request] = None
+                continue
+            note_resolution(self.environ, target, self.tiddler,
+                    interior_title, interior_tiddler.bag)
+            resolved[request] = interior_tiddler
+        return resolved
+
+    def load_all(self, tiddlers):
+        """
+        Load resolved tiddlers from the store, in bulk where it can.
+        Returns a dict of (bag, title) to the loaded tiddler, or None
+        if it could not be loaded.
+        """
+        return self.loaded(load_tiddlers(self.store, tiddlers))
+
+    def loaded(self, results):
+        """
+        Note the results of load_tiddlers as dependencies, replacing
+        exceptions with None.
+        """
+        loaded = {}
+        for (bag, title), interior_tiddler in results.items():
+            if isinstance(interior_tiddler, Exception):
+                note_tiddler(self.environ, bag, title, None)
+                loaded[(bag, title)] = None
+            else:
+                note_tiddler(self.environ, bag, title,
+                        interior_tiddler.revision)
+                loaded[(bag, title)] = interior_tiddler
+        return loaded
+
+    def transclude(self, match, interior_tiddler, rendered):
+        """
+        Return the article wrapping the rendered interior_tiddler, or
+        the original text of match if it cannot or must not (because
+        that would recurse or go over a limit) be transcluded.
+        rendered remembers the articles already made during this run,
+        or None for those over a limit.
+        """
+        if interior_tiddler is None:
             return match.group(0)
 
-        semaphore_title = '%s:%s' % (interior_tiddler.bag,
-                interior_tiddler.title)
+        semaphore_title = semaphore(interior_tiddler)
+        if semaphore_title in rendered:
+            return rendered[semaphore_title] or match.group(0)
+
+        if 'markdown.transclusions' in self.environ:
+            seen_titles = self.environ['markdown.transclusions']
+        else:
+            seen_titles = []
 
         if semaphore_title not in seen_titles:
+            if not self.admit(interior_tiddler, seen_titles):
+                rendered[semaphore_title] = None
+                return match.group(0)
             seen_titles.append(semaphore_title)
             self.environ['markdown.transclusions'] = seen_titles
-            if renderable(interior_tiddler, self.environ):
-                content = render_wikitext(interior_tiddler, self.environ)
-            else:
-                content = ''
-            seen_titles.pop()
-            return '<article id="%s" class="transclusion" data-uri="%s" ' \
-                    'data-title="%s" data-bag="%s">%s</article>' % (
-                            self._make_id(interior_tiddler),
-                            self.interior_url(interior_tiddler),
-                            interior_tiddler.title,
-                            interior_tiddler.bag, content)
+            try:
+                article = self.article(interior_tiddler, self.environ)
+            finally:
+                seen_titles.pop()
+            rendered[semaphore_title] = article
+            return article
         else:
             return match.group(0)
 
-    def resolve_tiddler(self, target, title):
-        interior_tiddler = Tiddler(title)
-        if target:
-            tiddlywebconfig = self.environ['tiddlyweb.config']
-            target_resolver = tiddlywebconfig.get('markdown.target_resolver')
-            if not target_resolver:
-                interior_tiddler.bag = 'NoSuchBag'
-            else:
-                target_resolver(self.environ, target, interior_tiddler)
+    def admit(self, interior_tiddler, seen_titles, note=True):
+        """
+        Whether interior_tiddler, transcluded within seen_titles, fits
+        in the budget of the current render, counting it if so. If not
+        and note is true, record the limit it would go over.
+        """
+        budget = current_budget(self.environ)
+        if budget is None:
+            return True
+        try:
+            budget.admit(interior_tiddler, len(seen_titles) + 1)
+        except LimitExceeded as exc:
+            if exc.limit == 'max_render_time':
+                raise
+            if note:
+                budget.note(exc)
+            return False
+        return True
+
+    def article(self, interior_tiddler, environ):
+        """
+        Render interior_tiddler in environ and wrap it in an article.
+        """
+        if renderable(interior_tiddler, environ):
+            content = render_wikitext(interior_tiddler, environ)
         else:
-            if self.tiddler.recipe:
-                interior_bag = get_bag_from_recipe(self.environ,
-                        self.tiddler.recipe, interior_tiddler)
-                interior_tiddler.bag = interior_bag.name
+            content = ''
+        return self.wrap(interior_tiddler, content)
+
+    def wrap(self, interior_tiddler, content):
+        """
+        Wrap the rendered content of interior_tiddler in an article.
+        """
+        return '%s%s</article>' % (self.opening(interior_tiddler), content)
+
+    def opening(self, interior_tiddler):
+        """
+        The start tag of the article for interior_tiddler.
+        """
+        return '<article id="%s" class="transclusion" ' \
+                'data-uri="%s" data-title="%s" data-bag="%s">' % (
+                        self._make_id(interior_tiddler),
+                        self.interior_url(interior_tiddler),
+                        interior_tiddler.title,
+                        interior_tiddler.bag)
+
+    def branches(self, interior_tiddlers):
+        """
+        Pair each of interior_tiddlers which may be transcluded here
+        (without recursing) with a copy of the environ to render it
+        in, separately from the others.
+
+        Each copy has a cycle detection stack, dependency record and
+        profile stack of its own; the resolution cache and budget are
+        shared. Tiddlers over a limit are left to transclude() to
+        record. Fold the articles rendered back in with merge().
+
+        interior_tiddlers must be in document order, the order in which
+        transclude() would admit them. With max_transcluded_bytes the
+        serial render also admits the tiddlers transcluded by each
+        before the next, so the branches stop at the first tiddler
+        which may transclude. Returns the branches and the tiddlers
+        after them, for branches to be called with again once those
+        are rendered.
+        """
+        seen_titles = self.environ.get('markdown.transclusions', [])
+        resolution_cache(self.environ)
+        budget = current_budget(self.environ)
+        counting = (budget is not None
+                and budget.max_transcluded_bytes is not None)
+        branches = []
+        for index, interior_tiddler in enumerate(interior_tiddlers):
+            semaphore_title = semaphore(interior_tiddler)
+            if semaphore_title in seen_titles:
+                continue
+            if not self.admit(interior_tiddler, seen_titles, note=False):
+                continue
+            environ = dict(self.environ)
+            environ['markdown.transclusions'] = seen_titles + [
+                    semaphore_title]
+            environ[STACK_KEY] = [Dependencies()]
+            if PROFILE_STACK_KEY in environ:
+                environ[PROFILE_STACK_KEY] = list(environ[PROFILE_STACK_KEY])
+            branches.append((interior_tiddler, environ))
+            if counting and '{{' in (interior_tiddler.text or ''):
+                return branches, interior_tiddlers[index + 1:]
+        return branches, []
+
+    def merge(self, branches, articles, rendered):
+        """
+        Put the articles rendered for branches in rendered and record
+        their dependencies, in order.
+        """
+        dependencies = recording(self.environ)
+        for (interior_tiddler, environ), article in zip(branches, articles):
+            rendered[semaphore(interior_tiddler)] = article
+            if dependencies is not None:
+                dependencies.update(environ[STACK_KEY][0])
+
+    def render_concurrently(self, interior_tiddlers, rendered):
+        """
+        If markdown.transclusion_workers is more than one, render the
+        articles for interior_tiddlers on a thread pool and put them
+        in rendered.
+
+        Transclusions within branches are rendered serially, so at
+        most that many threads work on one top level render.
+        """
+        tiddlywebconfig = self.environ.get('tiddlyweb.config', {})
+        workers = tiddlywebconfig.get('markdown.transclusion_workers', 0)
+        if not workers or workers < 2 or BRANCH_KEY in self.environ:
+            return
+
+        # branches are counted against the budget, so each is rendered
+        # here, even when it is the only one
+        branches, rest = self.branches(interior_tiddlers)
+        while branches:
+            for interior_tiddler, environ in branches:
+                environ[BRANCH_KEY] = True
+            if len(branches) == 1:
+                articles = [self.article(*branches[0])]
             else:
-                interior_tiddler.bag = self.tiddler.bag
-        return interior_tiddler
+                articles = thread_pool(workers).map(
+                        lambda branch: self.article(*branch), branches)
+            self.merge(branches, articles, rendered)
+            branches, rest = self.branches(rest)
+
+    def resolve_tiddler(self, target, title):
+        return resolve_interior(self.environ, self.tiddler, target, title)
 
     def interior_url(self, tiddler):
         tiddlywebconfig = self.environ['tiddlyweb.config']
         interior_tiddler_url = tiddlywebconfig.get(
             'markdown.transclude_url', tiddler_url)
-        return interior_tiddler_url(self.environ, tiddler)
+        return tiddler_link(self.environ, interior_tiddler_url, tiddler)
 
     def run(self, text):
-        return re.sub(self.pattern, self.transcluder, text)
+        """
+        Find every transclusion in text, resolve and load all of the
+        distinct tiddlers they name in one go, then splice in the
+        rendered tiddlers.
+        """
+        # bail out if the caller will transclude, or we have no store
+        if getattr(self.md, 'defer_transclusion', False):
+            return text
+
+        matches, requests = self.collect(text)
+        if not self.store or not matches:
+            return text
+
+        profile = getattr(self.md, 'profile', None)
+        with timing(profile, 'transclusion.fetch'):
+            resolved = self.resolve_all(requests)
+            loaded = self.load_all(self.distinct(resolved))
+
+        with timing(profile, 'transclusion.render'):
+            rendered = {}
+            self.render_concurrently(self.in_order(requests, resolved,
+                loaded), rendered)
+            return self.splice(text, matches, resolved, loaded, rendered)
+
+    def collect(self, text):
+        """
+        The transclusion matches in text and the distinct requests
+        they make, noted for render_with_links.
+        """
+        matches = list(self.expression.finditer(text))
+        requests = []
+        seen = set()
+        for match in matches:
+            request = transclusion_request(match)
+            if request not in seen:
+                seen.add(request)
+                requests.append(request)
+                note_transclusion(self.environ, *request)
+        return matches, requests
+
+    def distinct(self, resolved):
+        """
+        The distinct tiddlers in the results of resolve_all.
+        """
+        interior_tiddlers = {}
+        for interior_tiddler in resolved.values():
+            if interior_tiddler is not None:
+                interior_tiddlers[(interior_tiddler.bag,
+                    interior_tiddler.title)] = interior_tiddler
+        return list(interior_tiddlers.values())
+
+    def in_order(self, requests, resolved, loaded):
+        """
+        The distinct loaded tiddlers, in the order they are first
+        transcluded in the text.
+        """
+        interior_tiddlers = []
+        seen = set()
+        for request in requests:
+            interior_tiddler = resolved[request]
+            if interior_tiddler is None:
+                continue
+            key = (interior_tiddler.bag, interior_tiddler.title)
+            if key not in seen and loaded.get(key) is not None:
+                seen.add(key)
+                interior_tiddlers.append(loaded[key])
+        return interior_tiddlers
+
+    def splice(self, text, matches, resolved, loaded, rendered):
+        """
+        Replace each of matches in text with its transclusion.
+        """
+        output = []
+        position = 0
+        for match in matches:
+            interior_tiddler = resolved[transclusion_request(match)]
+            if interior_tiddler is not None:
+                interior_tiddler = loaded[(interior_tiddler.bag,
+                    interior_tiddler.title)]
+            output.append(text[position:match.start()])
+            output.append(self.transclude(match, interior_tiddler,
+                rendered))
+            position = match.end()
+        output.append(text[position:])
+        return ''.join(output)
 
     def _make_id(self, tiddler):
         """
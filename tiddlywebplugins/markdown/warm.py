@@ -0,0 +1,169 @@
+"""
+The markdown_warm twanager command, which renders every markdown
+tiddler in a bag or recipe into the configured render cache so the
+first visitors after a deploy or cache flush do not pay for it.
+
+    twanager markdown_warm <bag|recipe> [workers]
+
+A bag is looked for first, then a recipe of the same name. Tiddlers
+in a recipe are rendered with it as their context, as they are when
+requested through it. Output is made with render_many, and so by
+render() and the usual transclusion, as the GUEST user: transcluding
+tiddlers are cached per user, so only anonymous visitors benefit from
+those.
+
+`markdown.render_cache` must be set to a cache which outlasts the
+command, such as a DiskCache. Progress is written to a checkpoint
+file (`markdown.warm_checkpoint`, by default .markdown_warm.json in the
+current directory) so an interrupted run can be resumed by running
+the same command again.
+"""
+
+import json
+import os
+import sys
+import time
+
+from tiddlyweb.control import get_tiddlers_from_recipe
+from tiddlyweb.manage import make_command, usage
+from tiddlyweb.model.bag import Bag
+from tiddlyweb.model.recipe import Recipe
+from tiddlyweb.store import Store, NoBagError
+from tiddlyweb.util import renderable
+
+from .bulk import render_many
+from .cache import MemoryCache
+from .render import MARKDOWN_RENDERER, renderer_name
+
+
+DEFAULT_CHECKPOINT = '.markdown_warm.json'
+
+# How often, in tiddlers rendered, to report and save a checkpoint.
+PROGRESS_EVERY = 100
+
+
+def init(config):
+    """
+    Establish the command during twanager startup.
+    """
+
+    @make_command()
+    def markdown_warm(args):
+        """Render the markdown tiddlers in a bag or recipe into markdown.render_cache: <bag|recipe> [workers]"""
+        try:
+            name = args[0]
+        except IndexError:
+            usage('you must include a bag or recipe name')
+        try:
+            workers = int(args[1])
+        except IndexError:
+            workers = None
+        except ValueError:
+            usage('workers must be a number')
+
+        cache = config.get('markdown.render_cache')
+        if cache is None or isinstance(cache, MemoryCache):
+            usage('markdown.render_cache must be set to a persistent cache')
+
+        store = Store(config['server_store'][0], config['server_store'][1],
+                environ={'tiddlyweb.config': config})
+        warm(store, config, name, workers)
+        return True
+
+
+def warm(store, config, name, workers=None, out=None):
+    """
+    Render the markdown tiddlers in the bag or recipe called name,
+    resuming from the checkpoint if there is one for name. Returns a
+    dict of counts and timings.
+    """
+    if out is None:
+        out = sys.stderr
+    environ = {
+        'tiddlyweb.config': config,
+        'tiddlyweb.store': store,
+        'tiddlyweb.usersign': {'name': 'GUEST', 'roles': []},
+    }
+    checkpoint = Checkpoint(config.get('markdown.warm_checkpoint',
+        DEFAULT_CHECKPOINT), name)
+
+    recipe_name, stubs = list_tiddlers(store, environ, name)
+    stubs = sorted(stubs, key=lambda tiddler: tiddler.title)
+    if checkpoint.last is not None:
+        stubs = [tiddler for tiddler in stubs
+                if tiddler.title > checkpoint.last]
+        out.write('resuming %s after %s\n' % (name, checkpoint.last))
+
+    def markdown_tiddlers():
+        for stub in stubs:
+            tiddler = store.get(stub)
+            tiddler.recipe = recipe_name
+            if (renderable(tiddler, environ) and
+                    renderer_name(tiddler, environ) == MARKDOWN_RENDERER):
+                yield tiddler
+
+    start = time.time()
+    rendered = 0
+    for tiddler, _ in render_many(markdown_tiddlers(), environ, workers):
+        rendered += 1
+        if rendered % PROGRESS_EVERY == 0:
+            checkpoint.save(tiddler.title, rendered)
+            out.write('%s: %s rendered, %.1f/s\n' % (name, rendered,
+                rendered / max(time.time() - start, 0.001)))
+    checkpoint.clear()
+
+    elapsed = time.time() - start
+    stats = {
+        'tiddlers': len(stubs),
+        'rendered': rendered,
+        'seconds': elapsed,
+        'per_second': rendered / max(elapsed, 0.001),
+    }
+    out.write('%s: %s of %s tiddlers rendered in %.1fs, %.1f/s\n' % (
+        name, rendered, len(stubs), elapsed, stats['per_second']))
+    return stats
+
+
+def list_tiddlers(store, environ, name):
+    """
+    The recipe name (or None for a bag) and unloaded tiddlers of
+    the bag or recipe called name. Raises StoreError.
+    """
+    try:
+        bag = store.get(Bag(name))
+        return None, list(store.list_bag_tiddlers(bag))
+    except NoBagError:
+        recipe = store.get(Recipe(name))
+        return name, list(get_tiddlers_from_recipe(recipe, environ))
+
+
+class Checkpoint(object):
+    """
+    The title of the last tiddler rendered for name, kept in a JSON
+    file at path.
+    """
+
+    def __init__(self, path, name):
+        self.path = path
+        self.name = name
+        self.last = None
+        try:
+            with open(path) as checkpoint_file:
+                data = json.load(checkpoint_file)
+        except (IOError, OSError, ValueError):
+            return
+        if data.get('name') == name:
+            self.last = data.get('last')
+
+    def save(self, title, rendered):
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as checkpoint_file:
+            json.dump({'name': self.name, 'last': title,
+                'rendered': rendered}, checkpoint_file)
+        os.rename(temp_path, self.path)
+
+    def clear(self):
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
@@ -0,0 +1,93 @@
+"""
+Get rendering up to speed before the first request.
+
+The first render in a process imports Python-Markdown and the
+extensions (see render.preload), builds an engine and compiles the
+patterns of every extension. warmup(config) does all of that up
+front, from tiddlywebconfig.py or the post-fork hook of a server:
+
+    from tiddlywebplugins.markdown import warmup
+    warmup(config, engines=2, corpus=True)
+
+It builds engines idle in the pool for the settings in config, and
+for another `markdown.backend` the backend's parser and post-pass.
+With corpus it also renders the small CORPUS of texts covering the
+syntax the plugin handles, so that the code for each has run once.
+Those renders use neither the render nor the block cache, and do not
+call a `markdown.profile` function.
+
+Setting `markdown.warmup` in config to True, or to 'corpus' to render
+the corpus too, has init() call warmup when the plugin is loaded.
+
+Engines are built in the calling thread and no threads are started,
+so warming up before a server forks is safe: each worker starts with
+a copy of the warm pool.
+"""
+
+import time
+
+from .render import ENGINES, EngineSettings, preload, render
+
+
+CORPUS = [
+    u'Some plain prose, with nothing in it but words.\n\n'
+    u'And a second paragraph.',
+    u'# A Heading\n\nText with *emphasis*, **strong** and `code`, a '
+    u'[link](http://example.com/) and a bare http://example.com/ URL.',
+    u'* one\n* two\n    1. nested\n\n> quoted\n\n---\n\n    indented code',
+    u'```\nfenced code\n```\n\nTerm\n:   definition\n\n'
+    u'A footnote[^note].\n\n[^note]: The note.',
+    u'WikiLink, ~NotLink, [[free link]], [[label|free link]], '
+    u'FarLink@place, [[far link]]@[[some place]] and @place.',
+    u'Transcluded:\n\n{{Some Tiddler}}\n\n{{Other}}@place',
+    u'<b>HTML</b> &amp; &copy; < > [reference][1]\n\n'
+    u'[1]: http://example.com/',
+]
+
+
+def warmup(config, engines=1, corpus=False):
+    """
+    Import, build and compile what rendering with config needs, with
+    engines engines idle in the pool, and if corpus is true render
+    the CORPUS. Returns a dict of what was done and how long it took.
+    """
+    start = time.time()
+    preload(config)
+    settings = EngineSettings(config)
+    built = 0
+    if settings.backend is None:
+        # acquired together, so that each is a new engine
+        acquired = [ENGINES.acquire(settings) for _ in range(engines)]
+        for engine in acquired:
+            ENGINES.release(settings, engine)
+        built = len(acquired)
+    else:
+        from .postpass import PostPass
+        settings.backend.parser()
+        PostPass(settings)
+
+    rendered = 0
+    if corpus:
+        from tiddlyweb.model.tiddler import Tiddler
+        environ = {'tiddlyweb.config': corpus_config(config)}
+        for index, text in enumerate(CORPUS):
+            tiddler = Tiddler(u'warmup%s' % index)
+            tiddler.text = text
+            render(tiddler, environ)
+            rendered += 1
+
+    return {'engines': built, 'idle': ENGINES.idle_count(settings),
+            'rendered': rendered, 'seconds': time.time() - start}
+
+
+def corpus_config(config):
+    """
+    config for rendering the corpus, with the same engine settings but
+    without caches or a profile callback.
+    """
+    corpus_config = dict(config)
+    for key in ['markdown.render_cache', 'markdown.block_cache']:
+        corpus_config.pop(key, None)
+    if corpus_config.get('markdown.profile'):
+        corpus_config['markdown.profile'] = True
+    return corpus_config